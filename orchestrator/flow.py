@@ -1,8 +1,14 @@
 # orchestrator/flow.py
 
 import logging
+import os
 import subprocess
+from typing import Optional
+
 from prefect import flow, task, get_run_logger
+from prefect.runtime import task_run
+
+from training.distributed import launch_command
 
 # Configure root logger
 logging.basicConfig(
@@ -13,16 +19,22 @@ logger = logging.getLogger("orchestrator")
 
 
 @task(retries=3, retry_delay_seconds=120)
-def train_task():
+def train_task(nproc: int = 1):
     """
-    Task: Invoke the training script.
-    Retries up to 3 times on failure, waiting 2 minutes between attempts.
+    Task: Invoke the training script, as ``nproc`` data-parallel CPU ranks
+    (torchrun, gloo) when ``nproc > 1``.
+    Retries up to 3 times on failure, waiting 2 minutes between attempts;
+    a retry resumes from the latest complete checkpoint of the failed attempt.
     """
     task_logger = get_run_logger()
-    task_logger.info("Starting Granite LLM training…")
+    task_logger.info(f"Starting Granite LLM training on {nproc} rank(s)…")
+    args = []
+    if task_run.run_count > 1:
+        task_logger.info(f"Attempt {task_run.run_count}: resuming from the latest checkpoint")
+        args = ["--resume_from_checkpoint", "latest"]
     # Launch the training module
     result = subprocess.run(
-        ["python", "-m", "training.train"],
+        launch_command(nproc, args=args),
         check=False,
         capture_output=True,
         text=True
@@ -35,11 +47,13 @@ def train_task():
 
 
 @flow(name="FluxPilot_Granite_Pipeline")
-def fluxpilot_flow():
+def fluxpilot_flow(nproc: Optional[int] = None):
     """
     Prefect flow: orchestrates the entire pipeline.
+    ``nproc`` defaults to TRAIN_NPROC_PER_NODE (1); size it with
+    ``python -m training.bench_scaling``.
     """
-    train_task()
+    train_task(nproc or int(os.getenv("TRAIN_NPROC_PER_NODE", 1)))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,387 @@
+# serving/admission.py
+
+import asyncio
+import contextlib
+import hashlib
+import heapq
+import itertools
+import logging
+import math
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from serving.executor import QueueFullError
+from serving.metrics import (
+    ADMISSION_QUEUE_DEPTH,
+    ADMISSION_QUEUE_WAIT,
+    ADMISSION_REJECTED,
+    ADMISSION_TOKENS_IN_FLIGHT,
+)
+
+logger = logging.getLogger("serve.admission")
+
+# Highest first; a waiting request is never overtaken by a lower class
+PRIORITIES = ("high", "normal", "low")
+
+# Idle per-key buckets are dropped once there are this many
+_MAX_BUCKETS = 10000
+# Weight of the newest request in the seconds-per-token estimate
+_EWMA_ALPHA = 0.2
+
+
+def estimate_cost(prompt_tokens: int, max_new_tokens: int) -> int:
+    """
+    Token cost charged for a generation: the prompt is prefilled and up to
+    ``max_new_tokens`` are decoded, so a request is charged for both.
+    """
+    return prompt_tokens + max_new_tokens
+
+
+class AdmissionError(Exception):
+    """
+    Base class for requests refused by admission control.
+    """
+
+
+class RateLimitedError(AdmissionError):
+    """
+    The API key's token bucket cannot cover the request yet.
+    """
+
+    def __init__(self, retry_after: float):
+        super().__init__("Token rate limit exceeded for this API key")
+        self.retry_after = retry_after
+
+
+class RequestTooLargeError(AdmissionError):
+    """
+    The request costs more tokens than a key's bucket can ever hold.
+    """
+
+    def __init__(self, cost: int, limit: int):
+        super().__init__(f"Request costs {cost} tokens, the per-key limit is {limit}")
+        self.cost = cost
+        self.limit = limit
+
+
+class DeadlineExceededError(AdmissionError):
+    """
+    The request cannot finish before its deadline and was shed.
+    """
+
+    def __init__(self):
+        super().__init__("Request cannot complete before its deadline")
+
+
+class TokenBucket:
+    """
+    Holds up to ``burst`` tokens, refilled at ``rate`` tokens per second.
+    """
+
+    def __init__(self, rate: float, burst: float, now: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, cost: float, now: float) -> float:
+        """
+        Take ``cost`` tokens and return 0, or take nothing and return the
+        seconds until the bucket would cover ``cost``.
+        """
+        self._refill(now)
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def refund(self, cost: float):
+        self.tokens = min(self.burst, self.tokens + cost)
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+@dataclass
+class Ticket:
+    """
+    An admitted request's share of the token budget; hand it back with
+    ``AdmissionController.release``.
+    """
+
+    cost: int
+    priority: str
+    bucket: Optional[TokenBucket] = None
+    admitted_at: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class _Waiter:
+    ticket: Ticket
+    deadline: Optional[float]
+    future: asyncio.Future
+    enqueued_at: float
+    removed: bool = False
+
+
+class AdmissionController:
+    """
+    Admission in front of generation, measured in estimated tokens.
+
+    - Each API key has a token bucket (``rate_tokens_per_second``, up to
+      ``burst_tokens``); a request its bucket cannot cover gets
+      ``RateLimitedError`` with the time until it could.
+    - At most ``max_tokens_in_flight`` estimated tokens are admitted at once
+      (0 = unbounded). Requests that don't fit wait in priority order, then
+      by earliest deadline; a request larger than the whole budget runs
+      alone. At most ``max_queue_size`` requests wait.
+    - Requests with a deadline are shed with ``DeadlineExceededError`` as
+      soon as their expected completion time (queue wait plus service time,
+      from a moving average of seconds per token) falls after it, on arrival
+      or while waiting, rather than after using up capacity.
+
+    All methods must be called from the event loop thread.
+    """
+
+    def __init__(
+        self,
+        max_tokens_in_flight: int = 0,
+        rate_tokens_per_second: float = 0.0,
+        burst_tokens: int = 0,
+        max_queue_size: int = 64,
+        retry_after: int = 1,
+    ):
+        self.max_tokens_in_flight = max_tokens_in_flight
+        self.rate_tokens_per_second = rate_tokens_per_second
+        self.burst_tokens = burst_tokens
+        self.max_queue_size = max_queue_size
+        self.retry_after = retry_after
+
+        self.tokens_in_flight = 0
+        self.requests_in_flight = 0
+        # Moving average of wall seconds per admitted token; None until the
+        # first request completes, and nothing is shed on deadline before then
+        self.seconds_per_token: Optional[float] = None
+
+        self._buckets: Dict[bytes, TokenBucket] = {}
+        self._heap: List[tuple] = []
+        self._waiting = dict.fromkeys(PRIORITIES, 0)
+        self._seq = itertools.count()
+
+    # ------------------------------------------------------------- public
+
+    @contextlib.asynccontextmanager
+    async def admit(
+        self,
+        api_key: str,
+        cost: int,
+        priority: str = "normal",
+        deadline: Optional[float] = None,
+    ):
+        """
+        ``acquire`` on entry and ``release`` on exit.
+        """
+        ticket = await self.acquire(api_key, cost, priority, deadline)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    async def acquire(
+        self,
+        api_key: str,
+        cost: int,
+        priority: str = "normal",
+        deadline: Optional[float] = None,
+    ) -> Ticket:
+        """
+        Wait until the request may run and return its ticket.
+
+        Args:
+            api_key: Key the request was authenticated with.
+            cost: Estimated token cost (see ``estimate_cost``).
+            priority: One of ``PRIORITIES``.
+            deadline: ``time.monotonic()`` value by which the request must
+                have completed, or None.
+
+        Raises:
+            RateLimitedError, RequestTooLargeError, DeadlineExceededError,
+            QueueFullError: The request is refused.
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority {priority!r}, expected one of {PRIORITIES}")
+        now = time.monotonic()
+
+        if self._misses_deadline(cost, priority, deadline, now):
+            self._reject(priority, "deadline")
+            raise DeadlineExceededError()
+
+        bucket = None
+        if self.rate_tokens_per_second > 0:
+            if cost > self.burst_tokens:
+                self._reject(priority, "too_large")
+                raise RequestTooLargeError(cost, self.burst_tokens)
+            bucket = self._bucket(api_key, now)
+            wait = bucket.take(cost, now)
+            if wait > 0:
+                self._reject(priority, "rate_limited")
+                raise RateLimitedError(retry_after=wait)
+
+        ticket = Ticket(cost=cost, priority=priority, bucket=bucket)
+        if self._fits(cost) and not self._waiting_ahead(priority):
+            self._start(ticket, waited=0.0)
+            return ticket
+
+        if sum(self._waiting.values()) >= self.max_queue_size:
+            self._refund(ticket)
+            self._reject(priority, "queue_full")
+            raise QueueFullError("admission", self.retry_after)
+        return await self._wait(ticket, deadline, now)
+
+    def release(self, ticket: Ticket):
+        """
+        Return an admitted request's tokens to the budget and admit waiters.
+        """
+        self.tokens_in_flight -= ticket.cost
+        self.requests_in_flight -= 1
+        ADMISSION_TOKENS_IN_FLIGHT.set(self.tokens_in_flight)
+        if ticket.cost > 0:
+            sample = (time.monotonic() - ticket.admitted_at) / ticket.cost
+            if self.seconds_per_token is None:
+                self.seconds_per_token = sample
+            else:
+                self.seconds_per_token += _EWMA_ALPHA * (sample - self.seconds_per_token)
+        self._dispatch()
+
+    def expected_seconds(self, cost: int, priority: str) -> Optional[float]:
+        """
+        Expected time until a request of ``cost`` tokens arriving now at
+        ``priority`` would complete, or None before there is any history.
+        """
+        if self.seconds_per_token is None:
+            return None
+        service = cost * self.seconds_per_token
+        if self.max_tokens_in_flight <= 0:
+            return service
+        # Tokens that must finish before this request fits; admitted
+        # requests release their budget at about 1 / seconds_per_token
+        # tokens per second each
+        ahead = self._tokens_ahead(priority)
+        deficit = self.tokens_in_flight + ahead + cost - self.max_tokens_in_flight
+        if deficit <= 0 and not ahead:
+            return service
+        wait = max(deficit, 0) * self.seconds_per_token / max(self.requests_in_flight, 1)
+        return wait + service
+
+    # ----------------------------------------------------------- internal
+
+    def _bucket(self, api_key: str, now: float) -> TokenBucket:
+        # Keyed by digest, like the key store, so raw keys aren't retained
+        digest = hashlib.sha256(api_key.encode("utf-8")).digest()
+        bucket = self._buckets.get(digest)
+        if bucket is None:
+            if len(self._buckets) >= _MAX_BUCKETS:
+                self._buckets = {
+                    d: b for d, b in self._buckets.items() if not b.is_full(now)
+                }
+            bucket = TokenBucket(self.rate_tokens_per_second, self.burst_tokens, now)
+            self._buckets[digest] = bucket
+        return bucket
+
+    def _fits(self, cost: int) -> bool:
+        if self.max_tokens_in_flight <= 0 or self.requests_in_flight == 0:
+            return True
+        return self.tokens_in_flight + cost <= self.max_tokens_in_flight
+
+    def _waiting_ahead(self, priority: str) -> bool:
+        rank = PRIORITIES.index(priority)
+        return any(self._waiting[p] for p in PRIORITIES[:rank + 1])
+
+    def _tokens_ahead(self, priority: str) -> int:
+        rank = PRIORITIES.index(priority)
+        return sum(
+            entry[-1].ticket.cost for entry in self._heap
+            if not entry[-1].removed and entry[0] <= rank
+        )
+
+    def _misses_deadline(self, cost, priority, deadline, now) -> bool:
+        if deadline is None:
+            return False
+        expected = self.expected_seconds(cost, priority)
+        if expected is None:
+            return now >= deadline
+        return now + expected > deadline
+
+    def _start(self, ticket: Ticket, waited: float):
+        ticket.admitted_at = time.monotonic()
+        self.tokens_in_flight += ticket.cost
+        self.requests_in_flight += 1
+        ADMISSION_TOKENS_IN_FLIGHT.set(self.tokens_in_flight)
+        ADMISSION_QUEUE_WAIT.labels(priority=ticket.priority).observe(waited)
+
+    def _refund(self, ticket: Ticket):
+        if ticket.bucket is not None:
+            ticket.bucket.refund(ticket.cost)
+
+    def _reject(self, priority: str, reason: str):
+        ADMISSION_REJECTED.labels(priority=priority, reason=reason).inc()
+
+    def _set_waiting(self, priority: str, delta: int):
+        self._waiting[priority] += delta
+        ADMISSION_QUEUE_DEPTH.labels(priority=priority).set(self._waiting[priority])
+
+    async def _wait(self, ticket: Ticket, deadline: Optional[float], now: float) -> Ticket:
+        waiter = _Waiter(ticket, deadline, asyncio.get_running_loop().create_future(), now)
+        rank = PRIORITIES.index(ticket.priority)
+        heapq.heappush(self._heap, (
+            rank, deadline if deadline is not None else math.inf, next(self._seq), waiter
+        ))
+        self._set_waiting(ticket.priority, 1)
+
+        timeout = None
+        if deadline is not None:
+            # Give up once even an immediate start would finish too late
+            service = ticket.cost * (self.seconds_per_token or 0.0)
+            timeout = max(deadline - service - now, 0.0)
+        try:
+            return await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+        except asyncio.TimeoutError:
+            if waiter.future.done():
+                return waiter.future.result()
+            self._remove(waiter)
+            self._reject(ticket.priority, "deadline")
+            raise DeadlineExceededError()
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release(waiter.future.result())
+            else:
+                self._remove(waiter)
+            raise
+
+    def _remove(self, waiter: _Waiter):
+        waiter.removed = True
+        waiter.future.cancel()
+        self._set_waiting(waiter.ticket.priority, -1)
+        self._refund(waiter.ticket)
+        # The removed request may have been blocking smaller ones behind it
+        self._dispatch()
+
+    def _dispatch(self):
+        now = time.monotonic()
+        while self._heap:
+            waiter = self._heap[0][-1]
+            if waiter.removed:
+                heapq.heappop(self._heap)
+                continue
+            if not self._fits(waiter.ticket.cost):
+                break
+            heapq.heappop(self._heap)
+            self._set_waiting(waiter.ticket.priority, -1)
+            self._start(waiter.ticket, waited=now - waiter.enqueued_at)
+            waiter.future.set_result(waiter.ticket)
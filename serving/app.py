@@ -1,21 +1,73 @@
 # serving/app.py
+#
+# Importing this module is cheap: torch, transformers and the model itself
+# are loaded by the startup pipeline (or by preload() in the Gunicorn
+# master), while /healthz already answers. /ready turns 200 once the model is
+# loaded and warmed up.
 
 import os
+import math
+import time
+import asyncio
 import logging
-from fastapi import FastAPI, HTTPException
+import tempfile
+from typing import List, Literal, Optional
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse, JSONResponse
 from pydantic import BaseModel
-from transformers import AutoTokenizer, AutoModelForCausalLM
-import torch
 from fastapi import Depends
-from serving.auth import verify_api_key
-from serving.metrics import MetricsMiddleware, metrics_endpoint
-from serving.tracing import setup_tracing
+from starlette.background import BackgroundTask
+from serving import startup
+from serving.admission import (
+    AdmissionController,
+    AdmissionError,
+    RateLimitedError,
+    RequestTooLargeError,
+    estimate_cost,
+)
+from serving.auth import key_store, verify_admin_key, verify_api_key
+from serving.config import Config
+from serving.executor import InferenceExecutor, QueueFullError
+from serving.logging import (
+    RequestLogMiddleware,
+    log_fields,
+    log_stage,
+    request_fields,
+    setup_logging,
+)
+from serving.response_cache import ResponseCache, make_cache_key
+from serving.metrics import (
+    MODEL_VERSION_INFO,
+    MetricsMiddleware,
+    STARTUP_PHASE_SECONDS,
+    WORKER_STARTUP_SECONDS,
+    metrics_endpoint,
+    process_age_seconds,
+    timed,
+    track_first_token,
+)
+from serving.streaming import ClosingStreamingResponse, IncrementalDecoder, sse_event
+
+
+Priority = Literal["high", "normal", "low"]
 
 
 class GenerationRequest(BaseModel):
     prompt: str
     max_new_tokens: int = 50
     temperature: float = 1.0
+    priority: Priority = "normal"
+    # Milliseconds from arrival by which the generation must be complete
+    deadline_ms: Optional[int] = None
+
+
+class BatchGenerationRequest(BaseModel):
+    # Admitted as one unit; the items' own priority and deadline are ignored
+    requests: List[GenerationRequest]
+    priority: Priority = "low"
+    deadline_ms: Optional[int] = None
+
 
 app = FastAPI(
     title="FluxPilot Granite Inference API",
@@ -23,8 +75,6 @@ app = FastAPI(
     version="1.0.0"
 )
 
-setup_tracing(app)
-
 # Attach Prometheus metrics middleware
 app.add_middleware(MetricsMiddleware)
 
@@ -33,43 +83,527 @@ app.add_middleware(MetricsMiddleware)
 async def metrics():
     return metrics_endpoint()
 
-# Setup logging
-logging.basicConfig(level=logging.INFO)
+MODEL_DIR = os.getenv("SERVE_MODEL_DIR", "./model")
+MODEL_VERSION = os.getenv("SERVE_MODEL_VERSION", MODEL_DIR)
+settings = Config().serving_cfg
+
+# Setup logging: JSON written off the request path, one access log entry per request
+setup_logging(
+    level=settings.log_level,
+    queue_size=settings.log_queue_size,
+    sample_rates=settings.log_sample_rates,
+)
 logger = logging.getLogger("serve")
+app.add_middleware(RequestLogMiddleware, skip_paths=settings.access_log_skip_paths)
+
+# Spans are only worth their overhead when something collects them
+if os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT"):
+    from serving.tracing import setup_tracing
+
+    setup_tracing(app, sample_ratio=settings.trace_sample_ratio)
+
+executor = InferenceExecutor(
+    max_workers=settings.executor_workers,
+    max_queue_size=settings.max_queue_size,
+    retry_after=settings.retry_after_seconds,
+)
+
+admission = AdmissionController(
+    max_tokens_in_flight=settings.admission_max_tokens_in_flight,
+    rate_tokens_per_second=settings.rate_limit_tokens_per_second,
+    burst_tokens=settings.rate_limit_burst_tokens,
+    max_queue_size=settings.max_queue_size,
+    retry_after=settings.retry_after_seconds,
+)
+
+# Set by the startup pipeline (serving.runtime.ModelRuntime), and replaced
+# by the reloader when a new model version is swapped in
+runtime = None
+response_cache: Optional[ResponseCache] = None
+reloader = None
+phase = startup.STARTING
+_startup_task: Optional[asyncio.Task] = None
+
+
+def _initial_version() -> str:
+    # When the reloader watches the directory we start from, label the model
+    # the way the reloader will, so the first poll doesn't reload it
+    source = settings.reload_source
+    if source and os.path.realpath(source) == os.path.realpath(MODEL_DIR):
+        from serving.reloader import LocalDirectorySource
+
+        return LocalDirectorySource(MODEL_DIR).fingerprint() or MODEL_VERSION
+    return MODEL_VERSION
 
-MODEL_DIR = os.getenv("SERVE_MODEL_DIR", "./model")
 
-try:
-    tokenizer = AutoTokenizer.from_pretrained(MODEL_DIR)
-    model = AutoModelForCausalLM.from_pretrained(MODEL_DIR)
-    model.eval()
-    if torch.cuda.is_available():
-        model.to("cuda")
-    logger.info(f"Loaded model from {MODEL_DIR}")
-except Exception as e:
-    logger.error(f"Failed to load model: {e}")
-    raise
+def _load_runtime(shared: bool = False):
+    # Importing serving.runtime pulls in torch and transformers
+    from serving.runtime import ModelRuntime
+
+    return ModelRuntime.load(settings, MODEL_DIR, _initial_version(), shared=shared)
+
+
+def preload():
+    """
+    Load the model in the Gunicorn master (``preload_app``) so that every
+    forked worker shares the same read-only weights.
+    """
+    global runtime
+    runtime = _load_runtime(shared=True)
+
+
+async def _start_runtime():
+    global runtime, response_cache, phase
+    try:
+        phase = startup.LOADING
+        # API keys load from Secrets Manager in parallel with the model
+        keys_loaded = asyncio.ensure_future(asyncio.to_thread(key_store.start))
+        if runtime is None:
+            # Off the event loop, so /healthz keeps answering meanwhile
+            runtime = await asyncio.to_thread(_load_runtime)
+        # Threads are started here, in the worker, never inherited through fork
+        runtime.start()
+
+        phase = startup.WARMING_UP
+        await runtime.warmup(settings.warmup_prompt_lengths, settings.warmup_max_new_tokens)
+
+        if settings.response_cache_enabled:
+            response_cache = ResponseCache(
+                max_entries=settings.response_cache_max_entries,
+                ttl_seconds=settings.response_cache_ttl_seconds,
+                disk_dir=settings.response_cache_dir,
+            )
+        await keys_loaded
+        if settings.reload_source:
+            _start_reloader()
+    except Exception as e:
+        phase = startup.FAILED
+        logger.error(f"Startup failed: {e}")
+        return
+    phase = startup.READY
+    MODEL_VERSION_INFO.labels(version=runtime.version).set(1)
+    startup_seconds = process_age_seconds()
+    WORKER_STARTUP_SECONDS.set(startup_seconds)
+    logger.info(f"Worker {os.getpid()} ready after {startup_seconds:.1f}s")
+
+
+def _swap_runtime(new_runtime):
+    global runtime
+    runtime = new_runtime
+
+
+def _start_reloader():
+    global reloader
+    from serving.reloader import ModelReloader, make_source
+
+    reloader = ModelReloader(
+        make_source(settings.reload_source, settings.reload_download_dir),
+        settings,
+        current=runtime,
+        on_swap=_swap_runtime,
+        interval=settings.reload_interval_seconds,
+        drain_timeout=settings.reload_drain_seconds,
+    )
+    reloader.start()
+    logger.info(f"Watching {settings.reload_source} for new model versions")
+
+
+@app.on_event("startup")
+async def start_background_workers():
+    global _startup_task
+    # Interpreter start, imports and (under Gunicorn) the fork
+    boot_seconds = process_age_seconds()
+    STARTUP_PHASE_SECONDS.labels(phase="boot").set(boot_seconds)
+    logger.info(f"Startup phase boot took {boot_seconds:.2f}s")
+    # Load in the background so the server answers /healthz meanwhile
+    _startup_task = asyncio.create_task(_start_runtime())
+
+
+@app.on_event("shutdown")
+async def stop_background_workers():
+    if _startup_task is not None and not _startup_task.done():
+        _startup_task.cancel()
+    if reloader is not None:
+        reloader.stop()
+    key_store.stop()
+    if runtime is not None:
+        runtime.stop(timeout=30)
+    executor.shutdown(wait=False)
+
+
+def _ready_runtime():
+    """
+    The loaded runtime, or a 503 while the worker is still starting.
+    """
+    if phase != startup.READY:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Model is not ready ({phase})",
+            headers={"Retry-After": str(settings.retry_after_seconds)}
+        )
+    return runtime
+
 
 @app.get("/")
 async def root():
     return {"status": "FluxPilot Granite API is up"}
 
-@app.post("/generate", dependencies=[Depends(verify_api_key)])
-async def generate(request: GenerationRequest):
+
+@app.get("/healthz")
+async def healthz():
+    """
+    Liveness: the process and its event loop are responsive. Fails only if
+    startup failed for good, so that the container is restarted.
+    """
+    if phase == startup.FAILED:
+        return JSONResponse({"status": phase}, status_code=500)
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+async def ready():
+    """
+    Readiness: the model is loaded and warmed up.
+    """
+    if phase != startup.READY:
+        return JSONResponse({"status": phase}, status_code=503)
+    return {"status": phase, "model_version": runtime.version}
+
+
+@app.post("/admin/profile", dependencies=[Depends(verify_admin_key)])
+async def profile(seconds: float = 10):
+    """
+    Capture a torch.profiler trace of the batching engine while it serves
+    live traffic, and return it as a Chrome trace (open in Perfetto or
+    chrome://tracing).
+    """
+    from serving.batching import ProfilerBusyError
+
+    rt = _ready_runtime()
+    if not 0 < seconds <= settings.profile_max_seconds:
+        raise HTTPException(
+            status_code=422,
+            detail=f"seconds must be in (0, {settings.profile_max_seconds}]"
+        )
+    fd, path = tempfile.mkstemp(prefix="fluxpilot-profile-", suffix=".json")
+    os.close(fd)
     try:
-        inputs = tokenizer(
-            request.prompt,
-            return_tensors="pt"
+        await rt.engine.profile(seconds, path)
+    except ProfilerBusyError as e:
+        os.remove(path)
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        os.remove(path)
+        logger.error(f"Profiling failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return FileResponse(
+        path,
+        media_type="application/json",
+        filename=os.path.basename(path),
+        background=BackgroundTask(os.remove, path),
+    )
+
+def _deadline(deadline_ms: Optional[int]) -> Optional[float]:
+    """
+    Absolute (time.monotonic) deadline for a request arriving now.
+    """
+    if deadline_ms is None:
+        deadline_ms = settings.default_deadline_ms
+    if deadline_ms is None:
+        return None
+    return time.monotonic() + deadline_ms / 1000
+
+
+def _admission_http_error(e: AdmissionError) -> HTTPException:
+    if isinstance(e, RateLimitedError):
+        return HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(math.ceil(e.retry_after))}
         )
-        if torch.cuda.is_available():
-            inputs = {k: v.to("cuda") for k, v in inputs.items()}
-        outputs = model.generate(
-            **inputs,
+    if isinstance(e, RequestTooLargeError):
+        return HTTPException(status_code=413, detail=str(e))
+    # DeadlineExceededError: retrying the same deadline won't help, so no Retry-After
+    return HTTPException(status_code=503, detail=str(e))
+
+
+async def _run_model(rt, request: GenerationRequest, input_ids: List[int]) -> dict:
+    with log_stage("generate"):
+        output_ids = await rt.generate(
+            input_ids,
             max_new_tokens=request.max_new_tokens,
             temperature=request.temperature
         )
-        text = tokenizer.decode(outputs[0], skip_special_tokens=True)
-        return {"generated_text": text}
+    log_fields(output_tokens=len(output_ids) - len(input_ids))
+    with log_stage("detokenize"):
+        text = await executor.run(rt.detokenize, output_ids, skip_special_tokens=True)
+    return {"generated_text": text, "model_version": rt.version}
+
+
+async def _generate_text(
+    rt, request: GenerationRequest, api_key: str, deadline, cache_key: Optional[str] = None
+) -> dict:
+    with log_stage("tokenize"):
+        encoded = await executor.run(rt.tokenize, request.prompt)
+    input_ids = encoded["input_ids"]
+    log_fields(input_tokens=len(input_ids))
+    cost = estimate_cost(len(input_ids), request.max_new_tokens)
+    # Every caller is admitted (rate limit, deadline) under its own key, even
+    # when its model call ends up coalesced with an identical one
+    with log_stage("admission"):
+        ticket = await admission.acquire(api_key, cost, request.priority, deadline)
+    try:
+        if cache_key is None:
+            return await _run_model(rt, request, input_ids)
+        return await response_cache.get_or_compute(
+            cache_key, lambda: _run_model(rt, request, input_ids)
+        )
+    finally:
+        admission.release(ticket)
+
+
+@app.post("/generate")
+async def generate(request: GenerationRequest, api_key: str = Depends(verify_api_key)):
+    track_first_token("/generate")
+    deadline = _deadline(request.deadline_ms)
+    rt = _ready_runtime()
+    log_fields(model_version=rt.version, priority=request.priority)
+    try:
+        with rt.use():
+            # Only deterministic decoding is safe to serve from cache; cache
+            # hits are free and skip admission
+            if response_cache is None or rt.do_sample:
+                return await _generate_text(rt, request, api_key, deadline)
+            key = make_cache_key(
+                request.prompt, request.max_new_tokens, request.temperature, rt.version
+            )
+            cached = response_cache.get(key)
+            if cached is not None:
+                return cached
+            return await _generate_text(rt, request, api_key, deadline, cache_key=key)
+    except AdmissionError as e:
+        logger.warning(f"Not admitting request: {e}")
+        raise _admission_http_error(e)
+    except QueueFullError as e:
+        logger.warning(f"Shedding request: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail="Server is at capacity, retry later",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except ValueError as e:
+        # The engine's input checks, e.g. a prompt that tokenizes to nothing
+        logger.warning(f"Rejecting request: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Generation error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def _generate_alone(rt, input_ids: List[int], request: GenerationRequest):
+    """
+    Output token IDs for one batch item in a group of its own, or the
+    exception it failed with.
+    """
+    try:
+        result = await rt.engine.generate_group(
+            [(input_ids, request.max_new_tokens, request.temperature)]
+        )
+    except Exception as e:
+        return e
+    return result[0]
+
+
+@app.post("/generate/batch")
+async def generate_batch(request: BatchGenerationRequest, api_key: str = Depends(verify_api_key)):
+    """
+    Generate for many prompts in one call. Prompts are bucketed by token
+    length and each bucket is prefilled as a single padded batch. Results come
+    back in input order; a failed item carries an "error" instead of failing
+    the whole request.
+    """
+    from serving.batching import bucket_by_length
+
+    track_first_token("/generate/batch")
+    deadline = _deadline(request.deadline_ms)
+    rt = _ready_runtime()
+    items = request.requests
+    if len(items) > settings.max_batch_request_size:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {settings.max_batch_request_size} requests per batch"
+        )
+    if not items:
+        return {"results": [], "model_version": rt.version}
+
+    log_fields(model_version=rt.version, priority=request.priority, batch_size=len(items))
+    try:
+        with rt.use():
+            with log_stage("tokenize"):
+                encoded = await executor.run(rt.tokenize, [item.prompt for item in items])
+            input_ids = encoded["input_ids"]
+            log_fields(input_tokens=sum(len(ids) for ids in input_ids))
+            cost = sum(
+                estimate_cost(len(ids), item.max_new_tokens) for ids, item in zip(input_ids, items)
+            )
+            buckets = bucket_by_length([len(ids) for ids in input_ids], settings.max_batch_size)
+            with log_stage("admission"):
+                ticket = await admission.acquire(api_key, cost, request.priority, deadline)
+            try:
+                with log_stage("generate"):
+                    bucket_outputs = await asyncio.gather(*[
+                        rt.engine.generate_group([
+                            (input_ids[i], items[i].max_new_tokens, items[i].temperature)
+                            for i in bucket
+                        ])
+                        for bucket in buckets
+                    ], return_exceptions=True)
+                    outputs = [None] * len(items)
+                    for bucket, result in zip(buckets, bucket_outputs):
+                        for position, i in enumerate(bucket):
+                            outputs[i] = result if isinstance(result, BaseException) else result[position]
+                    # A bucket shares its prefill, so one bad item fails all of
+                    # them; rerun the failed ones alone so only the culprit fails
+                    for bucket in buckets:
+                        if len(bucket) == 1:
+                            continue
+                        for i in bucket:
+                            if isinstance(outputs[i], BaseException):
+                                outputs[i] = await _generate_alone(rt, input_ids[i], items[i])
+            finally:
+                admission.release(ticket)
+
+            succeeded = [i for i, out in enumerate(outputs) if not isinstance(out, BaseException)]
+            log_fields(output_tokens=sum(len(outputs[i]) - len(input_ids[i]) for i in succeeded))
+            with log_stage("detokenize"):
+                texts = await executor.run(
+                    rt.batch_detokenize, [outputs[i] for i in succeeded], skip_special_tokens=True
+                )
+    except AdmissionError as e:
+        logger.warning(f"Not admitting batch request: {e}")
+        raise _admission_http_error(e)
+    except QueueFullError as e:
+        logger.warning(f"Shedding batch request: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail="Server is at capacity, retry later",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except Exception as e:
+        logger.error(f"Batch generation error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    results = [None] * len(items)
+    for i, text in zip(succeeded, texts):
+        results[i] = {"generated_text": text}
+    for i, out in enumerate(outputs):
+        if isinstance(out, BaseException):
+            logger.error(f"Batch item {i} failed: {out}")
+            results[i] = {"error": str(out) or type(out).__name__}
+    return {"results": results, "model_version": rt.version}
+
+
+@app.post("/generate/stream")
+async def generate_stream(
+    request: GenerationRequest,
+    http_request: Request,
+    api_key: str = Depends(verify_api_key),
+):
+    """
+    Stream generated text as server-sent events: one `data: {"text": ...}`
+    frame per decoded chunk, then `data: [DONE]`. Only the continuation is
+    streamed, not the prompt.
+    """
+    track_first_token("/generate/stream")
+    deadline = _deadline(request.deadline_ms)
+    rt = _ready_runtime()
+    log_fields(model_version=rt.version, priority=request.priority)
+    try:
+        with rt.use():
+            with log_stage("tokenize"):
+                encoded = await executor.run(rt.tokenize, request.prompt)
+            input_ids = encoded["input_ids"]
+            log_fields(input_tokens=len(input_ids))
+            # Held until the stream ends, not just until it starts
+            with log_stage("admission"):
+                ticket = await admission.acquire(
+                    api_key,
+                    estimate_cost(len(input_ids), request.max_new_tokens),
+                    request.priority,
+                    deadline,
+                )
+            try:
+                tokens = rt.engine.stream(
+                    input_ids,
+                    max_new_tokens=request.max_new_tokens,
+                    temperature=request.temperature
+                )
+            except BaseException:
+                admission.release(ticket)
+                raise
+    except AdmissionError as e:
+        logger.warning(f"Not admitting request: {e}")
+        raise _admission_http_error(e)
+    except QueueFullError as e:
+        logger.warning(f"Shedding request: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail="Server is at capacity, retry later",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except ValueError as e:
+        # The engine's input checks, e.g. a prompt that tokenizes to nothing
+        logger.warning(f"Rejecting request: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Generation error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+    fields = request_fields()
+    generated = 0
+
+    async def events():
+        nonlocal generated
+        # decode() is tokenizer work: keep it off the event loop like the
+        # other endpoints' detokenize
+        push = timed("detokenize", IncrementalDecoder(rt.tokenizer).push)
+        try:
+            async for token_id in tokens:
+                generated += 1
+                if await http_request.is_disconnected():
+                    logger.info("Client disconnected, cancelling generation")
+                    break
+                text = await executor.run(push, token_id)
+                if text:
+                    yield sse_event({"text": text})
+            else:
+                yield sse_event("[DONE]")
+        except Exception as e:
+            logger.error(f"Generation error: {e}")
+            yield sse_event({"detail": str(e)}, event="error")
+
+    body = events()
+
+    async def close():
+        # Runs even if the body never started (client gone before the first
+        # send, or the send failed), so the ticket and batch slot never leak
+        rt.in_flight -= 1
+        admission.release(ticket)
+        if fields is not None:
+            fields["output_tokens"] = generated
+        await body.aclose()
+        # Closing the token iterator frees the batch slot immediately
+        await tokens.aclose()
+
+    # Released by close(), not when this handler returns
+    rt.in_flight += 1
+    return ClosingStreamingResponse(
+        body,
+        on_close=close,
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            "X-Model-Version": rt.version,
+        }
+    )
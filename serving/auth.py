@@ -2,14 +2,19 @@
 
 import os
 import json
-from typing import Set
+import hashlib
+import logging
+import random
+import threading
+from typing import Any, Callable, Dict, FrozenSet, Optional, Set
 
-import boto3
 from fastapi import HTTPException, Security
 from fastapi.security.api_key import APIKeyHeader
-from botocore.exceptions import BotoCoreError, ClientError
 
 from serving.config import Config
+from serving.metrics import AUTH_KEY_REFRESH_FAILURES, AUTH_KEYS_LOADED
+
+logger = logging.getLogger("serve.auth")
 
 # Load serving configuration
 cfg = Config()
@@ -20,46 +25,185 @@ SECRETS_MANAGER_KEY = cfg.serving_cfg.secrets_manager_key  # e.g. "/fluxpilot/ap
 api_key_header = APIKeyHeader(name=API_KEY_HEADER, auto_error=False)
 
 
-def _load_keys_from_env() -> Set[str]:
+def _load_keys_from_env(var: str = "API_KEYS") -> Set[str]:
     """
-    Fallback: load API keys from an environment variable 'API_KEYS', comma-separated.
+    Fallback: load API keys from an environment variable ('API_KEYS' by default), comma-separated.
     """
-    raw = os.getenv("API_KEYS", "")
+    raw = os.getenv(var, "")
     return {k.strip() for k in raw.split(",") if k.strip()}
 
 
-def _load_keys_from_secrets_manager() -> Set[str]:
+def _secrets_manager_client():
+    # boto3 is slow to import; only pay for it when keys are first loaded
+    import boto3
+
+    return boto3.client("secretsmanager", region_name=os.getenv("AWS_REGION"))
+
+
+def _load_secret(client: Any) -> Dict[str, Any]:
+    """
+    Read the API keys JSON from AWS Secrets Manager.
+    Expect a JSON like: {"api_keys": ["key1", ...], "admin_api_keys": ["admin1", ...]}
+    Raises on AWS or JSON errors so callers can tell a failed read from an empty secret.
+    """
+    resp = client.get_secret_value(SecretId=SECRETS_MANAGER_KEY)
+    secret_str = resp.get("SecretString", "{}")
+    return json.loads(secret_str)
+
+
+def _load_keys_from_secrets_manager(client: Any) -> Set[str]:
     """
-    Primary: load API keys JSON from AWS Secrets Manager.
-    Expect a JSON like: {"api_keys": ["key1", "key2", ...]}
+    Primary: load API keys from AWS Secrets Manager.
     """
-    try:
-        client = boto3.client("secretsmanager", region_name=os.getenv("AWS_REGION"))
-        resp = client.get_secret_value(SecretId=SECRETS_MANAGER_KEY)
-        secret_str = resp.get("SecretString", "{}")
-        secret_json = json.loads(secret_str)
-        return set(secret_json.get("api_keys", []))
-    except (ClientError, BotoCoreError, json.JSONDecodeError):
-        # If anything fails, fall back to env
-        return set()
-
-
-def get_allowed_api_keys() -> Set[str]:
+    return set(_load_secret(client).get("api_keys", []))
+
+
+def get_allowed_api_keys(client: Any = None) -> Set[str]:
     """
     Returns the set of allowed API keys, preferring Secrets Manager.
     """
-    keys = _load_keys_from_secrets_manager()
+    keys = _load_keys_from_secrets_manager(client or _secrets_manager_client())
     if keys:
         return keys
     return _load_keys_from_env()
 
 
+def _hash_key(key: str) -> bytes:
+    return hashlib.sha256(key.encode("utf-8")).digest()
+
+
+class ApiKeyStore:
+    """
+    In-process store of allowed API keys, refreshed on a background thread.
+
+    Only SHA-256 digests are kept in memory. A lookup hashes the presented
+    key and checks set membership, so its cost does not depend on how many
+    keys exist or how much of a key matches. A failed refresh keeps the last
+    good key set (falling back to ``API_KEYS`` only if nothing has loaded yet)
+    and is counted in ``fluxpilot_auth_key_refresh_failures_total``.
+
+    Admin keys (``admin_api_keys`` in the same secret, or ``ADMIN_API_KEYS``)
+    are kept in a separate set and only unlock the /admin endpoints.
+    """
+
+    def __init__(
+        self,
+        client_factory: Callable[[], Any] = _secrets_manager_client,
+        refresh_interval: float = 60,
+        jitter: float = 0.1,
+    ):
+        self.client_factory = client_factory
+        self.refresh_interval = refresh_interval
+        self.jitter = jitter
+        self._client = None
+        self._hashes: FrozenSet[bytes] = frozenset()
+        self._admin_hashes: FrozenSet[bytes] = frozenset()
+        self._loaded = False
+        # Set once the first refresh has put some key set in place
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def is_valid(self, api_key: str) -> bool:
+        return _hash_key(api_key) in self._hashes
+
+    def is_admin(self, api_key: str) -> bool:
+        return _hash_key(api_key) in self._admin_hashes
+
+    def refresh(self) -> bool:
+        """
+        Reload keys now. Returns whether the reload succeeded.
+        """
+        try:
+            if self._client is None:
+                self._client = self.client_factory()
+            secret = _load_secret(self._client)
+        except Exception as e:
+            AUTH_KEY_REFRESH_FAILURES.inc()
+            # Rebuild the client next time in case its credentials went stale
+            self._client = None
+            if self._loaded:
+                logger.warning(f"API key refresh failed, keeping previous keys: {e}")
+            else:
+                logger.warning(f"API key refresh failed, using API_KEYS env fallback: {e}")
+                self._set(_load_keys_from_env(), _load_keys_from_env("ADMIN_API_KEYS"))
+            return False
+        self._set(
+            set(secret.get("api_keys", [])) or _load_keys_from_env(),
+            set(secret.get("admin_api_keys", [])) or _load_keys_from_env("ADMIN_API_KEYS"),
+        )
+        self._loaded = True
+        return True
+
+    def start(self):
+        """
+        Load keys once, synchronously, then keep refreshing in the background.
+        Safe to call repeatedly, and after a fork.
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self.refresh()
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="fluxpilot-auth-refresh", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        # Jitter spreads refreshes of many workers/pods over time
+        while not self._stop.wait(
+            self.refresh_interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+        ):
+            self.refresh()
+
+    def _set(self, keys: Set[str], admin_keys: Set[str]):
+        self._hashes = frozenset(_hash_key(k) for k in keys)
+        self._admin_hashes = frozenset(_hash_key(k) for k in admin_keys)
+        AUTH_KEYS_LOADED.set(len(self._hashes))
+        self._ready.set()
+
+
+key_store = ApiKeyStore(
+    refresh_interval=cfg.serving_cfg.api_key_refresh_seconds,
+    jitter=cfg.serving_cfg.api_key_refresh_jitter,
+)
+
+
+def _require_keys_loaded():
+    # The startup task starts the store off the event loop; requests only
+    # ever read its in-memory hash sets
+    if not key_store.ready:
+        raise HTTPException(status_code=503, detail="API keys are still loading")
+
+
 async def verify_api_key(api_key: str = Security(api_key_header)):
     """
     FastAPI dependency to enforce API key auth.
     Raises 401 if header missing or invalid.
     """
-    allowed = get_allowed_api_keys()
-    if not api_key or api_key not in allowed:
+    _require_keys_loaded()
+    if not api_key or not key_store.is_valid(api_key):
+        raise HTTPException(status_code=401, detail="Invalid or missing API key")
+    return api_key
+
+
+async def verify_admin_key(api_key: str = Security(api_key_header)):
+    """
+    FastAPI dependency for /admin endpoints: 401 without a known key, 403
+    for a regular (non-admin) API key.
+    """
+    _require_keys_loaded()
+    if not api_key or not (key_store.is_admin(api_key) or key_store.is_valid(api_key)):
         raise HTTPException(status_code=401, detail="Invalid or missing API key")
+    if not key_store.is_admin(api_key):
+        raise HTTPException(status_code=403, detail="Admin API key required")
     return api_key
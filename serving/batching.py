@@ -0,0 +1,809 @@
+# serving/batching.py
+
+import asyncio
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import torch
+import torch.nn.functional as F
+from opentelemetry import context as otel_context
+from opentelemetry import trace
+
+try:
+    from transformers import DynamicCache
+except ImportError:  # older transformers only know the legacy tuple cache
+    DynamicCache = None
+
+from serving.executor import QueueFullError
+from serving.logging import record_stage, request_fields
+from serving.prefix_cache import PrefixCache
+from serving.metrics import (
+    GENERATION_CANCELLED,
+    GENERATION_TOKENS_PER_SECOND,
+    INFERENCE_QUEUE_DEPTH,
+    INFERENCE_QUEUE_WAIT,
+    INFERENCE_REJECTED,
+    INFERENCE_STAGE_LATENCY,
+    INFERENCE_TOKENS,
+    PREFILL_PADDING_EFFICIENCY,
+    TIME_TO_FIRST_TOKEN,
+    first_token_timing,
+)
+
+logger = logging.getLogger("serve.batching")
+tracer = trace.get_tracer("fluxpilot.serving")
+
+_STOP = object()
+# Wakes an idle scheduler so it notices a profiling request
+_WAKE = object()
+
+
+class ProfilerBusyError(RuntimeError):
+    """
+    Raised when a profile is requested while another one is running.
+    """
+
+
+@dataclass
+class GenerationJob:
+    """
+    A single generation request travelling through the batching engine.
+    """
+    input_ids: List[int]
+    max_new_tokens: int
+    temperature: float
+    future: asyncio.Future
+    loop: asyncio.AbstractEventLoop
+    enqueued_at: float = field(default_factory=time.monotonic)
+    prefill_started_at: Optional[float] = None
+    decode_started_at: Optional[float] = None
+    output_ids: List[int] = field(default_factory=list)
+    # Called on the request's event loop with each new token, then with None
+    on_token: Optional[Callable[[Optional[int]], None]] = None
+    # Set from the event loop when the client goes away; the engine drops the row
+    cancelled: bool = False
+    # Trace context of the request, so engine-side spans join its trace
+    trace_context: Optional[otel_context.Context] = None
+    decode_span: Optional[trace.Span] = None
+    # Access log entry of the request, for its engine stage timings
+    log_fields: Optional[Dict[str, Any]] = None
+    # (endpoint, arrival time) for the time-to-first-token histogram
+    timing: Optional[Tuple[str, float]] = None
+    finished: bool = False
+
+
+@dataclass
+class _ProfileRequest:
+    seconds: float
+    path: str
+    future: asyncio.Future
+    loop: asyncio.AbstractEventLoop
+
+
+def _to_legacy(past):
+    """Normalize a model's KV cache to the legacy per-layer tuple layout."""
+    if hasattr(past, "to_legacy_cache"):
+        return past.to_legacy_cache()
+    if hasattr(past, "layers"):
+        return tuple((layer.keys, layer.values) for layer in past.layers)
+    return past
+
+
+def _from_legacy(model, past):
+    """Wrap a legacy KV cache in whatever cache type the model expects."""
+    if DynamicCache is None or not getattr(model, "_supports_cache_class", True):
+        return past
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(past)
+    cache = DynamicCache()
+    for layer_idx, (keys, values) in enumerate(past):
+        cache.update(keys, values, layer_idx)
+    return cache
+
+
+def _map_cache(past, fn):
+    return tuple(tuple(fn(t) for t in layer) for layer in past)
+
+
+def _left_pad_cache(past, width: int):
+    """Left-pad every cached key/value tensor along the sequence axis."""
+    return _map_cache(past, lambda t: F.pad(t, (0, 0, width - t.shape[-2], 0)))
+
+
+def _left_pad_mask(mask: torch.Tensor, width: int) -> torch.Tensor:
+    return F.pad(mask, (width - mask.shape[-1], 0))
+
+
+def bucket_by_length(lengths: Sequence[int], bucket_size: int) -> List[List[int]]:
+    """
+    Group item indices into buckets of at most ``bucket_size`` items with
+    similar lengths, so each padded bucket wastes little compute on padding.
+
+    Returns:
+        Lists of indices into ``lengths``, shortest bucket first.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    return [order[i:i + bucket_size] for i in range(0, len(order), bucket_size)]
+
+
+class BatchingEngine:
+    """
+    Continuous micro-batching scheduler sitting between the API and the model.
+
+    Requests arriving within ``batch_wait_ms`` of each other are prefilled
+    together as one left-padded batch. Decoding then advances every active
+    sequence by one token per forward pass; finished sequences leave the
+    batch and queued requests join between decode steps.
+
+    With a ``PrefixCache`` attached, prompts that start with a cached prefix
+    are prefilled from the stored KV cache and only compute their suffix.
+    """
+
+    def __init__(
+        self,
+        model,
+        tokenizer,
+        max_batch_size: int = 8,
+        batch_wait_ms: int = 10,
+        max_queue_size: int = 64,
+        retry_after: int = 1,
+        prefix_cache: Optional[PrefixCache] = None,
+        autocast_dtype: Optional[torch.dtype] = None,
+    ):
+        self.model = model
+        self.prefix_cache = prefix_cache
+        self.autocast_dtype = autocast_dtype
+        self.max_batch_size = max_batch_size
+        self.batch_wait = batch_wait_ms / 1000.0
+        self.max_queue_size = max_queue_size
+        self.retry_after = retry_after
+
+        gen_cfg = model.generation_config
+        eos = gen_cfg.eos_token_id if gen_cfg.eos_token_id is not None else tokenizer.eos_token_id
+        self.eos_token_ids = set(eos if isinstance(eos, (list, tuple)) else [eos]) - {None}
+        pad = gen_cfg.pad_token_id if gen_cfg.pad_token_id is not None else tokenizer.pad_token_id
+        self.pad_token_id = pad if pad is not None else next(iter(self.eos_token_ids), 0)
+        # Mirror model.generate(): sample only when the generation config asks for it
+        self.do_sample = bool(gen_cfg.do_sample)
+
+        self._queue: "queue.Queue" = queue.Queue()
+        # A queued group that did not fit into the batch yet
+        self._deferred: Optional[List[GenerationJob]] = None
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+
+        # Running batch state; rows are aligned with self._jobs
+        self._jobs: List[GenerationJob] = []
+        self._past = None
+        self._attention_mask: Optional[torch.Tensor] = None
+        self._next_tokens: Optional[torch.Tensor] = None
+        # torch.profiler only sees the thread it runs on, so captures are
+        # started and stopped by the scheduler thread itself
+        self._profile_request: Optional[_ProfileRequest] = None
+        self._profiler = None
+        self._profile_deadline: Optional[float] = None
+
+    # ------------------------------------------------------------------ API
+
+    def start(self):
+        """
+        Start the scheduler thread. Safe to call repeatedly, and after a fork.
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(
+                target=self._run, name="fluxpilot-batching", daemon=True
+            )
+            self._thread.start()
+            logger.info(
+                f"Batching engine started (max_batch_size={self.max_batch_size}, "
+                f"batch_wait_ms={self.batch_wait * 1000:.0f})"
+            )
+
+    def stop(self, timeout: Optional[float] = None):
+        """
+        Stop accepting work, let active sequences finish and join the thread.
+        """
+        with self._lock:
+            if self._thread is None:
+                return
+            self._stopping = True
+            self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    async def generate(
+        self,
+        input_ids: List[int],
+        max_new_tokens: int,
+        temperature: float = 1.0,
+    ) -> List[int]:
+        """
+        Queue a prompt for generation and wait for its completion.
+
+        Returns:
+            The prompt token IDs followed by the generated token IDs, matching
+            the layout returned by ``model.generate`` for decoder-only models.
+
+        Raises:
+            QueueFullError: If ``max_queue_size`` requests are already waiting.
+        """
+        job = self._submit(input_ids, max_new_tokens, temperature)
+        try:
+            return await job.future
+        except asyncio.CancelledError:
+            job.cancelled = True
+            raise
+
+    def stream(
+        self,
+        input_ids: List[int],
+        max_new_tokens: int,
+        temperature: float = 1.0,
+    ) -> AsyncIterator[int]:
+        """
+        Queue a prompt for generation and return an async iterator over the
+        generated token IDs as they are decoded.
+
+        The request is admitted immediately, so ``QueueFullError`` is raised
+        here rather than after a response has started. Closing the iterator
+        early cancels the request and frees its batch slot.
+        """
+        tokens: asyncio.Queue = asyncio.Queue()
+        job = self._submit(input_ids, max_new_tokens, temperature, on_token=tokens.put_nowait)
+        return self._iter_tokens(job, tokens)
+
+    async def _iter_tokens(self, job: GenerationJob, tokens: asyncio.Queue) -> AsyncIterator[int]:
+        try:
+            while True:
+                token = await tokens.get()
+                if token is None:
+                    break
+                yield token
+            # Surface engine failures to the consumer
+            job.future.result()
+        finally:
+            if not job.future.done():
+                job.cancelled = True
+
+    async def profile(self, seconds: float, path: str):
+        """
+        Profile the scheduler thread with ``torch.profiler`` for ``seconds``
+        while it keeps serving traffic, and write a Chrome trace to ``path``.
+
+        Raises:
+            ProfilerBusyError: If a profile is already being captured.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._profile_request is not None:
+                raise ProfilerBusyError("A profile is already being captured")
+            self._profile_request = _ProfileRequest(seconds, path, loop.create_future(), loop)
+            request = self._profile_request
+        try:
+            self._queue.put_nowait(_WAKE)
+        except queue.Full:
+            pass
+        await request.future
+
+    async def generate_group(
+        self,
+        requests: List[Tuple[List[int], int, float]],
+    ) -> List[Union[List[int], BaseException]]:
+        """
+        Queue several prompts that should be prefilled together as one
+        padded batch, e.g. a length bucket from ``bucket_by_length``.
+
+        Args:
+            requests: ``(input_ids, max_new_tokens, temperature)`` per prompt;
+                at most ``max_batch_size`` of them.
+
+        Returns:
+            One entry per request, in order: the output token IDs, or the
+            exception that request failed with.
+
+        Raises:
+            QueueFullError: If the engine queue is full.
+        """
+        if len(requests) > self.max_batch_size:
+            raise ValueError(f"A group holds at most {self.max_batch_size} requests")
+        jobs: List[Union[GenerationJob, Exception]] = []
+        for input_ids, max_new_tokens, temperature in requests:
+            try:
+                jobs.append(self._make_job(input_ids, max_new_tokens, temperature))
+            except ValueError as e:
+                jobs.append(e)
+        self._enqueue([job for job in jobs if isinstance(job, GenerationJob)])
+        queued = [job for job in jobs if isinstance(job, GenerationJob)]
+        try:
+            results = await asyncio.gather(*[job.future for job in queued], return_exceptions=True)
+        except asyncio.CancelledError:
+            for job in queued:
+                job.cancelled = True
+            raise
+        ordered = iter(results)
+        return [job if isinstance(job, Exception) else next(ordered) for job in jobs]
+
+    def _submit(
+        self,
+        input_ids: List[int],
+        max_new_tokens: int,
+        temperature: float,
+        on_token: Optional[Callable[[Optional[int]], None]] = None,
+    ) -> GenerationJob:
+        job = self._make_job(input_ids, max_new_tokens, temperature, on_token)
+        self._enqueue([job])
+        return job
+
+    def _make_job(
+        self,
+        input_ids: List[int],
+        max_new_tokens: int,
+        temperature: float,
+        on_token: Optional[Callable[[Optional[int]], None]] = None,
+    ) -> GenerationJob:
+        if not input_ids:
+            raise ValueError("Prompt must contain at least one token")
+        loop = asyncio.get_running_loop()
+        job = GenerationJob(
+            input_ids=list(input_ids),
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            future=loop.create_future(),
+            loop=loop,
+            on_token=on_token,
+        )
+        if max_new_tokens <= 0:
+            job.future.set_result(job.input_ids)
+            if on_token is not None:
+                on_token(None)
+        job.trace_context = otel_context.get_current()
+        job.log_fields = request_fields()
+        job.timing = first_token_timing()
+        return job
+
+    def _enqueue(self, jobs: List[GenerationJob]):
+        """
+        Put jobs on the queue as one unit that is admitted into the batch together.
+        """
+        jobs = [job for job in jobs if not job.future.done()]
+        if not jobs:
+            return
+        if self._stopping:
+            raise RuntimeError("Batching engine is shutting down")
+        if self._queue.qsize() >= self.max_queue_size:
+            INFERENCE_REJECTED.labels(queue="engine").inc(len(jobs))
+            raise QueueFullError("engine", self.retry_after)
+        self.start()
+        self._queue.put(jobs)
+        INFERENCE_QUEUE_DEPTH.labels(queue="engine").set(self._queue.qsize())
+
+    # ------------------------------------------------------- scheduler loop
+
+    def _run(self):
+        while True:
+            if (
+                self._stopping
+                and not self._jobs
+                and self._deferred is None
+                and self._queue.empty()
+            ):
+                self._stop_profile()
+                return
+            self._update_profile()
+            joining = self._collect()
+            if joining:
+                try:
+                    self._prefill(joining)
+                except Exception as e:
+                    logger.error(f"Prefill failed for {len(joining)} request(s): {e}")
+                    for job in joining:
+                        self._resolve(job, error=e)
+            if self._jobs:
+                try:
+                    self._decode_step()
+                except Exception as e:
+                    logger.error(f"Decode step failed for {len(self._jobs)} request(s): {e}")
+                    for job in self._jobs:
+                        self._resolve(job, error=e)
+                    self._reset()
+
+    def _collect(self) -> List[GenerationJob]:
+        """
+        Pull queued jobs that fit into the free batch slots. A queued group
+        is admitted whole or left at the head of the queue.
+        """
+        free = self.max_batch_size - len(self._jobs)
+        joining: List[GenerationJob] = []
+        if free <= 0:
+            return joining
+
+        # When idle, block for the first request, then hold the batch open for
+        # up to batch_wait so that concurrent arrivals share the prefill. When
+        # busy, admit whatever is already waiting without stalling decode.
+        idle = not self._jobs
+        deadline = None
+        while len(joining) < free:
+            if self._deferred is not None:
+                item, self._deferred = self._deferred, None
+            else:
+                try:
+                    if not idle:
+                        item = self._queue.get_nowait()
+                    elif deadline is None:
+                        # Don't sleep past the end of a running profile
+                        item = self._queue.get(timeout=self._idle_timeout())
+                    else:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if item is _STOP or item is _WAKE:
+                break
+            if deadline is None:
+                deadline = time.monotonic() + self.batch_wait
+
+            group = [job for job in item if not self._skip_cancelled(job)]
+            if len(joining) + len(group) > free:
+                self._deferred = group
+                break
+            joining.extend(group)
+
+        now = time.monotonic()
+        for job in joining:
+            INFERENCE_QUEUE_WAIT.labels(queue="engine").observe(now - job.enqueued_at)
+        INFERENCE_QUEUE_DEPTH.labels(queue="engine").set(self._queue.qsize())
+        return joining
+
+    # ------------------------------------------------------------ profiling
+
+    def _idle_timeout(self) -> Optional[float]:
+        if self._profile_request is None:
+            return None
+        if self._profile_deadline is None:
+            return 0
+        return max(0.0, self._profile_deadline - time.monotonic())
+
+    def _update_profile(self):
+        request = self._profile_request
+        if request is None:
+            return
+        if self._profiler is None:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            try:
+                self._profiler = torch.profiler.profile(activities=activities)
+                self._profiler.start()
+            except Exception as e:
+                self._profiler = None
+                self._finish_profile(error=e)
+                return
+            self._profile_deadline = time.monotonic() + request.seconds
+            logger.info(f"Profiling the batching engine for {request.seconds:.0f}s")
+        elif time.monotonic() >= self._profile_deadline:
+            self._stop_profile()
+
+    def _stop_profile(self):
+        if self._profiler is None:
+            if self._profile_request is not None:
+                self._finish_profile(error=RuntimeError("Batching engine stopped"))
+            return
+        profiler, self._profiler = self._profiler, None
+        try:
+            profiler.stop()
+            profiler.export_chrome_trace(self._profile_request.path)
+        except Exception as e:
+            self._finish_profile(error=e)
+        else:
+            self._finish_profile()
+
+    def _finish_profile(self, error: Optional[BaseException] = None):
+        request = self._profile_request
+        with self._lock:
+            self._profile_request = None
+            self._profile_deadline = None
+
+        def _set():
+            if not request.future.done():
+                if error is not None:
+                    request.future.set_exception(error)
+                else:
+                    request.future.set_result(request.path)
+
+        try:
+            request.loop.call_soon_threadsafe(_set)
+        except RuntimeError:
+            pass
+
+    # ---------------------------------------------------------------- steps
+
+    def _skip_cancelled(self, job: GenerationJob) -> bool:
+        if job.cancelled:
+            GENERATION_CANCELLED.inc()
+            self._resolve(job, error=asyncio.CancelledError())
+            return True
+        return False
+
+    def _prefill(self, jobs: List[GenerationJob]):
+        started = time.monotonic()
+        started_ns = time.time_ns()
+        misses = []
+        hits = set()
+        with torch.profiler.record_function("prefill"):
+            for job in jobs:
+                job.prefill_started_at = started
+                hit = self.prefix_cache.lookup(job.input_ids) if self.prefix_cache else None
+                if hit is None:
+                    misses.append(job)
+                else:
+                    hits.add(id(job))
+                    self._prefill_from_prefix(job, *hit)
+            if misses:
+                self._prefill_batch(misses)
+        ended = time.monotonic()
+        INFERENCE_STAGE_LATENCY.labels(stage="prefill").observe(ended - started)
+        INFERENCE_TOKENS.labels(kind="input").inc(sum(len(job.input_ids) for job in jobs))
+
+        # One span per request: the batch is shared, the timing is the same
+        ended_ns = time.time_ns()
+        for job in jobs:
+            job.decode_started_at = ended
+            record_stage(job.log_fields, "engine_queue", started - job.enqueued_at)
+            record_stage(job.log_fields, "prefill", ended - started)
+            span = tracer.start_span(
+                "prefill",
+                context=job.trace_context,
+                start_time=started_ns,
+                attributes={
+                    "prompt_tokens": len(job.input_ids),
+                    "batch_size": len(jobs),
+                    "prefix_cache_hit": id(job) in hits,
+                },
+            )
+            span.end(end_time=ended_ns)
+            if not job.finished:
+                job.decode_span = tracer.start_span(
+                    "decode", context=job.trace_context, start_time=ended_ns
+                )
+
+    @torch.inference_mode()
+    def _prefill_batch(self, jobs: List[GenerationJob]):
+        device = self.model.device
+        width = max(len(job.input_ids) for job in jobs)
+        input_ids = torch.full((len(jobs), width), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(jobs), width), dtype=torch.long)
+        for row, job in enumerate(jobs):
+            n = len(job.input_ids)
+            input_ids[row, width - n:] = torch.tensor(job.input_ids, dtype=torch.long)
+            attention_mask[row, width - n:] = 1
+        PREFILL_PADDING_EFFICIENCY.observe(float(attention_mask.float().mean()))
+        input_ids = input_ids.to(device)
+        attention_mask = attention_mask.to(device)
+        position_ids = (attention_mask.cumsum(dim=-1) - 1).clamp(min=0)
+
+        out = self._forward(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            use_cache=True,
+        )
+        past = _to_legacy(out.past_key_values)
+        if self.prefix_cache is not None:
+            for row, job in enumerate(jobs):
+                start = width - len(job.input_ids)
+                self.prefix_cache.insert(
+                    job.input_ids, _map_cache(past, lambda t: t[row:row + 1, ..., start:, :])
+                )
+        self._admit(jobs, past, attention_mask, self._select(out.logits[:, -1, :], jobs))
+
+    @torch.inference_mode()
+    def _prefill_from_prefix(self, job: GenerationJob, prefix_length: int, prefix_past):
+        """
+        Prefill only the part of the prompt not covered by a cached prefix.
+        """
+        device = self.model.device
+        total = len(job.input_ids)
+        out = self._forward(
+            input_ids=torch.tensor([job.input_ids[prefix_length:]], dtype=torch.long, device=device),
+            attention_mask=torch.ones((1, total), dtype=torch.long, device=device),
+            position_ids=torch.arange(prefix_length, total, device=device).unsqueeze(0),
+            past_key_values=_from_legacy(self.model, prefix_past),
+            use_cache=True,
+        )
+        past = _to_legacy(out.past_key_values)
+        if total - prefix_length >= self.prefix_cache.block_size:
+            # Remember the longer prompt too, so its own suffix becomes reusable
+            self.prefix_cache.insert(job.input_ids, past)
+        self._admit(
+            [job],
+            past,
+            torch.ones((1, total), dtype=torch.long, device=device),
+            self._select(out.logits[:, -1, :], [job]),
+        )
+
+    def _admit(self, jobs, past, attention_mask, next_tokens):
+        """
+        Record the first generated token of freshly prefilled jobs and merge
+        the ones that are still generating into the running batch.
+        """
+        keep = self._record(jobs, next_tokens)
+        if not keep:
+            return
+        index = torch.tensor(keep, device=attention_mask.device)
+        self._merge(
+            [jobs[i] for i in keep],
+            _map_cache(past, lambda t: t.index_select(0, index)),
+            attention_mask.index_select(0, index),
+            next_tokens.index_select(0, index),
+        )
+
+    @torch.inference_mode()
+    @torch.profiler.record_function("decode_step")
+    def _decode_step(self):
+        started = time.monotonic()
+        batch = len(self._jobs)
+        attention_mask = torch.cat(
+            [self._attention_mask, self._attention_mask.new_ones((batch, 1))], dim=1
+        )
+        position_ids = attention_mask.sum(dim=1, keepdim=True) - 1
+
+        out = self._forward(
+            input_ids=self._next_tokens.unsqueeze(1),
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=_from_legacy(self.model, self._past),
+            use_cache=True,
+        )
+        self._past = _to_legacy(out.past_key_values)
+        self._attention_mask = attention_mask
+        self._next_tokens = self._select(out.logits[:, -1, :], self._jobs)
+        INFERENCE_STAGE_LATENCY.labels(stage="decode_token").observe(time.monotonic() - started)
+        self._retain(self._record(self._jobs, self._next_tokens))
+
+    # -------------------------------------------------------- batch helpers
+
+    def _forward(self, **kwargs):
+        if self.autocast_dtype is None:
+            return self.model(**kwargs)
+        with torch.autocast(self.model.device.type, dtype=self.autocast_dtype):
+            return self.model(**kwargs)
+
+    def _select(self, logits: torch.Tensor, jobs: List[GenerationJob]) -> torch.Tensor:
+        if not self.do_sample:
+            return logits.argmax(dim=-1)
+        temperatures = torch.tensor(
+            [max(job.temperature, 1e-5) for job in jobs], device=logits.device
+        ).unsqueeze(1)
+        probs = torch.softmax(logits.float() / temperatures, dim=-1)
+        return torch.multinomial(probs, num_samples=1).squeeze(1)
+
+    def _record(self, jobs: List[GenerationJob], tokens: torch.Tensor) -> List[int]:
+        """
+        Append the new token to each job, resolve finished jobs and return the
+        row indices that are still generating.
+        """
+        keep = []
+        for row, (job, token) in enumerate(zip(jobs, tokens.tolist())):
+            if self._skip_cancelled(job):
+                continue
+            job.output_ids.append(token)
+            if len(job.output_ids) == 1 and job.timing is not None:
+                endpoint, arrived_at = job.timing
+                ttft = time.monotonic() - arrived_at
+                TIME_TO_FIRST_TOKEN.labels(endpoint=endpoint).observe(ttft)
+                record_stage(job.log_fields, "first_token", ttft)
+            if job.on_token is not None:
+                self._notify(job, token)
+            if token in self.eos_token_ids or len(job.output_ids) >= job.max_new_tokens:
+                self._finish(job)
+            else:
+                keep.append(row)
+        return keep
+
+    def _finish(self, job: GenerationJob):
+        generated = len(job.output_ids)
+        INFERENCE_TOKENS.labels(kind="output").inc(generated)
+        if job.decode_span is not None:
+            job.decode_span.set_attribute("generated_tokens", generated)
+        now = time.monotonic()
+        elapsed = now - job.prefill_started_at
+        # Jobs that finish on their first token never reach the decode stage
+        if job.decode_started_at is not None:
+            record_stage(job.log_fields, "decode", now - job.decode_started_at)
+        if elapsed > 0:
+            GENERATION_TOKENS_PER_SECOND.observe(generated / elapsed)
+        self._resolve(job, result=job.input_ids + job.output_ids)
+
+    def _merge(self, jobs, past, attention_mask, next_tokens):
+        """
+        Append freshly prefilled rows to the running batch, left-padding both
+        sides to a common sequence length.
+        """
+        if not self._jobs:
+            self._jobs = list(jobs)
+            self._past = past
+            self._attention_mask = attention_mask
+            self._next_tokens = next_tokens
+            return
+
+        width = max(self._attention_mask.shape[1], attention_mask.shape[1])
+        old_past = _left_pad_cache(self._past, width)
+        new_past = _left_pad_cache(past, width)
+        self._past = tuple(
+            tuple(torch.cat([o, n], dim=0) for o, n in zip(old_layer, new_layer))
+            for old_layer, new_layer in zip(old_past, new_past)
+        )
+        self._attention_mask = torch.cat(
+            [_left_pad_mask(self._attention_mask, width), _left_pad_mask(attention_mask, width)],
+            dim=0,
+        )
+        self._next_tokens = torch.cat([self._next_tokens, next_tokens], dim=0)
+        self._jobs.extend(jobs)
+
+    def _retain(self, keep: List[int]):
+        """
+        Drop finished rows from the running batch and trim padding columns
+        that no remaining sequence attends to.
+        """
+        if not keep:
+            self._reset()
+            return
+        if len(keep) < len(self._jobs):
+            index = torch.tensor(keep, device=self._attention_mask.device)
+            self._jobs = [self._jobs[i] for i in keep]
+            self._past = _map_cache(self._past, lambda t: t.index_select(0, index))
+            self._attention_mask = self._attention_mask.index_select(0, index)
+            self._next_tokens = self._next_tokens.index_select(0, index)
+
+        start = int(self._attention_mask.any(dim=0).nonzero()[0])
+        if start > 0:
+            self._past = _map_cache(self._past, lambda t: t[..., start:, :])
+            self._attention_mask = self._attention_mask[:, start:]
+
+    def _reset(self):
+        self._jobs = []
+        self._past = None
+        self._attention_mask = None
+        self._next_tokens = None
+
+    @staticmethod
+    def _notify(job: GenerationJob, token: int):
+        try:
+            job.loop.call_soon_threadsafe(job.on_token, token)
+        except RuntimeError:
+            pass
+
+    @staticmethod
+    def _resolve(job: GenerationJob, result=None, error: Optional[BaseException] = None):
+        job.finished = True
+        if job.decode_span is not None:
+            if error is not None and not isinstance(error, asyncio.CancelledError):
+                job.decode_span.record_exception(error)
+            job.decode_span.end()
+            job.decode_span = None
+
+        def _set():
+            if not job.future.done():
+                if isinstance(error, asyncio.CancelledError):
+                    job.future.cancel()
+                elif error is not None:
+                    job.future.set_exception(error)
+                else:
+                    job.future.set_result(result)
+            if job.on_token is not None:
+                job.on_token(None)
+
+        try:
+            job.loop.call_soon_threadsafe(_set)
+        except RuntimeError:
+            # The request's event loop has already shut down
+            pass
@@ -0,0 +1,152 @@
+# serving/bench_precision.py
+#
+# Compare inference precisions on a fixed prompt set:
+#   python -m serving.bench_precision --model_dir ./model --output precision.json
+
+import argparse
+import json
+import logging
+import multiprocessing
+import resource
+import time
+from typing import Any, Dict, List
+
+import torch
+
+from serving.model_loader import PRECISIONS, load_model, precision_context
+
+DEFAULT_PROMPTS = [
+    "Summarize the following support ticket in one sentence:",
+    "Write a short product description for a stainless steel water bottle.",
+    "Explain the difference between a process and a thread.",
+    "Translate to French: The meeting has been moved to Thursday afternoon.",
+    "List three risks of deploying a model without monitoring.",
+    "Q: What is the capital of Australia?\nA:",
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark fp32 / bf16 / int8 inference on a fixed prompt set"
+    )
+    parser.add_argument("--model_dir", type=str, default="./model", help="Model to benchmark")
+    parser.add_argument(
+        "--precisions",
+        type=str,
+        default=",".join(PRECISIONS),
+        help="Comma-separated precisions to compare; fp32 is always the reference"
+    )
+    parser.add_argument("--max_new_tokens", type=int, default=32, help="Tokens per prompt")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed passes over the prompts")
+    parser.add_argument("--threads", type=int, default=0, help="torch threads (0 = default)")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON")
+    return parser.parse_args()
+
+
+def _run_precision(model_dir: str, precision: str, prompts: List[str], max_new_tokens: int,
+                   repeats: int, threads: int) -> Dict[str, Any]:
+    """
+    Load the model at one precision and time greedy generation. Runs in its
+    own process so that RSS reflects this precision only.
+    """
+    if threads:
+        torch.set_num_threads(threads)
+    load_started = time.monotonic()
+    tokenizer, model = load_model(model_dir, precision=precision)
+    load_seconds = time.monotonic() - load_started
+
+    outputs: List[List[int]] = []
+    latencies: List[float] = []
+    generated = 0
+    with torch.inference_mode(), precision_context(precision, model.device.type):
+        # One untimed pass warms up kernels and the allocator
+        for repeat in range(repeats + 1):
+            for prompt in prompts:
+                inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
+                started = time.monotonic()
+                out = model.generate(**inputs, max_new_tokens=max_new_tokens, do_sample=False)
+                elapsed = time.monotonic() - started
+                new_tokens = out[0, inputs["input_ids"].shape[1]:].tolist()
+                if repeat == 0:
+                    outputs.append(new_tokens)
+                else:
+                    latencies.append(elapsed)
+                    generated += len(new_tokens)
+
+    latencies.sort()
+    return {
+        "precision": precision,
+        "load_seconds": round(load_seconds, 3),
+        "latency_p50_seconds": round(latencies[len(latencies) // 2], 4),
+        "latency_p95_seconds": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 4),
+        "tokens_per_second": round(generated / sum(latencies), 2),
+        # ru_maxrss is reported in KiB on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "outputs": outputs,
+    }
+
+
+def _drift(reference: List[List[int]], candidate: List[List[int]]) -> Dict[str, float]:
+    """
+    How far greedy outputs diverge from the fp32 reference.
+    """
+    exact = 0
+    prefix_fractions = []
+    for ref, cand in zip(reference, candidate):
+        exact += ref == cand
+        common = 0
+        for a, b in zip(ref, cand):
+            if a != b:
+                break
+            common += 1
+        prefix_fractions.append(common / max(len(ref), 1))
+    return {
+        "exact_match_rate": round(exact / len(reference), 3),
+        "mean_common_prefix": round(sum(prefix_fractions) / len(prefix_fractions), 3),
+    }
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s — %(levelname)s — %(message)s")
+    precisions = [p.strip() for p in args.precisions.split(",") if p.strip()]
+    if "fp32" not in precisions:
+        precisions.insert(0, "fp32")
+
+    # A fresh interpreter per precision keeps RSS and thread pools independent
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    for precision in precisions:
+        with ctx.Pool(1) as pool:
+            result = pool.apply(
+                _run_precision,
+                (args.model_dir, precision, DEFAULT_PROMPTS, args.max_new_tokens,
+                 args.repeats, args.threads)
+            )
+        results.append(result)
+        logging.info(
+            f"{precision}: {result['tokens_per_second']} tok/s, "
+            f"p50 {result['latency_p50_seconds']}s, peak RSS {result['peak_rss_mb']} MB"
+        )
+
+    reference = next(r for r in results if r["precision"] == "fp32")["outputs"]
+    for result in results:
+        result["drift_vs_fp32"] = _drift(reference, result.pop("outputs"))
+
+    report = {
+        "model_dir": args.model_dir,
+        "max_new_tokens": args.max_new_tokens,
+        "repeats": args.repeats,
+        "num_prompts": len(DEFAULT_PROMPTS),
+        "torch_threads": torch.get_num_threads() if not args.threads else args.threads,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+# serving/bench_serving.py
+#
+# Closed-loop benchmark of the serving stack over HTTP, on a tiny randomly
+# initialised model by default (no network or GPU needed):
+#   python -m serving.bench_serving --output bench.json
+#   python -m serving.bench_serving --baseline bench.json --output bench-new.json
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import string
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import yaml
+
+# name -> [(weight, (min, max) prompt tokens, (min, max) output tokens)]
+WORKLOADS: Dict[str, List[Tuple[float, Tuple[int, int], Tuple[int, int]]]] = {
+    "short": [(1.0, (8, 32), (8, 32))],
+    "long_prompt": [(1.0, (256, 512), (8, 32))],
+    "long_output": [(1.0, (8, 32), (128, 256))],
+    "mixed": [
+        (0.7, (8, 64), (8, 64)),
+        (0.2, (256, 512), (16, 64)),
+        (0.1, (64, 128), (128, 256)),
+    ],
+}
+
+BENCH_API_KEY = "bench-key"
+
+# Serving settings for the benchmarked server; responses must not be served
+# from cache, and warmup mirrors what a deployment would do
+SERVING_SETTINGS = {
+    "response_cache_enabled": False,
+    "warmup_prompt_lengths": [16, 128, 512],
+    "warmup_max_new_tokens": 8,
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Sweep workloads and concurrency against a local FluxPilot server"
+    )
+    parser.add_argument(
+        "--model_dir", type=str, default=None,
+        help="Model to serve; a tiny random model is generated when omitted"
+    )
+    parser.add_argument(
+        "--workloads", type=str, default=",".join(WORKLOADS),
+        help=f"Comma-separated prompt/output length distributions ({', '.join(WORKLOADS)})"
+    )
+    parser.add_argument(
+        "--concurrency", type=str, default="1,4,16",
+        help="Comma-separated numbers of concurrent clients"
+    )
+    parser.add_argument(
+        "--requests", type=int, default=64,
+        help="Requests per (workload, concurrency) level; at least 4x the concurrency"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed for workloads and model")
+    parser.add_argument("--port", type=int, default=8765, help="Port for the benchmarked server")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON")
+    parser.add_argument(
+        "--baseline", type=str, default=None,
+        help="Earlier --output file to report changes against"
+    )
+    return parser.parse_args()
+
+
+def make_tiny_model(
+    path: str,
+    hidden_size: int = 64,
+    num_layers: int = 2,
+    max_positions: int = 256,
+    seed: int = 0,
+) -> str:
+    """
+    Save a randomly initialised Llama with a character-level tokenizer to
+    ``path``, laid out like a real model directory (config, weights,
+    tokenizer files).
+    """
+    import torch
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+    from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+    vocab = {"<unk>": 0, "<s>": 1, "</s>": 2}
+    for ch in string.printable:
+        vocab.setdefault(ch, len(vocab))
+    backend = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+    backend.pre_tokenizer = pre_tokenizers.Split("", "isolated")
+    backend.decoder = decoders.Fuse()
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=backend, unk_token="<unk>", bos_token="<s>", eos_token="</s>"
+    )
+
+    torch.manual_seed(seed)
+    config = LlamaConfig(
+        vocab_size=len(vocab), hidden_size=hidden_size, intermediate_size=hidden_size * 2,
+        num_hidden_layers=num_layers, num_attention_heads=4, num_key_value_heads=4,
+        max_position_embeddings=max_positions, bos_token_id=1, eos_token_id=2,
+    )
+    LlamaForCausalLM(config).save_pretrained(path)
+    tokenizer.save_pretrained(path)
+    return str(path)
+
+
+def sample_requests(workload: str, n: int, tokenizer, seed: int) -> List[Dict[str, Any]]:
+    """
+    ``n`` request bodies drawn from a workload's length distribution. The
+    same seed always yields the same requests.
+    """
+    rng = random.Random(f"{workload}:{seed}")
+    components = WORKLOADS[workload]
+    weights = [weight for weight, _, _ in components]
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9))) for _ in range(512)]
+
+    requests = []
+    for _ in range(n):
+        _, (p_min, p_max), (o_min, o_max) = rng.choices(components, weights)[0]
+        prompt_tokens = rng.randint(p_min, p_max)
+        # Plenty of words, then cut to the exact token length
+        text = " ".join(rng.choices(words, k=prompt_tokens))
+        ids = tokenizer(text, add_special_tokens=False)["input_ids"][:prompt_tokens]
+        requests.append({
+            "prompt": tokenizer.decode(ids),
+            "max_new_tokens": rng.randint(o_min, o_max),
+            "temperature": 1.0,
+        })
+    return requests
+
+
+def _percentile(sorted_values: Sequence[float], q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * len(sorted_values))) - 1))
+    return round(sorted_values[index], 4)
+
+
+def _memory_mb(pid: int) -> Dict[str, Optional[float]]:
+    """
+    Current and peak RSS of ``pid`` (Linux only).
+    """
+    fields = {"VmRSS": None, "VmHWM": None}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in fields:
+                    fields[key] = round(int(value.split()[0]) / 1024, 1)
+    except OSError:
+        pass
+    return {"rss_mb": fields["VmRSS"], "peak_rss_mb": fields["VmHWM"]}
+
+
+def _output_tokens(metrics_text: str) -> float:
+    from prometheus_client.parser import text_string_to_metric_families
+
+    for family in text_string_to_metric_families(metrics_text):
+        for sample in family.samples:
+            if sample.name == "fluxpilot_inference_tokens_total" and sample.labels.get("kind") == "output":
+                return sample.value
+    return 0.0
+
+
+class Server:
+    """
+    The FluxPilot app under uvicorn in a child process.
+    """
+
+    def __init__(self, model_dir: str, port: int, workdir: str):
+        self.url = f"http://127.0.0.1:{port}"
+        config_file = os.path.join(workdir, "config.yaml")
+        with open(config_file, "w") as f:
+            yaml.safe_dump({"default": {"serving": {"model_dir": model_dir, **SERVING_SETTINGS}}}, f)
+        env = {
+            **os.environ,
+            "CONFIG_FILE": config_file,
+            "SERVE_MODEL_DIR": model_dir,
+            "API_KEYS": BENCH_API_KEY,
+        }
+        self.log_path = os.path.join(workdir, "server.log")
+        self._log = open(self.log_path, "w")
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "serving.app:app",
+             "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+            env=env, stdout=self._log, stderr=subprocess.STDOUT,
+        )
+
+    async def wait_ready(self, client, timeout: float = 300):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                break
+            try:
+                if (await client.get("/ready")).status_code == 200:
+                    return
+            except Exception:
+                pass
+            await asyncio.sleep(0.5)
+        raise RuntimeError(f"Server did not become ready, see {self.log_path}")
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self._log.close()
+
+
+async def _one_request(client, body: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Stream one generation; TTFT is the time until the first text frame.
+    """
+    started = time.monotonic()
+    ttft = None
+    async with client.stream("POST", "/generate/stream", json=body) as response:
+        async for line in response.aiter_lines():
+            if ttft is None and line.startswith("data:") and "[DONE]" not in line:
+                ttft = time.monotonic() - started
+        status = response.status_code
+    return {"status": status, "latency": time.monotonic() - started, "ttft": ttft}
+
+
+async def run_level(client, requests: List[Dict[str, Any]], concurrency: int) -> Dict[str, Any]:
+    """
+    Send ``requests`` from ``concurrency`` clients, each issuing its next
+    request as soon as the previous one completes.
+    """
+    pending = iter(requests)
+    records: List[Dict[str, Any]] = []
+
+    async def worker():
+        for body in pending:
+            try:
+                records.append(await _one_request(client, body))
+            except Exception as e:
+                records.append({"status": type(e).__name__, "latency": None, "ttft": None})
+
+    tokens_before = _output_tokens((await client.get("/metrics")).text)
+    started = time.monotonic()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    wall = time.monotonic() - started
+    tokens = _output_tokens((await client.get("/metrics")).text) - tokens_before
+
+    ok = [r for r in records if r["status"] == 200]
+    latencies = sorted(r["latency"] for r in ok)
+    ttfts = sorted(r["ttft"] for r in ok if r["ttft"] is not None)
+    errors: Dict[str, int] = {}
+    for r in records:
+        if r["status"] != 200:
+            errors[str(r["status"])] = errors.get(str(r["status"]), 0) + 1
+    return {
+        "requests": len(records),
+        "errors": errors,
+        "wall_seconds": round(wall, 3),
+        "requests_per_second": round(len(ok) / wall, 3),
+        "output_tokens_per_second": round(tokens / wall, 2),
+        **{f"ttft_p{q}_seconds": _percentile(ttfts, q) for q in (50, 95, 99)},
+        **{f"latency_p{q}_seconds": _percentile(latencies, q) for q in (50, 95, 99)},
+    }
+
+
+def _compare(results: List[Dict[str, Any]], baseline: Dict[str, Any]):
+    """
+    Attach relative changes against matching levels of a baseline report.
+    """
+    previous = {(r["workload"], r["concurrency"]): r for r in baseline.get("results", [])}
+    for result in results:
+        before = previous.get((result["workload"], result["concurrency"]))
+        if before is None:
+            continue
+        delta = {}
+        for key in ("output_tokens_per_second", "ttft_p95_seconds", "latency_p95_seconds",
+                    "peak_rss_mb"):
+            if before.get(key) and result.get(key) is not None:
+                delta[key] = round(result[key] / before[key] - 1, 4)
+        result["vs_baseline"] = delta
+        logging.info(
+            f"{result['workload']} x{result['concurrency']} vs baseline: "
+            + ", ".join(f"{key} {value:+.1%}" for key, value in delta.items())
+        )
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def _run(args, model_dir: str, workdir: str) -> List[Dict[str, Any]]:
+    import httpx
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    workloads = [w.strip() for w in args.workloads.split(",") if w.strip()]
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+
+    server = Server(model_dir, args.port, workdir)
+    results = []
+    try:
+        async with httpx.AsyncClient(
+            base_url=server.url, headers={"X-API-KEY": BENCH_API_KEY}, timeout=600
+        ) as client:
+            await server.wait_ready(client)
+            for workload in workloads:
+                for concurrency in levels:
+                    n = max(args.requests, 4 * concurrency)
+                    requests = sample_requests(workload, n, tokenizer, args.seed)
+                    result = {
+                        "workload": workload,
+                        "concurrency": concurrency,
+                        **await run_level(client, requests, concurrency),
+                        **_memory_mb(server.process.pid),
+                    }
+                    results.append(result)
+                    logging.info(
+                        f"{workload} x{concurrency}: {result['output_tokens_per_second']} tok/s, "
+                        f"TTFT p50 {result['ttft_p50_seconds']}s, "
+                        f"latency p95 {result['latency_p95_seconds']}s, RSS {result['rss_mb']} MB"
+                    )
+    finally:
+        server.stop()
+    return results
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s — %(levelname)s — %(message)s")
+    # One line per request would drown the per-level summaries
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory(prefix="fluxpilot-bench-") as workdir:
+        model_dir = args.model_dir
+        model = {"model_dir": model_dir}
+        if model_dir is None:
+            tiny = {"hidden_size": 256, "num_layers": 4, "max_positions": 1024}
+            model_dir = make_tiny_model(os.path.join(workdir, "model"), seed=args.seed, **tiny)
+            model = {"tiny_random": tiny}
+        results = asyncio.run(_run(args, model_dir, workdir))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            _compare(results, json.load(f))
+
+    import torch
+
+    report = {
+        "git_commit": _git_commit(),
+        "model": model,
+        "seed": args.seed,
+        "workloads": {name: WORKLOADS[name] for name in args.workloads.split(",") if name in WORKLOADS},
+        "serving_settings": SERVING_SETTINGS,
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "torch_threads": torch.get_num_threads(),
+            "cpu_count": os.cpu_count(),
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
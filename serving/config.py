@@ -2,7 +2,7 @@
 
 import os
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, List, Literal, Optional
 
 import yaml
 from pydantic import BaseSettings, Field
@@ -13,8 +13,72 @@ class ServingSettings(BaseSettings):
     host: str = Field("0.0.0.0", env="SERVE_HOST")
     port: int = Field(8080, env="SERVE_PORT")
     workers: int = Field(4, env="GUNICORN_WORKERS")
+    # Load weights once in the Gunicorn master and share them with workers
+    preload_model: bool = Field(False, env="SERVE_PRELOAD_MODEL")
+    # Inference precision applied at load time: fp32, bf16 (autocast) or int8
+    # (dynamic quantization of Linear layers); compare with serving.bench_precision
+    precision: Literal["fp32", "bf16", "int8"] = Field("fp32", env="SERVE_PRECISION")
+    # Speculative decoding: a small draft model sharing the tokenizer proposes
+    # num_draft_tokens tokens that the main model verifies in one pass; only
+    # with max_batch_size 1, as it bypasses the batching engine
+    draft_model_dir: Optional[str] = Field(None, env="SERVE_DRAFT_MODEL_DIR")
+    # LoRA adapter applied on top of model_dir, merged into the weights at load
+    # time or kept attached. A model_dir holding only an adapter is loaded on
+    # base_model_dir (default: the base recorded in its adapter_config.json)
+    adapter_dir: Optional[str] = Field(None, env="SERVE_ADAPTER_DIR")
+    adapter_mode: Literal["merge", "attach"] = Field("merge", env="SERVE_ADAPTER_MODE")
+    base_model_dir: Optional[str] = Field(None, env="SERVE_BASE_MODEL_DIR")
+    num_draft_tokens: int = Field(4, env="SERVE_NUM_DRAFT_TOKENS")
     api_key_header: str = Field("X-API-KEY", env="API_KEY_HEADER")
     secrets_manager_key: str = Field("/fluxpilot/api_keys", env="AUTH_SECRETS_MANAGER_KEY")
+    api_key_refresh_seconds: int = Field(60, env="AUTH_KEY_REFRESH_SECONDS")
+    api_key_refresh_jitter: float = Field(0.1, env="AUTH_KEY_REFRESH_JITTER")
+    # Continuous micro-batching
+    max_batch_size: int = Field(8, env="SERVE_MAX_BATCH_SIZE")
+    batch_wait_ms: int = Field(10, env="SERVE_BATCH_WAIT_MS")
+    max_batch_request_size: int = Field(512, env="SERVE_MAX_BATCH_REQUEST_SIZE")
+    # Prompt prefix KV-cache (0 MB disables it)
+    prefix_cache_mb: int = Field(256, env="SERVE_PREFIX_CACHE_MB")
+    prefix_cache_block_size: int = Field(16, env="SERVE_PREFIX_CACHE_BLOCK_SIZE")
+    prefix_cache_min_tokens: int = Field(32, env="SERVE_PREFIX_CACHE_MIN_TOKENS")
+    # Response cache for deterministic (greedy) generations
+    response_cache_enabled: bool = Field(True, env="SERVE_RESPONSE_CACHE_ENABLED")
+    response_cache_max_entries: int = Field(1024, env="SERVE_RESPONSE_CACHE_MAX_ENTRIES")
+    response_cache_ttl_seconds: int = Field(300, env="SERVE_RESPONSE_CACHE_TTL_SECONDS")
+    response_cache_dir: Optional[str] = Field(None, env="SERVE_RESPONSE_CACHE_DIR")
+    # Inference executor & backpressure
+    executor_workers: int = Field(2, env="SERVE_EXECUTOR_WORKERS")
+    max_queue_size: int = Field(64, env="SERVE_MAX_QUEUE_SIZE")
+    retry_after_seconds: int = Field(1, env="SERVE_RETRY_AFTER_SECONDS")
+    # Admission control, in estimated tokens (prompt + max_new_tokens): the
+    # budget admitted at once (0 = unbounded), a per-API-key token bucket
+    # (rate 0 = no rate limit) and a default deadline for requests without one
+    admission_max_tokens_in_flight: int = Field(16384, env="SERVE_ADMISSION_MAX_TOKENS_IN_FLIGHT")
+    rate_limit_tokens_per_second: float = Field(0.0, env="SERVE_RATE_LIMIT_TOKENS_PER_SECOND")
+    rate_limit_burst_tokens: int = Field(16384, env="SERVE_RATE_LIMIT_BURST_TOKENS")
+    default_deadline_ms: Optional[int] = Field(None, env="SERVE_DEFAULT_DEADLINE_MS")
+    # Warmup generations run before /ready reports ready ([] disables)
+    warmup_prompt_lengths: List[int] = Field([16, 128, 512], env="SERVE_WARMUP_PROMPT_LENGTHS")
+    warmup_max_new_tokens: int = Field(8, env="SERVE_WARMUP_MAX_NEW_TOKENS")
+    # Hot-swap: poll a registry alias/stage (models:/Name@alias, models:/Name/Stage)
+    # or a local directory, and swap in new versions without a restart
+    reload_source: Optional[str] = Field(None, env="SERVE_RELOAD_SOURCE")
+    reload_interval_seconds: int = Field(60, env="SERVE_RELOAD_INTERVAL_SECONDS")
+    reload_download_dir: str = Field("/tmp/fluxpilot-models", env="SERVE_RELOAD_DOWNLOAD_DIR")
+    reload_drain_seconds: int = Field(300, env="SERVE_RELOAD_DRAIN_SECONDS")
+    # Logging: JSON records are written by a background thread from a queue
+    # of log_queue_size records (new records are dropped when it is full);
+    # log_sample_rates keeps a fraction of INFO records per logger
+    log_level: str = Field("INFO", env="SERVE_LOG_LEVEL")
+    log_queue_size: int = Field(10000, env="SERVE_LOG_QUEUE_SIZE")
+    log_sample_rates: Dict[str, float] = Field({}, env="SERVE_LOG_SAMPLE_RATES")
+    access_log_skip_paths: List[str] = Field(
+        ["/metrics", "/healthz", "/ready"], env="SERVE_ACCESS_LOG_SKIP_PATHS"
+    )
+    # Fraction of new traces recorded (child spans follow their parent's decision)
+    trace_sample_ratio: float = Field(1.0, env="OTEL_TRACES_SAMPLER_ARG")
+    # Longest torch.profiler capture /admin/profile will run
+    profile_max_seconds: int = Field(60, env="SERVE_PROFILE_MAX_SECONDS")
 
 
 class Config:
@@ -0,0 +1,89 @@
+# serving/executor.py
+
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from serving.metrics import INFERENCE_QUEUE_DEPTH, INFERENCE_QUEUE_WAIT, INFERENCE_REJECTED
+
+
+class QueueFullError(Exception):
+    """
+    Raised when an inference queue is at capacity and the request is shed.
+    """
+
+    def __init__(self, queue_name: str, retry_after: int):
+        super().__init__(f"Inference queue '{queue_name}' is full")
+        self.queue_name = queue_name
+        self.retry_after = retry_after
+
+
+class InferenceExecutor:
+    """
+    Bounded thread pool for blocking tokenizer/model calls made from async
+    endpoints, so that a long call never stalls the event loop.
+
+    At most ``max_workers`` calls run at once and at most ``max_queue_size``
+    more wait for a thread; anything beyond that raises ``QueueFullError``
+    instead of letting latency grow without limit.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 2,
+        max_queue_size: int = 64,
+        retry_after: int = 1,
+        name: str = "executor",
+    ):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.retry_after = retry_after
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=f"fluxpilot-{name}"
+        )
+        self._lock = threading.Lock()
+        self._waiting = 0
+
+    @property
+    def depth(self) -> int:
+        """Number of calls waiting for a free thread."""
+        return self._waiting
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Run ``fn(*args, **kwargs)`` on the pool and await its result.
+        """
+        with self._lock:
+            if self._waiting >= self.max_queue_size:
+                INFERENCE_REJECTED.labels(queue=self.name).inc()
+                raise QueueFullError(self.name, self.retry_after)
+            self._waiting += 1
+            INFERENCE_QUEUE_DEPTH.labels(queue=self.name).set(self._waiting)
+
+        enqueued_at = time.monotonic()
+
+        def _call():
+            with self._lock:
+                self._waiting -= 1
+                INFERENCE_QUEUE_DEPTH.labels(queue=self.name).set(self._waiting)
+            INFERENCE_QUEUE_WAIT.labels(queue=self.name).observe(time.monotonic() - enqueued_at)
+            return fn(*args, **kwargs)
+
+        # Carry contextvars (e.g. the active trace span) into the worker thread
+        submitted = self._pool.submit(contextvars.copy_context().run, _call)
+        try:
+            return await asyncio.wrap_future(submitted)
+        except asyncio.CancelledError:
+            # A call cancelled before reaching a thread must give its slot back
+            if submitted.cancel():
+                with self._lock:
+                    self._waiting -= 1
+                    INFERENCE_QUEUE_DEPTH.labels(queue=self.name).set(self._waiting)
+            raise
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait)
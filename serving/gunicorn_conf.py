@@ -1,13 +1,50 @@
 # serving/gunicorn_conf.py
 
 # Gunicorn configuration for production
-# Save as: fluxpilot-llm-pipeline/serving/gunicorn_conf.py
+# Run from the repository root: gunicorn -c serving/gunicorn_conf.py serving.app:app
 
-bind = "0.0.0.0:8080"
-workers = 4
+import os
+
+from serving.config import Config
+
+_settings = Config().serving_cfg
+
+bind = f"{_settings.host}:{_settings.port}"
+workers = _settings.workers
 worker_class = "uvicorn.workers.UvicornWorker"
 timeout = 120
 keepalive = 5
 accesslog = "-"        # stdout
 errorlog = "-"         # stdout
 loglevel = "info"
+
+# Import the app (and load the model) once in the master; workers inherit
+# the already-loaded, shared weights through fork instead of loading their own
+preload_app = _settings.preload_model
+
+
+def on_starting(server):
+    # With preload_app the master has already imported serving.app, which
+    # defers model loading; load the weights now, before any worker forks
+    if preload_app:
+        from serving import app
+
+        app.preload()
+
+
+def post_fork(server, worker):
+    # Split the CPU cores between workers so their intra-op thread pools
+    # don't oversubscribe the node
+    import torch
+
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    torch.set_num_threads(threads)
+    server.log.info(f"Worker {worker.pid} using {threads} torch threads")
+
+
+def child_exit(server, worker):
+    # Drop the exited worker's live gauges from the aggregated /metrics
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
@@ -1,19 +1,164 @@
 # serving/logging.py
 
+import atexit
+import contextlib
+import contextvars
+import copy
 import logging
+import logging.handlers
+import os
+import queue
+import random
 import sys
+import time
+import uuid
+from typing import Any, Dict, Iterable, Optional
+
 from pythonjsonlogger import jsonlogger
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from serving.metrics import LOG_RECORDS_DROPPED
+
+access_logger = logging.getLogger("serve.access")
+
+# Fields of the access log entry for the request being handled. The dict is
+# shared (not copied) with executor threads and engine jobs started by the
+# request, which fill in token counts and stage timings.
+_request_fields: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar(
+    "request_fields", default=None
+)
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional["DroppingQueueHandler"] = None
+
+
+def request_fields() -> Optional[Dict[str, Any]]:
+    """
+    The current request's access log fields, or None outside a request.
+    """
+    return _request_fields.get()
+
+
+def log_fields(**fields):
+    """
+    Add fields (e.g. ``input_tokens``) to the current request's access log entry.
+    """
+    current = _request_fields.get()
+    if current is not None:
+        current.update(fields)
+
+
+def record_stage(fields: Optional[Dict[str, Any]], stage: str, seconds: float):
+    """
+    Record a stage timing in ``fields`` (see ``request_fields``). When a
+    stage runs several times in parallel, e.g. for each item of a batch
+    request, the longest is kept.
+    """
+    if fields is None:
+        return
+    stages = fields.setdefault("stages_ms", {})
+    stages[stage] = max(stages.get(stage, 0.0), round(seconds * 1000, 3))
+
+
+@contextlib.contextmanager
+def log_stage(stage: str):
+    """
+    Time the block as ``stage`` of the current request (see ``record_stage``).
+    """
+    fields = _request_fields.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(fields, stage, time.perf_counter() - started)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep only a fraction of INFO-and-below records from selected loggers.
+    ``rates`` maps a logger name to the fraction kept; it also applies to
+    the logger's children. Warnings and errors are never sampled out.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = dict(rates)
+
+    def _rate(self, name: str) -> float:
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition(".")[0]
+        return 1.0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        if rate >= 1.0 or random.random() < rate:
+            return True
+        LOG_RECORDS_DROPPED.labels(reason="sampled").inc()
+        return False
+
 
-def setup_logging():
+class RequestIdFilter(logging.Filter):
     """
-    Configure root logger to output structured JSON logs to stdout.
+    Stamp every record logged while handling a request with its request ID.
     """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        fields = _request_fields.get()
+        if fields is not None and not hasattr(record, "request_id"):
+            record.request_id = fields.get("request_id")
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hand records to a bounded queue drained by a background thread. When
+    the queue is full the record is dropped and counted; logging never
+    blocks the caller.
+    """
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.labels(reason="queue_full").inc()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only merge the message arguments here; JSON formatting happens on
+        # the writer thread. The traceback is rendered now because exc_info
+        # holds frames that can't outlive this call.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(
+    level: str = "INFO",
+    queue_size: int = 10000,
+    sample_rates: Optional[Dict[str, float]] = None,
+) -> logging.handlers.QueueListener:
+    """
+    Configure the root logger to emit structured JSON to stdout from a
+    background thread: callers only put records on a bounded queue (see
+    ``DroppingQueueHandler``), optionally sampled per logger (see
+    ``SamplingFilter``). The writer is restarted in forked children.
+    """
+    global _listener, _queue_handler
     root_logger = logging.getLogger()
-    root_logger.setLevel(logging.INFO)
+    root_logger.setLevel(level)
 
-    # Remove any existing handlers
+    # Remove any existing handlers (including a previous setup_logging call)
     for handler in list(root_logger.handlers):
         root_logger.removeHandler(handler)
+    if _listener is not None:
+        _listener.stop()
 
     # Create and configure JSON formatter
     log_handler = logging.StreamHandler(sys.stdout)
@@ -22,5 +167,93 @@ def setup_logging():
     )
     log_handler.setFormatter(formatter)
 
+    _queue_handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    _queue_handler.addFilter(SamplingFilter(sample_rates or {}))
+    _queue_handler.addFilter(RequestIdFilter())
+    _listener = logging.handlers.QueueListener(
+        _queue_handler.queue, log_handler, respect_handler_level=True
+    )
+    _listener.start()
+
     # Attach handler
-    root_logger.addHandler(log_handler)
+    root_logger.addHandler(_queue_handler)
+    return _listener
+
+
+def _stop_listener():
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+
+def _restart_after_fork():
+    # The writer thread isn't inherited by a forked worker (and the queue's
+    # lock may have been held at fork time): give the child its own
+    global _listener
+    if _listener is None:
+        return
+    _queue_handler.queue = queue.Queue(maxsize=_queue_handler.queue.maxsize)
+    _listener = logging.handlers.QueueListener(
+        _queue_handler.queue, *_listener.handlers, respect_handler_level=True
+    )
+    _listener.start()
+
+
+atexit.register(_stop_listener)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+class RequestLogMiddleware:
+    """
+    Pure ASGI middleware that assigns each request an ID (the client's
+    ``X-Request-ID`` if it sent one), returns it in the ``X-Request-ID``
+    response header, and writes one ``serve.access`` entry per request with
+    its status, duration and whatever the handlers added through
+    ``log_fields`` / ``record_stage`` (token counts, stage timings). Server
+    errors are logged as warnings so that sampling never drops them.
+    """
+
+    def __init__(self, app: ASGIApp, skip_paths: Iterable[str] = ()):
+        self.app = app
+        self.skip_paths = frozenset(skip_paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope.get("headers", ()):
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:128]
+                break
+        fields: Dict[str, Any] = {"request_id": request_id or uuid.uuid4().hex}
+        token = _request_fields.set(fields)
+        status = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", ()))
+                headers.append((b"x-request-id", fields["request_id"].encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_fields.reset(token)
+            duration_ms = round((time.perf_counter() - started) * 1000, 3)
+            access_logger.log(
+                logging.WARNING if status >= 500 else logging.INFO,
+                f"{scope['method']} {scope['path']} {status}",
+                extra={
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": status,
+                    "duration_ms": duration_ms,
+                    **fields,
+                },
+            )
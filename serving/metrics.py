@@ -1,8 +1,23 @@
 # serving/metrics.py
 
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
-from fastapi import Response, Request
-from starlette.middleware.base import BaseHTTPMiddleware
+import contextvars
+import os
+import resource
+import time
+from typing import Callable, Optional, Tuple
+
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    CONTENT_TYPE_LATEST,
+)
+from fastapi import Response
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 # Metrics definitions
 REQUEST_COUNT = Counter(
@@ -15,29 +30,283 @@ REQUEST_LATENCY = Histogram(
     "Latency of HTTP requests in seconds",
     ["method", "endpoint"]
 )
+INFERENCE_QUEUE_DEPTH = Gauge(
+    "fluxpilot_inference_queue_depth",
+    "Requests waiting for an inference thread or batch slot",
+    ["queue"]
+)
+INFERENCE_QUEUE_WAIT = Histogram(
+    "fluxpilot_inference_queue_wait_seconds",
+    "Time requests spend queued before inference starts",
+    ["queue"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+GENERATION_CANCELLED = Counter(
+    "fluxpilot_generation_cancelled_total",
+    "Generations abandoned because the client disconnected"
+)
+TIME_TO_FIRST_TOKEN = Histogram(
+    "fluxpilot_time_to_first_token_seconds",
+    "Time from request arrival until the engine produces the first generated token",
+    ["endpoint"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+PREFILL_PADDING_EFFICIENCY = Histogram(
+    "fluxpilot_prefill_padding_efficiency",
+    "Fraction of prefill batch positions holding real (non-padding) tokens",
+    buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 1.0)
+)
+PREFIX_CACHE_LOOKUPS = Counter(
+    "fluxpilot_prefix_cache_lookups_total",
+    "Prompt prefix KV-cache lookups",
+    ["result"]
+)
+PREFIX_CACHE_HIT_RATIO = Gauge(
+    "fluxpilot_prefix_cache_hit_ratio",
+    "Fraction of prompt prefix KV-cache lookups that hit"
+)
+PREFIX_CACHE_BYTES = Gauge(
+    "fluxpilot_prefix_cache_bytes",
+    "Bytes of KV cache held by the prompt prefix cache"
+)
+RESPONSE_CACHE_REQUESTS = Counter(
+    "fluxpilot_response_cache_requests_total",
+    "Response cache lookups by outcome (hit, disk_hit, coalesced, miss)",
+    ["result"]
+)
+RESPONSE_CACHE_ENTRIES = Gauge(
+    "fluxpilot_response_cache_entries",
+    "Responses held in the in-memory response cache"
+)
+AUTH_KEY_REFRESH_FAILURES = Counter(
+    "fluxpilot_auth_key_refresh_failures_total",
+    "Failed background reloads of the allowed API keys"
+)
+AUTH_KEYS_LOADED = Gauge(
+    "fluxpilot_auth_keys_loaded",
+    "Number of allowed API keys currently held in memory"
+)
+MODEL_LOAD_SECONDS = Gauge(
+    "fluxpilot_model_load_seconds",
+    "Time this process spent loading the model weights"
+)
+WORKER_STARTUP_SECONDS = Gauge(
+    "fluxpilot_worker_startup_seconds",
+    "Time from process start until the worker reported ready (model loaded and warmed up)"
+)
+MODEL_VERSION_INFO = Gauge(
+    "fluxpilot_model_version_info",
+    "1 for the model version this worker is serving, 0 for versions it retired",
+    ["version"]
+)
+MODEL_RELOADS = Counter(
+    "fluxpilot_model_reloads_total",
+    "Model hot-swap attempts by outcome",
+    ["result"]
+)
+STARTUP_PHASE_SECONDS = Gauge(
+    "fluxpilot_startup_phase_seconds",
+    "Time this process spent in each startup phase",
+    ["phase"]
+)
+WORKER_RSS_BYTES = Gauge(
+    "fluxpilot_worker_rss_bytes",
+    "Resident set size of this worker process"
+)
+WORKER_SHARED_BYTES = Gauge(
+    "fluxpilot_worker_shared_bytes",
+    "Resident pages of this worker that are shared with other processes"
+)
+INFERENCE_REJECTED = Counter(
+    "fluxpilot_inference_rejected_total",
+    "Requests shed because an inference queue was full",
+    ["queue"]
+)
+INFERENCE_STAGE_LATENCY = Histogram(
+    "fluxpilot_inference_stage_seconds",
+    "Time spent in each inference stage: tokenize, prefill (per batch), "
+    "decode_token (one decode step of the running batch) and detokenize",
+    ["stage"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+INFERENCE_TOKENS = Counter(
+    "fluxpilot_inference_tokens_total",
+    "Prompt tokens prefilled (kind=input) and tokens generated (kind=output)",
+    ["kind"]
+)
+GENERATION_TOKENS_PER_SECOND = Histogram(
+    "fluxpilot_generation_tokens_per_second",
+    "Generated tokens per second for each request, from prefill to last token",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+)
+SPECULATIVE_ACCEPTANCE_RATE = Histogram(
+    "fluxpilot_speculative_acceptance_rate",
+    "Fraction of draft-model tokens accepted by the target model, per request",
+    buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+)
+SPECULATIVE_TOKENS_PER_PASS = Histogram(
+    "fluxpilot_speculative_tokens_per_target_pass",
+    "Tokens generated per target-model forward pass, per request (1.0 = no speedup)",
+    buckets=(1.0, 1.25, 1.5, 2.0, 2.5, 3.0, 4.0, 5.0, 6.0, 8.0)
+)
+ADMISSION_REJECTED = Counter(
+    "fluxpilot_admission_rejected_total",
+    "Requests refused by admission control, by priority class and reason "
+    "(rate_limited, too_large, deadline, queue_full)",
+    ["priority", "reason"]
+)
+ADMISSION_QUEUE_WAIT = Histogram(
+    "fluxpilot_admission_queue_wait_seconds",
+    "Time admitted requests waited for token budget, by priority class",
+    ["priority"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "fluxpilot_admission_queue_depth",
+    "Requests waiting for token budget, by priority class",
+    ["priority"]
+)
+ADMISSION_TOKENS_IN_FLIGHT = Gauge(
+    "fluxpilot_admission_tokens_in_flight",
+    "Estimated token cost of the requests currently admitted"
+)
+LOG_RECORDS_DROPPED = Counter(
+    "fluxpilot_log_records_dropped_total",
+    "Log records not written: sampled out, or dropped because the log queue was full",
+    ["reason"]
+)
 
-class MetricsMiddleware(BaseHTTPMiddleware):
+class MetricsMiddleware:
     """
-    Starlette middleware to record Prometheus metrics for each request.
+    Pure ASGI middleware to record Prometheus metrics for each HTTP request.
+
+    Requests are labelled by route template (``/items/{id}``) rather than raw
+    path so that label cardinality stays bounded; paths that match no route
+    share the ``unmatched`` label. Unlike ``BaseHTTPMiddleware`` this does
+    not wrap the response in an extra task or buffer streamed bodies, and the
+    latency of a streaming response covers the whole stream.
     """
-    async def dispatch(self, request: Request, call_next):
-        method = request.method
-        endpoint = request.url.path
-        # Measure latency
-        with REQUEST_LATENCY.labels(method=method, endpoint=endpoint).time():
-            response = await call_next(request)
-        status = response.status_code
-        # Count request
-        REQUEST_COUNT.labels(
-            method=method,
-            endpoint=endpoint,
-            http_status=status
-        ).inc()
-        return response
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        endpoint = _route_template(scope)
+        status = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUEST_LATENCY.labels(method=method, endpoint=endpoint).observe(
+                time.perf_counter() - started
+            )
+            REQUEST_COUNT.labels(method=method, endpoint=endpoint, http_status=status).inc()
+
+
+def _route_template(scope: Scope) -> str:
+    app = scope.get("app")
+    for route in getattr(app, "routes", ()):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", scope["path"])
+    return "unmatched"
+
+
+def timed(stage: str, fn: Callable) -> Callable:
+    """
+    Wrap ``fn`` so that each call is observed in INFERENCE_STAGE_LATENCY.
+    """
+    histogram = INFERENCE_STAGE_LATENCY.labels(stage=stage)
+
+    def wrapper(*args, **kwargs):
+        with histogram.time():
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+# Endpoint and arrival time (time.monotonic) of the request being handled;
+# the batching engine reads it when a job is queued
+_first_token_timing: contextvars.ContextVar[Optional[Tuple[str, float]]] = contextvars.ContextVar(
+    "first_token_timing", default=None
+)
+
+
+def track_first_token(endpoint: str):
+    """
+    Have the batching engine (or the speculative decoder) record the time to
+    first token of every generation the current request runs, from now,
+    labelled with ``endpoint``.
+    """
+    _first_token_timing.set((endpoint, time.monotonic()))
+
+
+def first_token_timing() -> Optional[Tuple[str, float]]:
+    return _first_token_timing.get()
+
+
+def _read_memory() -> Tuple[int, int]:
+    """
+    Return (resident, shared) bytes of the current process.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            _, resident, shared = (int(v) for v in f.read().split()[:3])
+        page_size = os.sysconf("SC_PAGE_SIZE")
+        return resident * page_size, shared * page_size
+    except OSError:
+        # Non-Linux fallback: peak RSS in KiB, no shared breakdown
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, 0
+
+
+def process_age_seconds() -> float:
+    """
+    Seconds since this process was started (or forked); 0.0 where /proc is
+    unavailable.
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            # Field 22 is the start time in clock ticks since boot; the command
+            # name in field 2 may contain spaces, so split after its ")"
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except OSError:
+        return 0.0
+    return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+
+
+def update_process_metrics():
+    rss, shared = _read_memory()
+    WORKER_RSS_BYTES.set(rss)
+    WORKER_SHARED_BYTES.set(shared)
+
 
 def metrics_endpoint():
     """
     FastAPI route handler to expose metrics in Prometheus format.
+
+    When PROMETHEUS_MULTIPROC_DIR is set (Gunicorn with several workers),
+    samples from every worker are aggregated, and per-process gauges such as
+    RSS are reported with a ``pid`` label.
     """
-    data = generate_latest()
+    update_process_metrics()
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        data = generate_latest(registry)
+    else:
+        data = generate_latest()
     return Response(content=data, media_type=CONTENT_TYPE_LATEST)
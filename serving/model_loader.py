@@ -0,0 +1,175 @@
+# serving/model_loader.py
+
+import contextlib
+import json
+import logging
+import os
+import time
+from typing import Optional, Tuple
+
+import torch
+from transformers import AutoTokenizer, AutoModelForCausalLM
+
+from serving.metrics import MODEL_LOAD_SECONDS, update_process_metrics
+
+logger = logging.getLogger("serve.model_loader")
+
+# Inference precisions selectable through ServingSettings.precision:
+#   fp32 - weights and compute in float32 (reference)
+#   bf16 - float32 weights, matmuls autocast to bfloat16
+#   int8 - dynamic int8 quantization of every nn.Linear (weights int8,
+#          activations quantized on the fly), compute elsewhere in float32
+PRECISIONS = ("fp32", "bf16", "int8")
+
+# LoRA adapters (from train.py --lora) are either merged into the base
+# weights at load time (no per-token overhead) or kept attached as separate
+# low-rank layers (base weights untouched, slightly slower forward passes)
+ADAPTER_MODES = ("merge", "attach")
+
+ADAPTER_CONFIG = "adapter_config.json"
+
+
+def is_adapter_dir(path: str) -> bool:
+    """Whether ``path`` holds adapter-only artifacts rather than a full model."""
+    return os.path.isfile(os.path.join(path, ADAPTER_CONFIG))
+
+
+def adapter_base_model(adapter_dir: str) -> str:
+    """The base model an adapter was trained on, as recorded by peft."""
+    with open(os.path.join(adapter_dir, ADAPTER_CONFIG)) as f:
+        return json.load(f)["base_model_name_or_path"]
+
+
+def autocast_dtype(precision: str) -> Optional[torch.dtype]:
+    """
+    dtype to autocast forward passes to, or None to run them as loaded.
+    """
+    return torch.bfloat16 if precision == "bf16" else None
+
+
+def precision_context(precision: str, device_type: str = "cpu"):
+    """
+    Context manager to wrap forward passes in for the given precision.
+    """
+    dtype = autocast_dtype(precision)
+    if dtype is None:
+        return contextlib.nullcontext()
+    return torch.autocast(device_type, dtype=dtype)
+
+
+def apply_precision(model: AutoModelForCausalLM, precision: str) -> AutoModelForCausalLM:
+    """
+    Convert a freshly loaded fp32 model for the given precision.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision!r}, expected one of {PRECISIONS}")
+    if precision == "int8":
+        model = torch.ao.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+    return model
+
+
+def _load_weights(
+    model_dir: str,
+    shared: bool,
+    precision: str,
+    adapter_dir: Optional[str] = None,
+    adapter_mode: str = "merge",
+) -> AutoModelForCausalLM:
+    # safetensors checkpoints are mmapped while loading, which avoids a
+    # second full copy of the weights on the way in
+    model = AutoModelForCausalLM.from_pretrained(model_dir, low_cpu_mem_usage=True)
+    if adapter_dir:
+        if adapter_mode not in ADAPTER_MODES:
+            raise ValueError(f"Unknown adapter mode {adapter_mode!r}, expected one of {ADAPTER_MODES}")
+        if adapter_mode == "attach" and precision == "int8":
+            raise ValueError("int8 quantization needs the adapter merged (adapter_mode='merge')")
+        from peft import PeftModel
+
+        model = PeftModel.from_pretrained(model, adapter_dir)
+        if adapter_mode == "merge":
+            model = model.merge_and_unload()
+    model.eval()
+    if torch.cuda.is_available() and precision != "int8":
+        model.to("cuda")
+    else:
+        model = apply_precision(model, precision)
+        if shared:
+            model.share_memory()
+    return model
+
+
+def load_model(
+    model_dir: str,
+    shared: bool = False,
+    precision: str = "fp32",
+    adapter_dir: Optional[str] = None,
+    adapter_mode: str = "merge",
+    base_model_dir: Optional[str] = None,
+) -> Tuple[AutoTokenizer, AutoModelForCausalLM]:
+    """
+    Load the tokenizer and causal-LM weights used for serving.
+
+    Args:
+        model_dir: Local directory (or Hub ID) holding the model artifacts.
+        shared: Move the weights into shared memory. Use this when the
+            module is imported once in the Gunicorn master (``preload_app``)
+            so that every forked worker maps the same read-only pages instead
+            of holding its own copy.
+        precision: One of ``PRECISIONS``; applied once at load time. bf16
+            additionally needs forward passes wrapped in ``precision_context``.
+        adapter_dir: LoRA adapter to apply on top of ``model_dir``. When
+            ``model_dir`` itself holds only an adapter (as registered by
+            ``train.py --lora``, or swapped in by the reloader), it is used
+            as the adapter instead.
+        adapter_mode: One of ``ADAPTER_MODES``.
+        base_model_dir: Base model for an adapter-only ``model_dir``;
+            defaults to the base recorded in the adapter config.
+
+    Returns:
+        (tokenizer, model) with the model in eval mode.
+    """
+    started = time.monotonic()
+    if is_adapter_dir(model_dir):
+        adapter_dir = model_dir
+        model_dir = base_model_dir or adapter_base_model(adapter_dir)
+    # Adapters are saved with the tokenizer they were trained with
+    tokenizer_dir = adapter_dir if adapter_dir and os.path.isfile(
+        os.path.join(adapter_dir, "tokenizer_config.json")
+    ) else model_dir
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_dir)
+    model = _load_weights(model_dir, shared, precision, adapter_dir, adapter_mode)
+
+    elapsed = time.monotonic() - started
+    MODEL_LOAD_SECONDS.set(elapsed)
+    update_process_metrics()
+    adapter = f", adapter={adapter_dir} ({adapter_mode})" if adapter_dir else ""
+    logger.info(
+        f"Loaded model from {model_dir} in {elapsed:.1f}s "
+        f"(precision={precision}, shared={shared}{adapter})"
+    )
+    return tokenizer, model
+
+
+def load_draft_model(
+    draft_dir: str,
+    tokenizer: AutoTokenizer,
+    shared: bool = False,
+    precision: str = "fp32",
+) -> AutoModelForCausalLM:
+    """
+    Load the draft model used for speculative decoding.
+
+    The draft proposes token IDs that the main model verifies directly, so
+    both must use the same vocabulary; a mismatch is rejected here rather
+    than silently producing nonsense drafts that are never accepted.
+    """
+    started = time.monotonic()
+    draft_tokenizer = AutoTokenizer.from_pretrained(draft_dir)
+    if draft_tokenizer.get_vocab() != tokenizer.get_vocab():
+        raise ValueError(f"Draft model at {draft_dir} does not share the main model's tokenizer")
+    model = _load_weights(draft_dir, shared, precision)
+    update_process_metrics()
+    logger.info(f"Loaded draft model from {draft_dir} in {time.monotonic() - started:.1f}s")
+    return model
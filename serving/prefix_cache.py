@@ -0,0 +1,150 @@
+# serving/prefix_cache.py
+
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from serving.metrics import PREFIX_CACHE_BYTES, PREFIX_CACHE_HIT_RATIO, PREFIX_CACHE_LOOKUPS
+
+
+@dataclass
+class _Entry:
+    token_ids: Tuple[int, ...]
+    block_hashes: List[int]
+    past: tuple
+    nbytes: int
+
+
+def _block_hashes(token_ids: Sequence[int], block_size: int) -> List[int]:
+    """
+    Chained hashes of every full block, so hashes[i] identifies the whole
+    prefix token_ids[:(i + 1) * block_size].
+    """
+    hashes = []
+    running = 0
+    for start in range(0, len(token_ids) - block_size + 1, block_size):
+        running = hash((running, tuple(token_ids[start:start + block_size])))
+        hashes.append(running)
+    return hashes
+
+
+def _cache_nbytes(past) -> int:
+    return sum(t.numel() * t.element_size() for layer in past for t in layer)
+
+
+class PrefixCache:
+    """
+    LRU store of prompt KV caches (``past_key_values``) keyed on token-ID
+    prefixes, bounded by a memory budget.
+
+    Prefixes are matched in whole blocks of ``block_size`` tokens. A stored
+    prompt serves any request that shares at least ``min_tokens`` leading
+    tokens with it, since the KV cache of a prefix is just the leading slice
+    of the KV cache of the longer prompt.
+    """
+
+    def __init__(self, max_bytes: int, block_size: int = 16, min_tokens: int = 32):
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self.min_tokens = max(min_tokens, block_size)
+        self._entries: "OrderedDict[Tuple[int, ...], _Entry]" = OrderedDict()
+        # First block hash -> keys of entries starting with that block
+        self._by_first_block: Dict[int, Set[Tuple[int, ...]]] = {}
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.lookups = 0
+
+    def lookup(self, token_ids: Sequence[int]) -> Optional[Tuple[int, tuple]]:
+        """
+        Find the longest cached prefix of ``token_ids``.
+
+        At least one token is always left over, because the model needs a
+        fresh forward pass to produce the next-token logits.
+
+        Returns:
+            ``(prefix_length, past_key_values)`` with the cache already sliced
+            to ``prefix_length`` tokens, or None on a miss.
+        """
+        hashes = _block_hashes(token_ids[:-1], self.block_size)
+        prompt = tuple(token_ids)
+        best: Optional[_Entry] = None
+        best_blocks = 0
+        with self._lock:
+            self.lookups += 1
+            candidates = self._by_first_block.get(hashes[0], ()) if hashes else ()
+            for key in candidates:
+                entry = self._entries[key]
+                matched = 0
+                for ours, theirs in zip(hashes, entry.block_hashes):
+                    # Hashes only narrow the search: a colliding prompt must
+                    # never be served another prompt's KV cache
+                    block = slice(matched * self.block_size, (matched + 1) * self.block_size)
+                    if ours != theirs or prompt[block] != entry.token_ids[block]:
+                        break
+                    matched += 1
+                if matched > best_blocks:
+                    best, best_blocks = entry, matched
+
+            length = best_blocks * self.block_size
+            if best is None or length < self.min_tokens:
+                self._observe(hit=False)
+                return None
+            self._entries.move_to_end(best.token_ids)
+            self.hits += 1
+            self._observe(hit=True)
+
+        past = tuple(tuple(t[..., :length, :] for t in layer) for layer in best.past)
+        return length, past
+
+    def insert(self, token_ids: Sequence[int], past) -> bool:
+        """
+        Store the KV cache of a whole prompt. ``past`` must hold exactly one
+        sequence covering ``token_ids`` with no padding.
+
+        Returns:
+            Whether the entry was stored.
+        """
+        if len(token_ids) < self.min_tokens:
+            return False
+        key = tuple(token_ids)
+        past = tuple(tuple(t.detach().clone() for t in layer) for layer in past)
+        nbytes = _cache_nbytes(past)
+        if nbytes > self.max_bytes:
+            return False
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return True
+            hashes = _block_hashes(key, self.block_size)
+            self._entries[key] = _Entry(key, hashes, past, nbytes)
+            self._by_first_block.setdefault(hashes[0], set()).add(key)
+            self.bytes += nbytes
+            while self.bytes > self.max_bytes:
+                self._evict_oldest()
+            PREFIX_CACHE_BYTES.set(self.bytes)
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_first_block.clear()
+            self.bytes = 0
+            PREFIX_CACHE_BYTES.set(0)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _evict_oldest(self):
+        key, entry = self._entries.popitem(last=False)
+        siblings = self._by_first_block[entry.block_hashes[0]]
+        siblings.discard(key)
+        if not siblings:
+            del self._by_first_block[entry.block_hashes[0]]
+        self.bytes -= entry.nbytes
+
+    def _observe(self, hit: bool):
+        PREFIX_CACHE_LOOKUPS.labels(result="hit" if hit else "miss").inc()
+        PREFIX_CACHE_HIT_RATIO.set(self.hits / self.lookups)
@@ -0,0 +1,229 @@
+# serving/reloader.py
+
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+from typing import Callable, Optional
+
+from serving.config import ServingSettings
+from serving.metrics import MODEL_RELOADS, MODEL_VERSION_INFO
+
+logger = logging.getLogger("serve.reloader")
+
+
+# A full model, or an adapter-only artifact as registered by train.py --lora
+MODEL_CONFIG_FILES = ("config.json", "adapter_config.json")
+
+
+def _find_model_dir(root: str) -> str:
+    """
+    The directory under ``root`` holding the Hugging Face ``config.json`` or
+    peft ``adapter_config.json``; registered artifacts often nest it one or
+    two levels down. ``load_model`` loads an adapter onto its base model.
+    """
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        if any(name in filenames for name in MODEL_CONFIG_FILES):
+            return dirpath
+    raise FileNotFoundError(f"No config.json or adapter_config.json found under {root}")
+
+
+class LocalDirectorySource:
+    """
+    Watch a local directory (typically a mounted volume or a symlink that a
+    deploy job repoints). The version is a fingerprint of the resolved path
+    and its files' sizes and mtimes; a new fingerprint is only reported once
+    it has been seen on two consecutive polls, so a directory that is still
+    being copied is never loaded.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._candidate: Optional[str] = None
+
+    def fingerprint(self) -> Optional[str]:
+        real = os.path.realpath(self.path)
+        if not os.path.isdir(real):
+            return None
+        digest = hashlib.sha256(real.encode("utf-8"))
+        for dirpath, dirnames, filenames in os.walk(real):
+            dirnames.sort()
+            for name in sorted(filenames):
+                stat = os.stat(os.path.join(dirpath, name))
+                digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+        return f"{os.path.basename(real)}@{digest.hexdigest()[:12]}"
+
+    def latest(self) -> Optional[str]:
+        fingerprint = self.fingerprint()
+        stable = fingerprint is not None and fingerprint == self._candidate
+        self._candidate = fingerprint
+        return fingerprint if stable else None
+
+    def fetch(self, version: str) -> str:
+        return _find_model_dir(os.path.realpath(self.path))
+
+
+class MlflowRegistrySource:
+    """
+    Follow a registered model's alias (``models:/Name@alias``) or stage
+    (``models:/Name/Production``) in the MLflow Model Registry.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        alias: Optional[str] = None,
+        stage: Optional[str] = None,
+        download_dir: str = "/tmp/fluxpilot-models",
+        tracking_uri: Optional[str] = None,
+    ):
+        from mlflow.tracking import MlflowClient
+
+        self.model_name = model_name
+        self.alias = alias
+        self.stage = stage
+        self.download_dir = download_dir
+        self.tracking_uri = tracking_uri
+        self._client = MlflowClient(tracking_uri=tracking_uri, registry_uri=tracking_uri)
+
+    def latest(self) -> Optional[str]:
+        """
+        The version the alias/stage points at, as ``Name/<number>``.
+        """
+        if self.alias:
+            number = self._client.get_model_version_by_alias(self.model_name, self.alias).version
+        else:
+            versions = self._client.get_latest_versions(self.model_name, stages=[self.stage])
+            if not versions:
+                return None
+            number = versions[0].version
+        return f"{self.model_name}/{number}"
+
+    def fetch(self, version: str) -> str:
+        import mlflow.artifacts
+
+        number = version.rsplit("/", 1)[-1]
+        target = os.path.join(self.download_dir, self.model_name, number)
+        if not os.path.isdir(target):
+            # Download next to the target and rename, so a concurrent worker
+            # or a crash never leaves a half-written version directory behind
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            staging = tempfile.mkdtemp(dir=os.path.dirname(target), prefix=".download-")
+            try:
+                mlflow.artifacts.download_artifacts(
+                    artifact_uri=f"models:/{self.model_name}/{number}",
+                    dst_path=staging,
+                    tracking_uri=self.tracking_uri,
+                )
+                os.rename(staging, target)
+            except OSError:
+                if not os.path.isdir(target):
+                    raise
+            finally:
+                shutil.rmtree(staging, ignore_errors=True)
+        return _find_model_dir(target)
+
+
+def make_source(uri: str, download_dir: str, tracking_uri: Optional[str] = None):
+    """
+    ``models:/Name@alias`` or ``models:/Name/Stage`` follow the MLflow
+    registry; anything else is treated as a local directory.
+    """
+    if not uri.startswith("models:/"):
+        return LocalDirectorySource(uri)
+    ref = uri[len("models:/"):]
+    if "@" in ref:
+        name, alias = ref.split("@", 1)
+        return MlflowRegistrySource(name, alias=alias, download_dir=download_dir,
+                                    tracking_uri=tracking_uri)
+    name, _, stage = ref.partition("/")
+    if not stage:
+        raise ValueError(f"Model URI {uri!r} needs an @alias or a /stage")
+    return MlflowRegistrySource(name, stage=stage, download_dir=download_dir,
+                                tracking_uri=tracking_uri)
+
+
+class ModelReloader:
+    """
+    Background task that polls a model source and hot-swaps new versions.
+
+    A new version is loaded into a second ``ModelRuntime`` next to the one
+    serving traffic and warmed up, then handed to ``on_swap`` in a single
+    assignment. Requests that already hold the old runtime finish on it; it
+    is stopped once they have drained. A failed load leaves the current
+    model in place and is retried on the next poll.
+    """
+
+    def __init__(
+        self,
+        source,
+        settings: ServingSettings,
+        current,
+        on_swap: Callable[[object], None],
+        interval: float = 60,
+        drain_timeout: float = 300,
+    ):
+        self.source = source
+        self.settings = settings
+        self.current = current
+        self.on_swap = on_swap
+        self.interval = interval
+        self.drain_timeout = drain_timeout
+        self._task: Optional[asyncio.Task] = None
+        MODEL_VERSION_INFO.labels(version=current.version).set(1)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.check()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                MODEL_RELOADS.labels(result="failure").inc()
+                logger.error(f"Model reload failed, keeping {self.current.version}: {e}")
+
+    async def check(self) -> bool:
+        """
+        Poll the source once and swap in a newer version if there is one.
+        Returns whether a swap happened.
+        """
+        from serving.runtime import ModelRuntime
+
+        version = await asyncio.to_thread(self.source.latest)
+        if version is None or version == self.current.version:
+            return False
+
+        logger.info(f"Loading model version {version} (serving {self.current.version})")
+        model_dir = await asyncio.to_thread(self.source.fetch, version)
+        candidate = await asyncio.to_thread(ModelRuntime.load, self.settings, model_dir, version)
+        candidate.start()
+        try:
+            await candidate.warmup(
+                self.settings.warmup_prompt_lengths, self.settings.warmup_max_new_tokens
+            )
+        except Exception:
+            candidate.stop(timeout=10)
+            raise
+
+        previous, self.current = self.current, candidate
+        self.on_swap(candidate)
+        MODEL_VERSION_INFO.labels(version=previous.version).set(0)
+        MODEL_VERSION_INFO.labels(version=candidate.version).set(1)
+        MODEL_RELOADS.labels(result="success").inc()
+        logger.info(f"Now serving model version {candidate.version}")
+
+        await previous.drain(self.drain_timeout)
+        logger.info(f"Retired model version {previous.version}")
+        return True
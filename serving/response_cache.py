@@ -0,0 +1,201 @@
+# serving/response_cache.py
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from serving.metrics import RESPONSE_CACHE_ENTRIES, RESPONSE_CACHE_REQUESTS
+
+logger = logging.getLogger("serve.response_cache")
+
+
+def make_cache_key(
+    prompt: str,
+    max_new_tokens: int,
+    temperature: float,
+    model_version: str,
+) -> str:
+    """
+    Hash everything that determines a deterministic generation result.
+    The prompt is Unicode-normalized (NFC) so equivalent encodings share a key.
+    """
+    payload = json.dumps(
+        [unicodedata.normalize("NFC", prompt), max_new_tokens, temperature, model_version],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Size-bounded LRU + TTL cache of generation responses.
+
+    Concurrent requests for the same key are coalesced so that N duplicates
+    cost a single model call. An optional on-disk tier under ``disk_dir``
+    lets cached results survive worker restarts and be shared between the
+    workers of one pod.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl_seconds: float = 300,
+        disk_dir: Optional[str] = None,
+        disk_max_entries: int = 10000,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_max_entries = disk_max_entries
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        if self.disk_dir is not None:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self._disk_writes = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        The value cached in memory for ``key``, or None. Unlike
+        ``get_or_compute`` this never waits or computes.
+        """
+        value = self._get_memory(key)
+        if value is not None:
+            RESPONSE_CACHE_REQUESTS.labels(result="hit").inc()
+        return value
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Return the cached value for ``key``, join an identical in-flight
+        computation, or run ``compute()`` and cache its result.
+
+        Failures are propagated to every waiter and never cached.
+        """
+        value = self._get_memory(key)
+        if value is not None:
+            RESPONSE_CACHE_REQUESTS.labels(result="hit").inc()
+            return value
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            RESPONSE_CACHE_REQUESTS.labels(result="coalesced").inc()
+            return await asyncio.shield(inflight)
+
+        # Run the computation as its own task so that a disconnecting leader
+        # does not cancel the work its followers are waiting on
+        task = asyncio.ensure_future(self._load_or_compute(key, compute))
+        self._inflight[key] = task
+        task.add_done_callback(lambda t: self._finish(key, t))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Future):
+        self._inflight.pop(key, None)
+        # Mark the failure as retrieved even if every waiter has gone away
+        if not task.cancelled():
+            task.exception()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            RESPONSE_CACHE_ENTRIES.set(0)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def _load_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        if self.disk_dir is not None:
+            stored = await asyncio.to_thread(self._read_disk, key)
+            if stored is not None:
+                created, value = stored
+                RESPONSE_CACHE_REQUESTS.labels(result="disk_hit").inc()
+                self._put_memory(key, value, created)
+                return value
+
+        RESPONSE_CACHE_REQUESTS.labels(result="miss").inc()
+        value = await compute()
+        created = time.time()
+        self._put_memory(key, value, created)
+        if self.disk_dir is not None:
+            await asyncio.to_thread(self._write_disk, key, value, created)
+        return value
+
+    # ------------------------------------------------------------- memory tier
+
+    def _get_memory(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            created, value = item
+            if time.time() - created > self.ttl_seconds:
+                del self._entries[key]
+                RESPONSE_CACHE_ENTRIES.set(len(self._entries))
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _put_memory(self, key: str, value: Any, created: float):
+        with self._lock:
+            self._entries[key] = (created, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            RESPONSE_CACHE_ENTRIES.set(len(self._entries))
+
+    # --------------------------------------------------------------- disk tier
+
+    def _read_disk(self, key: str) -> Optional[Tuple[float, Any]]:
+        path = self.disk_dir / f"{key}.json"
+        try:
+            with open(path, "r") as f:
+                record = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Discarding unreadable cache file {path}: {e}")
+            path.unlink(missing_ok=True)
+            return None
+        if time.time() - record["created"] > self.ttl_seconds:
+            path.unlink(missing_ok=True)
+            return None
+        return record["created"], record["value"]
+
+    def _write_disk(self, key: str, value: Any, created: float):
+        path = self.disk_dir / f"{key}.json"
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            with open(tmp, "w") as f:
+                json.dump({"created": created, "value": value}, f)
+            # Atomic rename so concurrent workers never read a partial file
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"Failed to write cache file {path}: {e}")
+            return
+
+        self._disk_writes += 1
+        if self._disk_writes % 64 == 0:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        # Other workers may be pruning the same directory concurrently
+        files = []
+        for path in self.disk_dir.glob("*.json"):
+            try:
+                files.append((path.stat().st_mtime, path))
+            except FileNotFoundError:
+                continue
+        files.sort()
+        now = time.time()
+        excess = len(files) - self.disk_max_entries
+        for i, (mtime, path) in enumerate(files):
+            if i < excess or now - mtime > self.ttl_seconds:
+                path.unlink(missing_ok=True)
@@ -0,0 +1,225 @@
+# serving/runtime.py
+#
+# Everything bound to one loaded model. serving.app imports this lazily from
+# its startup pipeline, so torch and transformers are not pulled in until the
+# model is actually being loaded.
+
+import asyncio
+import contextlib
+import logging
+import time
+from typing import List, Optional
+
+from opentelemetry import trace
+
+from serving.batching import BatchingEngine
+from serving.config import ServingSettings
+from serving.executor import InferenceExecutor
+from serving.metrics import timed
+from serving.model_loader import autocast_dtype, load_draft_model, load_model
+from serving.prefix_cache import PrefixCache
+from serving.speculative import SpeculativeDecoder
+from serving.startup import startup_phase
+
+logger = logging.getLogger("serve.runtime")
+tracer = trace.get_tracer("fluxpilot.serving")
+
+# Repeated to build warmup prompts of a given token length
+_WARMUP_TEXT = "The quick brown fox jumps over the lazy dog while the model warms up. "
+
+
+class ModelRuntime:
+    """
+    A loaded model together with its tokenizer, batching engine, prefix cache
+    and (optionally) speculative decoder.
+    """
+
+    def __init__(
+        self,
+        settings: ServingSettings,
+        tokenizer,
+        model,
+        version: str,
+        draft_model=None,
+    ):
+        self.settings = settings
+        self.tokenizer = tokenizer
+        self.model = model
+        self.version = version
+        # Requests currently using this runtime; see drain()
+        self.in_flight = 0
+
+        self.prefix_cache = None
+        if settings.prefix_cache_mb > 0:
+            self.prefix_cache = PrefixCache(
+                max_bytes=settings.prefix_cache_mb * 1024 * 1024,
+                block_size=settings.prefix_cache_block_size,
+                min_tokens=settings.prefix_cache_min_tokens,
+            )
+        self.engine = BatchingEngine(
+            model,
+            tokenizer,
+            max_batch_size=settings.max_batch_size,
+            batch_wait_ms=settings.batch_wait_ms,
+            max_queue_size=settings.max_queue_size,
+            retry_after=settings.retry_after_seconds,
+            prefix_cache=self.prefix_cache,
+            autocast_dtype=autocast_dtype(settings.precision),
+        )
+
+        # Speculative requests run one at a time outside the batching engine
+        # and its prefix cache; that only pays off when batching is off anyway
+        if draft_model is not None and settings.max_batch_size > 1:
+            raise ValueError(
+                "draft_model_dir needs max_batch_size: 1; speculative decoding does not "
+                "run inside the batching engine"
+            )
+
+        # Speculative decoding only reproduces greedy output, so sampling
+        # models keep using the batching engine for everything
+        self.speculative = None
+        self.speculative_executor = None
+        if draft_model is not None and not self.engine.do_sample:
+            self.speculative = SpeculativeDecoder(
+                model,
+                draft_model,
+                num_draft_tokens=settings.num_draft_tokens,
+                eos_token_ids=self.engine.eos_token_ids,
+                autocast_dtype=autocast_dtype(settings.precision),
+            )
+            self.speculative_executor = InferenceExecutor(
+                max_workers=settings.executor_workers,
+                max_queue_size=settings.max_queue_size,
+                retry_after=settings.retry_after_seconds,
+                name="speculative",
+            )
+
+        # Tokenizer calls run on executor threads; these record how long the
+        # work itself takes, separately from time spent waiting for a thread
+        self._tokenize = timed("tokenize", tokenizer)
+        self._detokenize = timed("detokenize", tokenizer.decode)
+        self._batch_detokenize = timed("detokenize", tokenizer.batch_decode)
+
+    @classmethod
+    def load(
+        cls,
+        settings: ServingSettings,
+        model_dir: str,
+        version: str,
+        shared: bool = False,
+    ) -> "ModelRuntime":
+        """
+        Load the model (and draft model, if configured) from ``model_dir``.
+        Blocking; run it off the event loop.
+        """
+        with startup_phase("load_model"):
+            tokenizer, model = load_model(
+                model_dir,
+                shared=shared,
+                precision=settings.precision,
+                adapter_dir=settings.adapter_dir,
+                adapter_mode=settings.adapter_mode,
+                base_model_dir=settings.base_model_dir,
+            )
+        draft_model = None
+        if settings.draft_model_dir:
+            with startup_phase("load_draft_model"):
+                draft_model = load_draft_model(
+                    settings.draft_model_dir, tokenizer, shared=shared, precision=settings.precision
+                )
+        return cls(settings, tokenizer, model, version, draft_model=draft_model)
+
+    @property
+    def do_sample(self) -> bool:
+        return self.engine.do_sample
+
+    def start(self):
+        self.engine.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        self.engine.stop(timeout=timeout)
+        if self.speculative_executor is not None:
+            self.speculative_executor.shutdown(wait=False)
+
+    @contextlib.contextmanager
+    def use(self):
+        """
+        Mark a request as using this runtime for the duration of the block.
+        """
+        self.in_flight += 1
+        try:
+            yield self
+        finally:
+            self.in_flight -= 1
+
+    async def drain(self, timeout: float):
+        """
+        Wait (up to ``timeout``) for in-flight requests to finish, then stop.
+        """
+        deadline = time.monotonic() + timeout
+        while self.in_flight and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self.in_flight:
+            logger.warning(
+                f"Stopping model version {self.version} with {self.in_flight} request(s) in flight"
+            )
+        await asyncio.to_thread(self.stop, 30)
+
+    # ----------------------------------------------------------- tokenizer
+
+    def tokenize(self, text):
+        with tracer.start_as_current_span("tokenize") as span:
+            encoded = self._tokenize(text)
+            ids = encoded["input_ids"]
+            span.set_attribute("tokens", len(ids) if isinstance(text, str) else sum(map(len, ids)))
+            return encoded
+
+    def detokenize(self, output_ids, **kwargs):
+        with tracer.start_as_current_span("decode_text", attributes={"tokens": len(output_ids)}):
+            return self._detokenize(output_ids, **kwargs)
+
+    def batch_detokenize(self, sequences, **kwargs):
+        with tracer.start_as_current_span(
+            "decode_text", attributes={"tokens": sum(map(len, sequences))}
+        ):
+            return self._batch_detokenize(sequences, **kwargs)
+
+    # ---------------------------------------------------------- generation
+
+    async def generate(self, input_ids: List[int], max_new_tokens: int, temperature: float):
+        if self.speculative is not None:
+            return await self.speculative_executor.run(
+                self.speculative.generate, input_ids, max_new_tokens
+            )
+        return await self.engine.generate(
+            input_ids, max_new_tokens=max_new_tokens, temperature=temperature
+        )
+
+    async def warmup(self, prompt_lengths: List[int], max_new_tokens: int):
+        """
+        Run generations over representative prompt lengths so that kernel
+        selection, allocator growth and thread pools are paid for before the
+        first real request: each length alone, then all of them as one
+        padded batch.
+        """
+        if not prompt_lengths:
+            return
+        with startup_phase("warmup"):
+            limit = getattr(self.model.config, "max_position_embeddings", None)
+            base = self.tokenizer(_WARMUP_TEXT)["input_ids"]
+            prompts = []
+            for length in prompt_lengths:
+                if limit:
+                    length = min(length, limit - max_new_tokens)
+                ids = base * (length // max(len(base), 1) + 1)
+                prompts.append(ids[:max(length, 1)])
+
+            for ids in prompts:
+                await self.generate(ids, max_new_tokens, 1.0)
+            await asyncio.gather(*[
+                self.engine.generate(ids, max_new_tokens=max_new_tokens) for ids in prompts
+            ])
+            # Synthetic prompts shouldn't occupy space meant for real prefixes
+            if self.prefix_cache is not None:
+                self.prefix_cache.clear()
+        logger.info(f"Warmed up with prompt lengths {[len(ids) for ids in prompts]}")
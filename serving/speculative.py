@@ -0,0 +1,157 @@
+# serving/speculative.py
+
+import logging
+import time
+from typing import List, Optional
+
+import torch
+from opentelemetry import trace
+
+from serving.batching import _from_legacy, _map_cache, _to_legacy
+from serving.logging import record_stage, request_fields
+from serving.metrics import (
+    GENERATION_TOKENS_PER_SECOND,
+    INFERENCE_TOKENS,
+    SPECULATIVE_ACCEPTANCE_RATE,
+    SPECULATIVE_TOKENS_PER_PASS,
+    TIME_TO_FIRST_TOKEN,
+    first_token_timing,
+)
+
+logger = logging.getLogger("serve.speculative")
+tracer = trace.get_tracer("fluxpilot.serving")
+
+
+def _crop(past, length: int):
+    return _map_cache(past, lambda t: t[..., :length, :])
+
+
+class SpeculativeDecoder:
+    """
+    Greedy speculative decoding with a small draft model.
+
+    Each round the draft model proposes ``num_draft_tokens`` tokens one at a
+    time, and the target model scores all of them in a single forward pass.
+    The longest prefix of the draft that matches the target's own greedy
+    choices is accepted, followed by the target's token at the first
+    mismatch. The output is therefore identical to greedy decoding with the
+    target model alone; only the number of target forward passes changes.
+    """
+
+    def __init__(
+        self,
+        target,
+        draft,
+        num_draft_tokens: int = 4,
+        eos_token_ids=(),
+        autocast_dtype: Optional[torch.dtype] = None,
+    ):
+        self.target = target
+        self.draft = draft
+        self.num_draft_tokens = num_draft_tokens
+        self.eos_token_ids = set(eos_token_ids)
+        self.autocast_dtype = autocast_dtype
+
+    def generate(self, input_ids: List[int], max_new_tokens: int) -> List[int]:
+        """
+        Returns:
+            The prompt token IDs followed by the generated token IDs.
+        """
+        if not input_ids:
+            raise ValueError("Prompt must contain at least one token")
+        with tracer.start_as_current_span("speculative_decode") as span:
+            tokens, target_passes, drafted, accepted = self._generate(input_ids, max_new_tokens)
+            span.set_attributes({
+                "prompt_tokens": len(input_ids),
+                "generated_tokens": len(tokens) - len(input_ids),
+                "target_passes": target_passes,
+                "draft_tokens": drafted,
+                "accepted_tokens": accepted,
+            })
+        return tokens
+
+    @torch.inference_mode()
+    def _generate(self, input_ids: List[int], max_new_tokens: int):
+        started = time.monotonic()
+        # Set by the endpoint; carried into this thread by the executor
+        timing = first_token_timing()
+        tokens = list(input_ids)
+        target_past, target_len = None, 0
+        draft_past, draft_len = None, 0
+        generated = 0
+        target_passes = 0
+        drafted = accepted_total = 0
+
+        while generated < max_new_tokens:
+            k = min(self.num_draft_tokens, max_new_tokens - generated)
+
+            # 1. Draft k tokens greedily, feeding only what its cache lacks
+            drafts: List[int] = []
+            feed = tokens[draft_len:]
+            for _ in range(k):
+                out = self._forward(self.draft, feed, draft_past, draft_len)
+                draft_past = _to_legacy(out.past_key_values)
+                draft_len += len(feed)
+                drafts.append(int(out.logits[0, -1].argmax()))
+                feed = drafts[-1:]
+
+            # 2. Score prompt suffix + all drafts with one target pass
+            feed = tokens[target_len:] + drafts
+            out = self._forward(self.target, feed, target_past, target_len)
+            target_passes += 1
+            offset = len(tokens) - target_len
+            choices = out.logits[0, offset - 1:].argmax(dim=-1).tolist()
+
+            # 3. Accept the agreeing prefix plus the target's next token
+            accepted = 0
+            while accepted < k and choices[accepted] == drafts[accepted]:
+                accepted += 1
+            new_tokens = drafts[:accepted] + [choices[accepted]]
+            drafted += k
+            accepted_total += accepted
+
+            # 4. Roll both caches back to the accepted tokens
+            target_len = len(tokens) + accepted
+            target_past = _crop(_to_legacy(out.past_key_values), target_len)
+            draft_len = min(draft_len, target_len)
+            draft_past = _crop(draft_past, draft_len)
+
+            for token in new_tokens[:max_new_tokens - generated]:
+                tokens.append(token)
+                generated += 1
+                if generated == 1 and timing is not None:
+                    endpoint, arrived_at = timing
+                    ttft = time.monotonic() - arrived_at
+                    TIME_TO_FIRST_TOKEN.labels(endpoint=endpoint).observe(ttft)
+                    record_stage(request_fields(), "first_token", ttft)
+                if token in self.eos_token_ids:
+                    generated = max_new_tokens
+                    break
+
+        new_count = len(tokens) - len(input_ids)
+        INFERENCE_TOKENS.labels(kind="input").inc(len(input_ids))
+        INFERENCE_TOKENS.labels(kind="output").inc(new_count)
+        elapsed = time.monotonic() - started
+        if elapsed > 0:
+            GENERATION_TOKENS_PER_SECOND.observe(new_count / elapsed)
+        if drafted:
+            SPECULATIVE_ACCEPTANCE_RATE.observe(accepted_total / drafted)
+        if target_passes:
+            SPECULATIVE_TOKENS_PER_PASS.observe(new_count / target_passes)
+        return tokens, target_passes, drafted, accepted_total
+
+    def _forward(self, model, feed: List[int], past, past_len: int):
+        device = model.device
+        total = past_len + len(feed)
+        kwargs = dict(
+            input_ids=torch.tensor([feed], dtype=torch.long, device=device),
+            attention_mask=torch.ones((1, total), dtype=torch.long, device=device),
+            position_ids=torch.arange(past_len, total, device=device).unsqueeze(0),
+            use_cache=True,
+        )
+        if past is not None:
+            kwargs["past_key_values"] = _from_legacy(model, past)
+        if self.autocast_dtype is None:
+            return model(**kwargs)
+        with torch.autocast(device.type, dtype=self.autocast_dtype):
+            return model(**kwargs)
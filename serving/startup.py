@@ -0,0 +1,31 @@
+# serving/startup.py
+
+import contextlib
+import logging
+import time
+
+from serving.metrics import STARTUP_PHASE_SECONDS
+
+logger = logging.getLogger("serve.startup")
+
+# Readiness phases reported by /ready, in order
+STARTING = "starting"
+LOADING = "loading"
+WARMING_UP = "warming_up"
+READY = "ready"
+FAILED = "failed"
+
+
+@contextlib.contextmanager
+def startup_phase(name: str):
+    """
+    Time one startup phase, log it and export it as
+    ``fluxpilot_startup_phase_seconds{phase=name}``.
+    """
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        elapsed = time.monotonic() - started
+        STARTUP_PHASE_SECONDS.labels(phase=name).set(elapsed)
+        logger.info(f"Startup phase {name} took {elapsed:.2f}s")
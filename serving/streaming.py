@@ -0,0 +1,67 @@
+# serving/streaming.py
+
+import json
+from typing import Any, Awaitable, Callable, List
+
+from fastapi.responses import StreamingResponse
+
+
+class IncrementalDecoder:
+    """
+    Turn a growing list of generated token IDs into text deltas.
+
+    Only a short trailing window is re-decoded per token, and text is held
+    back while it ends in an incomplete multi-byte character, so every delta
+    is valid UTF-8 and the deltas concatenate to the full decoded output.
+    """
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.token_ids: List[int] = []
+        self._prefix_offset = 0
+        self._read_offset = 0
+
+    def push(self, token_id: int) -> str:
+        """
+        Add one token and return whatever new text it completes (may be "").
+        """
+        self.token_ids.append(token_id)
+        prefix_text = self.tokenizer.decode(
+            self.token_ids[self._prefix_offset:self._read_offset], skip_special_tokens=True
+        )
+        new_text = self.tokenizer.decode(
+            self.token_ids[self._prefix_offset:], skip_special_tokens=True
+        )
+        if len(new_text) > len(prefix_text) and not new_text.endswith("\ufffd"):
+            self._prefix_offset = self._read_offset
+            self._read_offset = len(self.token_ids)
+            return new_text[len(prefix_text):]
+        return ""
+
+
+def sse_event(data: Any, event: str = None) -> str:
+    """
+    Format one server-sent event frame.
+    """
+    payload = data if isinstance(data, str) else json.dumps(data)
+    frame = f"event: {event}\n" if event else ""
+    return f"{frame}data: {payload}\n\n"
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that always runs ``on_close`` once it is done with
+    the request: after the body is sent, when the client disconnects
+    (even before the body iterator has started), or when sending fails.
+    A BackgroundTask would be skipped in the last case.
+    """
+
+    def __init__(self, content, on_close: Callable[[], Awaitable[None]], **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.on_close()
@@ -2,19 +2,29 @@
 
 import os
 from opentelemetry import trace
+from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
 from opentelemetry.sdk.resources import Resource, SERVICE_NAME
 from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import BatchSpanProcessor, OTLPSpanExporter
+from opentelemetry.sdk.trace.export import BatchSpanProcessor
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
 from opentelemetry.instrumentation.requests import RequestsInstrumentor
 
-def setup_tracing(app):
+
+def setup_tracing(app, sample_ratio: float = 1.0):
     """
     Configure OpenTelemetry tracing with OTLP exporter and instrument FastAPI + requests.
+
+    New traces are kept with probability ``sample_ratio``; requests that
+    arrive with a sampled/unsampled parent span follow the caller's decision,
+    so a trace is never half recorded.
     """
     service_name = os.getenv("OTEL_SERVICE_NAME", "fluxpilot")
     resource = Resource.create({SERVICE_NAME: service_name})
-    provider = TracerProvider(resource=resource)
+    provider = TracerProvider(
+        resource=resource,
+        sampler=ParentBased(TraceIdRatioBased(sample_ratio)),
+    )
 
     otlp_endpoint = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
     if otlp_endpoint:
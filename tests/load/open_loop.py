@@ -0,0 +1,97 @@
+# tests/load/open_loop.py
+#
+# Open-loop load: requests arrive at a constant rate (Poisson by default)
+# however fast the server answers, so overload shows up as queueing latency
+# and 429/503s rather than as a quietly lower request rate, which is what the
+# closed-loop locustfile.py measures. ARRIVAL_RATE is per user:
+#   API_KEY=... ARRIVAL_RATE=20 locust -f tests/load/open_loop.py \
+#       --host http://localhost:8080 --users 1 --spawn-rate 1 --headless --run-time 5m
+
+import os
+import random
+import string
+import time
+
+import gevent
+from locust import HttpUser, constant, task
+
+ARRIVAL_RATE = float(os.getenv("ARRIVAL_RATE", "10"))
+ARRIVALS = os.getenv("ARRIVALS", "poisson")  # poisson | uniform
+API_KEY = os.getenv("API_KEY", "")
+SEED = int(os.getenv("SEED", "0"))
+
+# (weight, (min, max) prompt words, (min, max) max_new_tokens); the shape of
+# the "mixed" workload in serving.bench_serving
+MIX = [
+    (0.7, (2, 12), (8, 64)),
+    (0.2, (48, 96), (16, 64)),
+    (0.1, (12, 24), (128, 256)),
+]
+
+
+class OpenLoopUser(HttpUser):
+    wait_time = constant(0)
+
+    def on_start(self):
+        self.rng = random.Random(SEED)
+        self.next_arrival = time.monotonic()
+
+    @task
+    def arrive(self):
+        # Schedule from the previous arrival, not from now, so a slow
+        # greenlet switch never lowers the offered rate
+        if ARRIVALS == "poisson":
+            self.next_arrival += self.rng.expovariate(ARRIVAL_RATE)
+        else:
+            self.next_arrival += 1 / ARRIVAL_RATE
+        delay = self.next_arrival - time.monotonic()
+        if delay > 0:
+            gevent.sleep(delay)
+        # Fire and forget: the next arrival doesn't wait for this response
+        gevent.spawn(self._send, self._body())
+
+    def _body(self):
+        _, (w_min, w_max), (o_min, o_max) = self.rng.choices(MIX, [m[0] for m in MIX])[0]
+        words = [
+            "".join(self.rng.choices(string.ascii_lowercase, k=self.rng.randint(2, 9)))
+            for _ in range(self.rng.randint(w_min, w_max))
+        ]
+        return {"prompt": " ".join(words), "max_new_tokens": self.rng.randint(o_min, o_max)}
+
+    def _fire(self, name, started, exception=None):
+        self.environment.events.request.fire(
+            request_type="SSE",
+            name=name,
+            response_time=(time.perf_counter() - started) * 1000,
+            response_length=0,
+            exception=exception,
+            context={},
+        )
+
+    def _send(self, body):
+        # Locust times a streamed request until its headers only, so the
+        # time to first token and to the end of the stream are reported as
+        # separate SSE entries
+        started = time.perf_counter()
+        with self.client.post(
+            "/generate/stream",
+            json=body,
+            headers={"X-API-KEY": API_KEY},
+            stream=True,
+            catch_response=True,
+            timeout=300,
+        ) as response:
+            if response.status_code != 200:
+                response.failure(f"HTTP {response.status_code}")
+                return
+            first = True
+            for line in response.iter_lines():
+                if first and line.startswith(b"data:") and b"[DONE]" not in line:
+                    self._fire("time to first token", started)
+                    first = False
+                if line.startswith(b"event: error"):
+                    response.failure("error event in stream")
+                    self._fire("end to end", started, exception=RuntimeError("error event"))
+                    return
+            response.success()
+            self._fire("end to end", started)
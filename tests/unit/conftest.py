@@ -0,0 +1,14 @@
+# tests/conftest.py
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def tiny_model_dir(tmp_path_factory):
+    """
+    A randomly initialised two-layer Llama with a character-level tokenizer,
+    saved like a real model directory (config, weights, tokenizer files).
+    """
+    from serving.bench_serving import make_tiny_model
+
+    return make_tiny_model(str(tmp_path_factory.mktemp("tiny_model")))
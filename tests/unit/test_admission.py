@@ -0,0 +1,81 @@
+# tests/test_admission.py
+
+import asyncio
+import time
+
+import pytest
+
+from serving.admission import (
+    AdmissionController,
+    DeadlineExceededError,
+    RateLimitedError,
+    RequestTooLargeError,
+    TokenBucket,
+)
+
+
+def test_token_bucket_refills_at_rate():
+    bucket = TokenBucket(rate=10, burst=100, now=0.0)
+    assert bucket.take(80, now=0.0) == 0
+    assert bucket.take(80, now=0.0) == pytest.approx(6.0)
+    assert bucket.take(80, now=6.0) == 0
+
+
+def test_keys_are_rate_limited_independently():
+    admission = AdmissionController(rate_tokens_per_second=10, burst_tokens=100)
+
+    async def run():
+        admission.release(await admission.acquire("alpha", 80))
+        with pytest.raises(RateLimitedError) as excinfo:
+            await admission.acquire("alpha", 80)
+        assert excinfo.value.retry_after > 5
+        admission.release(await admission.acquire("beta", 80))
+        with pytest.raises(RequestTooLargeError):
+            await admission.acquire("gamma", 101)
+
+    asyncio.run(run())
+
+
+def test_waiters_are_admitted_by_priority():
+    admission = AdmissionController(max_tokens_in_flight=100)
+    order = []
+
+    async def request(name, priority):
+        async with admission.admit("key", 60, priority):
+            order.append(name)
+
+    async def run():
+        running = await admission.acquire("key", 100)
+        waiters = [
+            asyncio.ensure_future(request("low", "low")),
+            asyncio.ensure_future(request("normal", "normal")),
+            asyncio.ensure_future(request("high", "high")),
+        ]
+        await asyncio.sleep(0)
+        assert order == []
+        admission.release(running)
+        await asyncio.gather(*waiters)
+
+    asyncio.run(run())
+    assert order == ["high", "normal", "low"]
+
+
+def test_requests_that_would_miss_their_deadline_are_shed():
+    admission = AdmissionController(max_tokens_in_flight=100)
+    admission.seconds_per_token = 0.001
+
+    async def run():
+        # 1000 tokens take about a second, so a 100 ms deadline can't be met
+        with pytest.raises(DeadlineExceededError):
+            await admission.acquire("key", 1000, deadline=time.monotonic() + 0.1)
+
+        # Queued behind a long request, a waiter gives up at its deadline
+        running = await admission.acquire("key", 100)
+        started = time.monotonic()
+        with pytest.raises(DeadlineExceededError):
+            await admission.acquire("key", 10, deadline=time.monotonic() + 0.2)
+        assert time.monotonic() - started < 1
+        admission.release(running)
+        assert admission.tokens_in_flight == 0
+
+    asyncio.run(run())
@@ -0,0 +1,78 @@
+# tests/test_auth.py
+
+import json
+
+from botocore.exceptions import ClientError
+
+from serving.auth import ApiKeyStore
+
+
+class StubSecretsManager:
+    """
+    Local stand-in for the boto3 Secrets Manager client.
+    """
+
+    def __init__(self, keys=None, error=None, admin_keys=None):
+        self.keys = keys or []
+        self.admin_keys = admin_keys or []
+        self.error = error
+        self.calls = 0
+
+    def get_secret_value(self, SecretId):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return {"SecretString": json.dumps({
+            "api_keys": self.keys, "admin_api_keys": self.admin_keys
+        })}
+
+
+def _client_error():
+    return ClientError({"Error": {"Code": "ThrottlingException"}}, "GetSecretValue")
+
+
+def test_store_holds_only_hashed_keys():
+    store = ApiKeyStore(client_factory=lambda: StubSecretsManager(["alpha", "beta"]))
+    assert store.refresh()
+    assert store.is_valid("alpha")
+    assert not store.is_valid("gamma")
+    assert b"alpha" not in store._hashes
+
+
+def test_failed_refresh_keeps_previous_keys():
+    stub = StubSecretsManager(["alpha"])
+    store = ApiKeyStore(client_factory=lambda: stub)
+    assert store.refresh()
+
+    stub.error = _client_error()
+    assert not store.refresh()
+    assert store.is_valid("alpha")
+
+
+def test_env_fallback_when_nothing_loaded(monkeypatch):
+    monkeypatch.setenv("API_KEYS", "from-env")
+    store = ApiKeyStore(client_factory=lambda: StubSecretsManager(error=_client_error()))
+    assert not store.refresh()
+    assert store.is_valid("from-env")
+
+
+def test_start_loads_keys_before_returning():
+    stub = StubSecretsManager(["alpha"])
+    store = ApiKeyStore(client_factory=lambda: stub, refresh_interval=3600)
+    assert not store.ready
+    try:
+        store.start()
+        assert store.ready
+        assert store.is_valid("alpha")
+        store.start()
+        assert stub.calls == 1
+    finally:
+        store.stop()
+
+
+def test_admin_keys_are_separate():
+    store = ApiKeyStore(client_factory=lambda: StubSecretsManager(["alpha"], admin_keys=["root"]))
+    assert store.refresh()
+    assert store.is_admin("root")
+    assert not store.is_admin("alpha")
+    assert not store.is_valid("root")
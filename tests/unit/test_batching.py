@@ -0,0 +1,225 @@
+# tests/test_batching.py
+
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+import torch
+from transformers import GPT2Config, GPT2LMHeadModel
+
+from serving.batching import BatchingEngine, bucket_by_length
+from serving.prefix_cache import PrefixCache
+
+
+@pytest.fixture(scope="module")
+def tiny_model():
+    torch.manual_seed(0)
+    config = GPT2Config(
+        n_layer=2, n_head=2, n_embd=32, vocab_size=64, n_positions=128,
+        bos_token_id=63, eos_token_id=63,
+    )
+    model = GPT2LMHeadModel(config)
+    model.eval()
+    return model
+
+
+def test_batched_greedy_matches_generate(tiny_model):
+    tokenizer = SimpleNamespace(eos_token_id=None, pad_token_id=None)
+    engine = BatchingEngine(tiny_model, tokenizer, max_batch_size=4, batch_wait_ms=50)
+    prompts = [[1, 2, 3], [4, 5, 6, 7, 8, 9], [10], [11, 12, 13, 14]]
+    max_new = [5, 3, 8, 6]
+
+    async def run_all():
+        return await asyncio.gather(*[
+            engine.generate(p, max_new_tokens=n) for p, n in zip(prompts, max_new)
+        ])
+
+    try:
+        results = asyncio.run(run_all())
+    finally:
+        engine.stop(timeout=10)
+
+    for prompt, n, result in zip(prompts, max_new, results):
+        expected = tiny_model.generate(
+            torch.tensor([prompt]), max_new_tokens=n, do_sample=False, pad_token_id=0
+        )[0].tolist()
+        assert result == expected
+
+
+def test_request_finishing_at_prefill_shares_a_batch(tiny_model):
+    tokenizer = SimpleNamespace(eos_token_id=None, pad_token_id=None)
+    engine = BatchingEngine(tiny_model, tokenizer, max_batch_size=2, batch_wait_ms=0)
+
+    async def run():
+        return await engine.generate_group([([1, 2, 3], 1, 1.0), ([4, 5], 3, 1.0)])
+
+    try:
+        short, long = asyncio.run(run())
+    finally:
+        engine.stop(timeout=10)
+
+    assert len(short) == 4
+    assert len(long) == 5
+
+
+def test_stream_yields_generated_tokens(tiny_model):
+    tokenizer = SimpleNamespace(eos_token_id=None, pad_token_id=None)
+    engine = BatchingEngine(tiny_model, tokenizer, max_batch_size=2, batch_wait_ms=0)
+    prompt = [3, 1, 4, 1, 5]
+
+    async def collect():
+        full = await engine.generate(prompt, max_new_tokens=6)
+        streamed = [t async for t in engine.stream(prompt, max_new_tokens=6)]
+        return full, streamed
+
+    try:
+        full, streamed = asyncio.run(collect())
+    finally:
+        engine.stop(timeout=10)
+
+    assert streamed == full[len(prompt):]
+
+
+def test_prefix_cache_hit_matches_generate(tiny_model):
+    tokenizer = SimpleNamespace(eos_token_id=None, pad_token_id=None)
+    cache = PrefixCache(max_bytes=16 * 1024 * 1024, block_size=4, min_tokens=4)
+    engine = BatchingEngine(
+        tiny_model, tokenizer, max_batch_size=2, batch_wait_ms=0, prefix_cache=cache
+    )
+    preamble = [7, 8, 9, 10, 11, 12, 13, 14]
+    first, second = preamble + [1, 2, 3], preamble + [20, 21]
+
+    async def run_both():
+        return [await engine.generate(p, max_new_tokens=5) for p in (first, second)]
+
+    try:
+        results = asyncio.run(run_both())
+    finally:
+        engine.stop(timeout=10)
+
+    assert cache.hits == 1
+    assert cache.bytes > 0
+    for prompt, result in zip((first, second), results):
+        expected = tiny_model.generate(
+            torch.tensor([prompt]), max_new_tokens=5, do_sample=False, pad_token_id=0
+        )[0].tolist()
+        assert result == expected
+
+
+def test_prefix_cache_hash_collision_is_a_miss(monkeypatch):
+    # Every block hashes alike: only the token comparison tells prompts apart
+    monkeypatch.setattr(
+        "serving.prefix_cache._block_hashes",
+        lambda token_ids, block_size: [0] * (len(token_ids) // block_size)
+    )
+    cache = PrefixCache(max_bytes=1024 * 1024, block_size=4, min_tokens=4)
+    past = ((torch.zeros(1, 1, 9, 2), torch.zeros(1, 1, 9, 2)),)
+    cache.insert(list(range(9)), past)
+
+    assert cache.lookup(list(range(10, 20))) is None
+    assert cache.lookup(list(range(4)) + [50, 51, 52, 53, 54])[0] == 4
+
+
+def test_bucket_by_length_groups_similar_lengths():
+    lengths = [5, 100, 7, 98, 6, 99]
+    buckets = bucket_by_length(lengths, bucket_size=3)
+    assert buckets == [[0, 4, 2], [3, 5, 1]]
+
+
+def test_time_to_first_token_is_recorded_per_endpoint(tiny_model):
+    from prometheus_client import REGISTRY
+
+    from serving.metrics import track_first_token
+
+    def count():
+        return REGISTRY.get_sample_value(
+            "fluxpilot_time_to_first_token_seconds_count", {"endpoint": "/test"}
+        ) or 0
+
+    tokenizer = SimpleNamespace(eos_token_id=None, pad_token_id=None)
+    engine = BatchingEngine(tiny_model, tokenizer, max_batch_size=4, batch_wait_ms=0)
+
+    async def run():
+        # Untracked requests are not observed; tracked ones once per sequence
+        await engine.generate([1, 2, 3], max_new_tokens=3)
+        track_first_token("/test")
+        await engine.generate_group([([4, 5], 3, 1.0), ([6], 3, 1.0)])
+
+    before = count()
+    try:
+        asyncio.run(run())
+    finally:
+        engine.stop(timeout=10)
+    assert count() - before == 2
+
+
+def test_generate_group_reports_per_item_errors(tiny_model):
+    tokenizer = SimpleNamespace(eos_token_id=None, pad_token_id=None)
+    engine = BatchingEngine(tiny_model, tokenizer, max_batch_size=4, batch_wait_ms=0)
+
+    async def run():
+        return await engine.generate_group([([1, 2, 3], 4, 1.0), ([], 4, 1.0), ([5, 6], 2, 1.0)])
+
+    try:
+        results = asyncio.run(run())
+    finally:
+        engine.stop(timeout=10)
+
+    assert results[0][:3] == [1, 2, 3]
+    assert isinstance(results[1], ValueError)
+    assert results[2][:2] == [5, 6]
+
+
+def test_engine_spans_join_the_request_trace(tiny_model, monkeypatch):
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    tracer = provider.get_tracer("test")
+    monkeypatch.setattr("serving.batching.tracer", tracer)
+
+    tokenizer = SimpleNamespace(eos_token_id=None, pad_token_id=None)
+    engine = BatchingEngine(tiny_model, tokenizer, max_batch_size=2, batch_wait_ms=0)
+
+    async def run():
+        with tracer.start_as_current_span("request") as parent:
+            await engine.generate([1, 2, 3], max_new_tokens=4)
+        return parent
+
+    try:
+        parent = asyncio.run(run())
+    finally:
+        engine.stop(timeout=10)
+
+    spans = {span.name: span for span in exporter.get_finished_spans()}
+    assert spans["prefill"].attributes["prompt_tokens"] == 3
+    assert spans["decode"].attributes["generated_tokens"] == 4
+    for name in ("prefill", "decode"):
+        assert spans[name].parent.span_id == parent.get_span_context().span_id
+        assert spans[name].context.trace_id == parent.get_span_context().trace_id
+
+
+def test_profile_captures_live_decode_steps(tiny_model, tmp_path):
+    tokenizer = SimpleNamespace(eos_token_id=None, pad_token_id=None)
+    engine = BatchingEngine(tiny_model, tokenizer, max_batch_size=2, batch_wait_ms=0)
+    path = str(tmp_path / "trace.json")
+
+    async def run():
+        profiling = asyncio.ensure_future(engine.profile(0.5, path))
+        await asyncio.sleep(0.05)
+        await engine.generate([1, 2, 3], max_new_tokens=8)
+        await profiling
+
+    try:
+        engine.start()
+        asyncio.run(run())
+    finally:
+        engine.stop(timeout=10)
+
+    with open(path) as f:
+        names = {event.get("name") for event in json.load(f)["traceEvents"]}
+    assert "decode_step" in names
@@ -0,0 +1,70 @@
+# tests/test_checkpointing.py
+
+import os
+
+import torch
+from datasets import Dataset
+from transformers import AutoModelForCausalLM, TrainerCallback, TrainingArguments
+
+from training.checkpointing import CheckpointingTrainer, latest_checkpoint
+
+
+class StopAt(TrainerCallback):
+    def __init__(self, step):
+        self.step = step
+
+    def on_step_end(self, args, state, control, **kwargs):
+        control.should_training_stop = state.global_step == self.step
+
+
+def _trainer(tiny_model_dir, output_dir, callbacks=None):
+    torch.manual_seed(0)
+    input_ids = torch.randint(0, 64, (24, 16), generator=torch.Generator().manual_seed(0)).tolist()
+    args = TrainingArguments(
+        output_dir=output_dir,
+        max_steps=6,
+        per_device_train_batch_size=2,
+        learning_rate=1e-3,
+        use_cpu=True,
+        seed=0,
+        save_strategy="steps",
+        save_steps=2,
+        save_total_limit=2,
+        logging_strategy="no",
+        report_to=[],
+        disable_tqdm=True
+    )
+    return CheckpointingTrainer(
+        model=AutoModelForCausalLM.from_pretrained(tiny_model_dir),
+        args=args,
+        train_dataset=Dataset.from_dict({"input_ids": input_ids, "labels": input_ids}),
+        callbacks=callbacks
+    )
+
+
+def test_checkpoints_are_safetensors_and_pruned(tiny_model_dir, tmp_path):
+    _trainer(tiny_model_dir, str(tmp_path)).train()
+
+    assert sorted(os.listdir(tmp_path)) == ["checkpoint-4", "checkpoint-6"]
+    files = os.listdir(tmp_path / "checkpoint-6")
+    assert {"model.safetensors", "optimizer.safetensors", "rng_state.safetensors",
+            "scheduler.json", "trainer_state.json"} <= set(files)
+    assert not any(name.endswith((".pt", ".pth", ".bin")) for name in files)
+
+    # A checkpoint directory without its trainer state was never completed
+    os.makedirs(tmp_path / "checkpoint-8")
+    assert latest_checkpoint(str(tmp_path)) == str(tmp_path / "checkpoint-6")
+
+
+def test_resumed_training_matches_uninterrupted(tiny_model_dir, tmp_path):
+    full = _trainer(tiny_model_dir, str(tmp_path / "full"))
+    full.train()
+
+    # A run that died after its step-4 checkpoint, retried
+    _trainer(tiny_model_dir, str(tmp_path / "resumed"), callbacks=[StopAt(4)]).train()
+    resumed = _trainer(tiny_model_dir, str(tmp_path / "resumed"))
+    resumed.train(resume_from_checkpoint=latest_checkpoint(str(tmp_path / "resumed")))
+
+    assert resumed.state.global_step == 6
+    for expected, actual in zip(full.model.parameters(), resumed.model.parameters()):
+        assert torch.allclose(expected, actual, atol=1e-6)
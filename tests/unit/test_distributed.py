@@ -0,0 +1,25 @@
+# tests/test_distributed.py
+
+import sys
+
+from training.bench_scaling import scaling_efficiency
+from training.distributed import launch_command
+
+
+def test_launch_command():
+    assert launch_command(1) == [sys.executable, "-m", "training.train"]
+    command = launch_command(4, args=["--epochs", "1"])
+    assert command[1:4] == ["-m", "torch.distributed.run", "--standalone"]
+    assert "--nproc_per_node=4" in command
+    assert command[-4:] == ["-m", "training.train", "--epochs", "1"]
+
+
+def test_scaling_efficiency_is_relative_to_fewest_ranks():
+    results = [
+        {"ranks": 1, "samples_per_second": 10.0},
+        {"ranks": 2, "samples_per_second": 18.0},
+        {"ranks": 4, "samples_per_second": 30.0},
+    ]
+    scaling_efficiency(results)
+    assert [r["speedup"] for r in results] == [1.0, 1.8, 3.0]
+    assert [r["scaling_efficiency"] for r in results] == [1.0, 0.9, 0.75]
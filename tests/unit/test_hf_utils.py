@@ -0,0 +1,90 @@
+# tests/test_hf_utils.py
+
+import torch
+from datasets import Dataset
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from training.hf_utils import (
+    IGNORE_INDEX,
+    collate_packed,
+    collate_padded,
+    group_texts,
+    pack_dataset,
+    padding_report,
+    preprocess_function,
+)
+
+
+def test_pack_dataset_fills_blocks_with_eos_separated_documents(tiny_model_dir):
+    tokenizer = AutoTokenizer.from_pretrained(tiny_model_dir)
+    eos = tokenizer.eos_token_id
+    dataset = Dataset.from_dict({"text": ["abcdef", "", "  ", "ghij", "klmnopqrstu", "vw"]})
+
+    packed, stats = pack_dataset(dataset, tokenizer, block_size=8)
+
+    assert stats["documents"] == 4
+    assert stats["tokens"] == 7 + 5 + 12 + 3
+    assert stats["blocks"] == 3
+    assert stats["packing_efficiency"] == round(24 / 27, 4)
+    assert stats["unpacked_efficiency"] == round(27 / (5 * 8), 4)
+    first = packed[0]
+    assert first["input_ids"] == tokenizer("abcdef")["input_ids"] + [eos, tokenizer("g")["input_ids"][0]]
+    assert all(row["labels"] == row["input_ids"] for row in packed)
+    assert all(len(row["input_ids"]) == 8 for row in packed)
+
+
+def test_separate_documents_masks_attention_and_labels(tiny_model_dir):
+    tokenizer = AutoTokenizer.from_pretrained(tiny_model_dir)
+    model = AutoModelForCausalLM.from_pretrained(tiny_model_dir).eval()
+    docs = [tokenizer(t)["input_ids"] + [tokenizer.eos_token_id] for t in ("hello", "wor", "ld!")]
+
+    block = group_texts({"input_ids": docs}, block_size=12, separate_documents=True)
+    assert block["position_ids"][0] == [0, 1, 2, 3, 4, 5, 0, 1, 2, 3, 0, 1]
+    assert [i for i, label in enumerate(block["labels"][0]) if label == IGNORE_INDEX] == [6, 10]
+
+    batch = collate_packed([
+        {key: values[0] for key, values in block.items()}
+    ])
+    with torch.no_grad():
+        packed = model(**batch).logits[0]
+        alone = model(torch.tensor([docs[1]])).logits[0]
+    assert torch.allclose(packed[6:10], alone, atol=1e-5)
+
+
+def test_collate_padded_pads_to_batch_max_and_masks_labels():
+    features = [
+        {"input_ids": [5, 6, 7], "attention_mask": [1, 1, 1], "labels": [5, 6, 7], "length": 3},
+        {"input_ids": [8], "attention_mask": [1], "labels": [8], "length": 1},
+    ]
+    batch = collate_padded(features, pad_token_id=0, pad_to_multiple_of=4)
+
+    assert set(batch) == {"input_ids", "attention_mask", "labels"}
+    assert batch["input_ids"].tolist() == [[5, 6, 7, 0], [8, 0, 0, 0]]
+    assert batch["attention_mask"].tolist() == [[1, 1, 1, 0], [1, 0, 0, 0]]
+    assert batch["labels"].tolist() == [[5, 6, 7, IGNORE_INDEX], [8] + [IGNORE_INDEX] * 3]
+    assert collate_padded(features, pad_token_id=0)["input_ids"].shape == (2, 3)
+
+
+def test_blank_lines_yield_no_empty_windows(tiny_model_dir):
+    tokenizer = AutoTokenizer.from_pretrained(tiny_model_dir)
+    model = AutoModelForCausalLM.from_pretrained(tiny_model_dir)
+    dataset = Dataset.from_dict({"text": ["", " ", "a", "", "hello world", "\n"] * 4})
+    windows = dataset.map(
+        lambda batch: preprocess_function(batch, tokenizer, max_length=8, stride=2),
+        batched=True,
+        remove_columns=["text"]
+    )
+
+    assert min(windows["length"]) >= 2
+    # Length grouping puts the shortest windows in one batch
+    shortest = sorted(windows, key=lambda row: row["length"])[:4]
+    batch = collate_padded(shortest, pad_token_id=tokenizer.pad_token_id or 0)
+    loss = model(**batch).loss
+    assert torch.isfinite(loss)
+
+
+def test_length_grouping_reduces_padding():
+    lengths = [8, 512] * 800 + [100, 120, 250, 260] * 400
+    report = padding_report(lengths, batch_size=8, max_length=512, pad_to_multiple_of=8)
+    assert report["grouped"] < report["random"] / 2
+    assert report["random"] < report["fixed"]
@@ -0,0 +1,72 @@
+# tests/test_logging.py
+
+import logging
+import queue
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from serving.logging import (
+    DroppingQueueHandler,
+    RequestLogMiddleware,
+    SamplingFilter,
+    log_fields,
+    log_stage,
+)
+
+
+def _dropped(reason):
+    return REGISTRY.get_sample_value(
+        "fluxpilot_log_records_dropped_total", {"reason": reason}
+    ) or 0.0
+
+
+def _record(name, level=logging.INFO, msg="hello %s", args=("world",)):
+    return logging.LogRecord(name, level, __file__, 1, msg, args, None)
+
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = DroppingQueueHandler(queue.Queue(maxsize=1))
+    before = _dropped("queue_full")
+    handler.handle(_record("serve"))
+    handler.handle(_record("serve"))
+    assert _dropped("queue_full") == before + 1
+    assert handler.queue.get_nowait().getMessage() == "hello world"
+
+
+def test_sampling_applies_to_child_loggers_but_not_warnings():
+    sampling = SamplingFilter({"serve.access": 0.0})
+    assert not sampling.filter(_record("serve.access"))
+    assert not sampling.filter(_record("serve.access.stream"))
+    assert sampling.filter(_record("serve.access", level=logging.WARNING))
+    assert sampling.filter(_record("serve.batching"))
+
+
+def test_access_log_has_request_id_tokens_and_stages(caplog):
+    app = FastAPI()
+    app.add_middleware(RequestLogMiddleware, skip_paths=["/healthz"])
+
+    @app.get("/work")
+    async def work():
+        with log_stage("generate"):
+            log_fields(input_tokens=3, output_tokens=5)
+        logging.getLogger("serve.test").info("inside the request")
+        return {}
+
+    @app.get("/healthz")
+    async def healthz():
+        return {}
+
+    client = TestClient(app)
+    with caplog.at_level(logging.INFO):
+        response = client.get("/work", headers={"X-Request-ID": "req-1"})
+        generated = client.get("/work").headers["x-request-id"]
+        client.get("/healthz")
+
+    assert response.headers["x-request-id"] == "req-1"
+    access = [r for r in caplog.records if r.name == "serve.access"]
+    assert [r.request_id for r in access] == ["req-1", generated]
+    assert access[0].status == 200
+    assert access[0].input_tokens == 3 and access[0].output_tokens == 5
+    assert "generate" in access[0].stages_ms
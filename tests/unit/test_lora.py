@@ -0,0 +1,51 @@
+# tests/test_lora.py
+
+import os
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from serving.model_loader import load_model
+from training.lora import apply_lora, parameter_counts
+
+
+def _adapter(tiny_model_dir, path):
+    model = apply_lora(AutoModelForCausalLM.from_pretrained(tiny_model_dir), rank=4)
+    # LoRA starts as a no-op (B = 0); give it an effect to check for
+    torch.manual_seed(0)
+    with torch.no_grad():
+        for name, param in model.named_parameters():
+            if "lora_B" in name:
+                param.normal_(std=0.5)
+    model.save_pretrained(path)
+    AutoTokenizer.from_pretrained(tiny_model_dir).save_pretrained(path)
+    return model
+
+
+def test_only_adapter_weights_are_trained_and_saved(tiny_model_dir, tmp_path):
+    full = parameter_counts(AutoModelForCausalLM.from_pretrained(tiny_model_dir))
+    model = _adapter(tiny_model_dir, str(tmp_path))
+    counts = parameter_counts(model)
+
+    assert counts["total_params"] > full["total_params"]
+    assert counts["trainable_params"] * 20 < full["trainable_params"]
+    assert counts["optimizer_state_mb"] * 20 < full["optimizer_state_mb"]
+    assert "model.safetensors" not in os.listdir(tmp_path)
+    assert os.path.getsize(tmp_path / "adapter_model.safetensors") * 20 < os.path.getsize(
+        os.path.join(tiny_model_dir, "model.safetensors")
+    )
+
+
+def test_serving_merges_or_attaches_an_adapter_only_model_dir(tiny_model_dir, tmp_path):
+    trained = _adapter(tiny_model_dir, str(tmp_path)).eval()
+    input_ids = torch.tensor([[5, 6, 7, 8]])
+
+    _, merged = load_model(str(tmp_path), adapter_mode="merge")
+    _, attached = load_model(str(tmp_path), adapter_mode="attach")
+    _, base = load_model(tiny_model_dir)
+    with torch.no_grad():
+        expected = trained(input_ids).logits
+        assert torch.allclose(merged(input_ids).logits, expected, atol=1e-4)
+        assert torch.allclose(attached(input_ids).logits, expected, atol=1e-4)
+        assert not torch.allclose(base(input_ids).logits, expected, atol=1e-4)
+    assert not any("lora" in name for name, _ in merged.named_parameters())
@@ -0,0 +1,44 @@
+# tests/test_metrics.py
+
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from serving.metrics import MetricsMiddleware
+
+
+def _count(endpoint, status):
+    return REGISTRY.get_sample_value(
+        "fluxpilot_http_requests_total",
+        {"method": "GET", "endpoint": endpoint, "http_status": str(status)},
+    ) or 0.0
+
+
+def test_requests_are_labelled_by_route_template():
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/items/{item_id}")
+    async def item(item_id: int):
+        return {"id": item_id}
+
+    @app.get("/chunks")
+    async def chunks():
+        async def body():
+            for i in range(3):
+                yield f"{i}\n"
+        return StreamingResponse(body(), media_type="text/plain")
+
+    before_item = _count("/items/{item_id}", 200)
+    before_missing = _count("unmatched", 404)
+    client = TestClient(app)
+    assert client.get("/items/1").status_code == 200
+    assert client.get("/items/2").status_code == 200
+    assert client.get("/chunks").text == "0\n1\n2\n"
+    assert client.get("/no/such/path").status_code == 404
+
+    assert _count("/items/{item_id}", 200) == before_item + 2
+    assert _count("/chunks", 200) >= 1
+    assert _count("unmatched", 404) == before_missing + 1
+    assert _count("/items/1", 200) == 0
@@ -0,0 +1,29 @@
+# tests/test_performance.py
+
+from argparse import Namespace
+
+from training.performance import accumulation_steps, apply_profile, parse_cpu_list
+
+
+def test_profile_fills_only_unset_settings():
+    args = Namespace(perf_profile="cpu_throughput", bf16=False, gradient_checkpointing=False,
+                     global_batch_size=128)
+    apply_profile(args)
+    assert args.bf16 and args.gradient_checkpointing
+    assert args.global_batch_size == 128
+
+    args = Namespace(perf_profile="default", bf16=False, gradient_checkpointing=False,
+                     global_batch_size=0)
+    apply_profile(args)
+    assert not args.bf16 and args.global_batch_size == 0
+
+
+def test_accumulation_reaches_global_batch():
+    assert accumulation_steps(0, 4) == 1
+    assert accumulation_steps(32, 4) == 8
+    assert accumulation_steps(32, 4, world_size=2) == 4
+    assert accumulation_steps(30, 4) == 8
+
+
+def test_parse_cpu_list():
+    assert parse_cpu_list("0-3,8,10-11") == [0, 1, 2, 3, 8, 10, 11]
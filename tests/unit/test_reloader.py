@@ -0,0 +1,132 @@
+# tests/test_reloader.py
+
+import asyncio
+import os
+import shutil
+
+import mlflow
+import pytest
+from mlflow.tracking import MlflowClient
+
+from serving.config import ServingSettings
+from serving.reloader import LocalDirectorySource, ModelReloader, make_source
+from serving.runtime import ModelRuntime
+
+
+@pytest.fixture
+def registry(tmp_path, tiny_model_dir):
+    """
+    A local file-based MLflow tracking store and model registry.
+    """
+    uri = f"file:{tmp_path / 'mlruns'}"
+    mlflow.set_tracking_uri(uri)
+    client = MlflowClient(tracking_uri=uri, registry_uri=uri)
+
+    def register():
+        with mlflow.start_run() as run:
+            mlflow.log_artifacts(tiny_model_dir, "model")
+        version = mlflow.register_model(f"runs:/{run.info.run_id}/model", "TinyModel").version
+        client.set_registered_model_alias("TinyModel", "champion", version)
+        return version
+
+    yield uri, register
+    mlflow.set_tracking_uri(None)
+
+
+def _settings(model_dir):
+    return ServingSettings(model_dir=model_dir, prefix_cache_mb=0, warmup_prompt_lengths=[8])
+
+
+def test_mlflow_source_follows_alias(registry, tmp_path):
+    uri, register = registry
+    register()
+    source = make_source("models:/TinyModel@champion", str(tmp_path / "models"), tracking_uri=uri)
+    assert source.latest() == "TinyModel/1"
+    assert os.path.isfile(os.path.join(source.fetch("TinyModel/1"), "config.json"))
+
+    register()
+    assert source.latest() == "TinyModel/2"
+
+
+def test_reloader_swaps_and_drains(registry, tmp_path, tiny_model_dir):
+    uri, register = registry
+    register()
+    settings = _settings(tiny_model_dir)
+    source = make_source("models:/TinyModel@champion", str(tmp_path / "models"), tracking_uri=uri)
+    current = ModelRuntime.load(settings, tiny_model_dir, version="TinyModel/1")
+    current.start()
+    swapped = []
+
+    async def run():
+        reloader = ModelReloader(source, settings, current, on_swap=swapped.append)
+        assert not await reloader.check()
+
+        register()
+        current.in_flight = 1
+
+        async def finish_request():
+            await asyncio.sleep(0.2)
+            current.in_flight = 0
+
+        done = asyncio.ensure_future(finish_request())
+        assert await reloader.check()
+        # The old runtime was only stopped after its request finished
+        assert done.done()
+        return reloader
+
+    reloader = asyncio.run(run())
+    try:
+        assert [rt.version for rt in swapped] == ["TinyModel/2"]
+        assert reloader.current is swapped[0]
+        assert not current.engine._thread.is_alive()
+    finally:
+        swapped[0].stop(timeout=10)
+
+
+def test_reloader_swaps_in_an_adapter_version(tmp_path, tiny_model_dir):
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    from training.lora import apply_lora
+
+    # Laid out like the adapter artifact train.py --lora registers, with
+    # non-zero updates so the swapped model differs from the base
+    adapter_dir = tmp_path / "models" / "adapter"
+    adapter = apply_lora(AutoModelForCausalLM.from_pretrained(tiny_model_dir), rank=4)
+    with torch.no_grad():
+        for name, param in adapter.named_parameters():
+            if "lora_B" in name:
+                param.normal_(std=0.5)
+    adapter.save_pretrained(adapter_dir)
+    AutoTokenizer.from_pretrained(tiny_model_dir).save_pretrained(adapter_dir)
+    settings = _settings(tiny_model_dir)
+    source = LocalDirectorySource(str(tmp_path / "models"))
+    source.latest()
+    current = ModelRuntime.load(settings, tiny_model_dir, version="base")
+    current.start()
+    swapped = []
+
+    reloader = ModelReloader(source, settings, current, on_swap=swapped.append)
+    assert asyncio.run(reloader.check())
+    try:
+        assert swapped[0].version == source.fingerprint()
+        input_ids = torch.tensor([[5, 6, 7, 8]])
+        with torch.no_grad():
+            assert not torch.allclose(
+                swapped[0].model(input_ids).logits, current.model(input_ids).logits, atol=1e-4
+            )
+    finally:
+        swapped[0].stop(timeout=10)
+
+
+def test_local_directory_waits_for_a_stable_copy(tmp_path, tiny_model_dir):
+    target = tmp_path / "model"
+    shutil.copytree(tiny_model_dir, target)
+    source = LocalDirectorySource(str(target))
+    assert source.latest() is None
+    first = source.latest()
+    assert first is not None
+
+    (target / "extra.txt").write_text("new file")
+    assert source.latest() is None
+    assert source.latest() not in (None, first)
@@ -0,0 +1,66 @@
+# tests/test_response_cache.py
+
+import asyncio
+
+from serving.response_cache import ResponseCache, make_cache_key
+
+
+def test_cache_key_depends_on_decoding_params():
+    base = make_cache_key("Hello", 20, 1.0, "v1")
+    assert base == make_cache_key("Hello", 20, 1.0, "v1")
+    assert base != make_cache_key("Hello", 21, 1.0, "v1")
+    assert base != make_cache_key("Hello", 20, 1.0, "v2")
+
+
+def test_concurrent_duplicates_are_coalesced():
+    cache = ResponseCache(max_entries=8, ttl_seconds=60)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"generated_text": "hi"}
+
+    async def run():
+        return await asyncio.gather(*[cache.get_or_compute("k", compute) for _ in range(5)])
+
+    assert cache.get("k") is None
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(r == {"generated_text": "hi"} for r in results)
+    assert cache.get("k") == {"generated_text": "hi"}
+
+
+def test_lru_and_ttl_eviction(monkeypatch):
+    cache = ResponseCache(max_entries=2, ttl_seconds=10)
+    now = [1000.0]
+    monkeypatch.setattr("serving.response_cache.time.time", lambda: now[0])
+
+    async def fill(key):
+        async def compute():
+            return key
+        return await cache.get_or_compute(key, compute)
+
+    for key in ("a", "b", "c"):
+        asyncio.run(fill(key))
+    assert cache._get_memory("a") is None
+    assert cache._get_memory("c") == "c"
+
+    now[0] += 11
+    assert cache._get_memory("c") is None
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    first = ResponseCache(ttl_seconds=60, disk_dir=str(tmp_path))
+
+    async def compute():
+        return {"generated_text": "persisted"}
+
+    asyncio.run(first.get_or_compute("k", compute))
+
+    second = ResponseCache(ttl_seconds=60, disk_dir=str(tmp_path))
+
+    async def fail():
+        raise AssertionError("should have been served from disk")
+
+    assert asyncio.run(second.get_or_compute("k", fail)) == {"generated_text": "persisted"}
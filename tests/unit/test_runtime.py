@@ -0,0 +1,47 @@
+# tests/test_runtime.py
+
+import asyncio
+
+import pytest
+from prometheus_client import REGISTRY
+
+from serving.config import ServingSettings
+from serving.runtime import ModelRuntime
+
+
+def _settings(model_dir, **overrides):
+    values = dict(model_dir=model_dir, prefix_cache_mb=1, prefix_cache_min_tokens=16)
+    values.update(overrides)
+    return ServingSettings(**values)
+
+
+def test_load_and_warmup(tiny_model_dir):
+    runtime = ModelRuntime.load(_settings(tiny_model_dir), tiny_model_dir, version="v1")
+    runtime.start()
+
+    async def run():
+        # Longer than the model's 256 positions: clamped, not an error
+        await runtime.warmup([8, 64, 1000], max_new_tokens=4)
+        encoded = runtime.tokenize("hello")
+        return await runtime.generate(encoded["input_ids"], max_new_tokens=3, temperature=1.0)
+
+    try:
+        output_ids = asyncio.run(run())
+    finally:
+        runtime.stop(timeout=10)
+
+    assert len(output_ids) == len("hello") + 3
+    assert runtime.prefix_cache.bytes == 0
+    for phase in ("load_model", "warmup"):
+        assert REGISTRY.get_sample_value("fluxpilot_startup_phase_seconds", {"phase": phase}) > 0
+
+
+def test_speculative_decoding_needs_batching_off(tiny_model_dir):
+    settings = _settings(tiny_model_dir, draft_model_dir=tiny_model_dir, max_batch_size=8)
+    with pytest.raises(ValueError, match="max_batch_size"):
+        ModelRuntime.load(settings, tiny_model_dir, version="v1")
+
+    settings = _settings(tiny_model_dir, draft_model_dir=tiny_model_dir, max_batch_size=1)
+    runtime = ModelRuntime.load(settings, tiny_model_dir, version="v1")
+    assert runtime.speculative is not None
+    runtime.stop(timeout=10)
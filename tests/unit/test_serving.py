@@ -26,3 +26,60 @@ def temp_model_dir(tmp_path, monkeypatch):
     monkeypatch.setenv("SERVE_MODEL_DIR", str(model_dir))
     yield
     shutil.rmtree(str(model_dir))
+
+
+@pytest.fixture
+def ready_app(tiny_model_dir, monkeypatch):
+    # The tiny model served as if the worker had finished starting up
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    import serving.app as serving_app
+    from serving import startup
+    from serving.auth import verify_api_key
+    from serving.runtime import ModelRuntime
+
+    rt = ModelRuntime(
+        serving_app.settings,
+        AutoTokenizer.from_pretrained(tiny_model_dir),
+        AutoModelForCausalLM.from_pretrained(tiny_model_dir).eval(),
+        "test"
+    )
+    monkeypatch.setattr(serving_app, "runtime", rt)
+    monkeypatch.setattr(serving_app, "phase", startup.READY)
+    app.dependency_overrides[verify_api_key] = lambda: "test-key"
+    yield rt
+    app.dependency_overrides.clear()
+    rt.engine.stop(timeout=10)
+
+
+def test_batch_item_failure_does_not_fail_its_bucket(ready_app, monkeypatch):
+    forward = ready_app.engine._forward
+    poison = ready_app.tokenizer("z")["input_ids"][-1]
+
+    def failing_forward(**kwargs):
+        if (kwargs["input_ids"] == poison).any():
+            raise RuntimeError("poisoned prompt")
+        return forward(**kwargs)
+
+    monkeypatch.setattr(ready_app.engine, "_forward", failing_forward)
+    items = [
+        {"prompt": "ab", "max_new_tokens": 3},
+        {"prompt": "zz", "max_new_tokens": 3},
+        {"prompt": "", "max_new_tokens": 3},
+        {"prompt": "abc", "max_new_tokens": 1},
+    ]
+    resp = client.post("/generate/batch", json={"requests": items})
+
+    assert resp.status_code == 200
+    results = resp.json()["results"]
+    assert "generated_text" in results[0] and "generated_text" in results[3]
+    assert results[1] == {"error": "poisoned prompt"}
+    assert "error" in results[2]
+
+
+def test_empty_prompt_is_a_client_error(ready_app):
+    for path in ("/generate", "/generate/stream"):
+        resp = client.post(path, json={"prompt": "", "max_new_tokens": 3})
+        assert resp.status_code == 400
+        assert resp.json()["detail"] == "Prompt must contain at least one token"
+    assert ready_app.in_flight == 0
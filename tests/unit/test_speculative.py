@@ -0,0 +1,69 @@
+# tests/test_speculative.py
+
+import contextvars
+
+import pytest
+import torch
+from transformers import GPT2Config, GPT2LMHeadModel
+
+from serving.speculative import SpeculativeDecoder
+
+
+def _tiny_gpt2(seed, n_layer):
+    torch.manual_seed(seed)
+    config = GPT2Config(
+        n_layer=n_layer, n_head=2, n_embd=32, vocab_size=64, n_positions=128,
+        bos_token_id=63, eos_token_id=63,
+    )
+    return GPT2LMHeadModel(config).eval()
+
+
+@pytest.fixture(scope="module")
+def target():
+    return _tiny_gpt2(seed=0, n_layer=2)
+
+
+@pytest.mark.parametrize("num_draft_tokens", [1, 3, 5])
+def test_output_matches_target_greedy(target, num_draft_tokens):
+    # An unrelated draft is rejected often, which exercises cache rollback
+    draft = _tiny_gpt2(seed=1, n_layer=1)
+    decoder = SpeculativeDecoder(target, draft, num_draft_tokens, eos_token_ids=[63])
+    for prompt, max_new in [([1, 2, 3], 12), ([7], 20), ([5, 9, 11, 2, 8, 4], 7)]:
+        expected = target.generate(
+            torch.tensor([prompt]), max_new_tokens=max_new, do_sample=False, pad_token_id=0
+        )[0].tolist()
+        assert decoder.generate(prompt, max_new) == expected
+
+
+def test_identical_draft_is_always_accepted(target, monkeypatch):
+    passes = []
+    decoder = SpeculativeDecoder(target, target, num_draft_tokens=4)
+    monkeypatch.setattr(
+        "serving.speculative.SPECULATIVE_TOKENS_PER_PASS.observe", passes.append
+    )
+    out = decoder.generate([1, 2, 3], 12)
+    assert len(out) == 15
+    # Every round accepts 4 drafts plus the target's bonus token
+    assert passes == [12 / 3]
+
+
+def test_time_to_first_token_is_recorded(target):
+    from prometheus_client import REGISTRY
+
+    from serving.metrics import track_first_token
+
+    def count():
+        return REGISTRY.get_sample_value(
+            "fluxpilot_time_to_first_token_seconds_count", {"endpoint": "/speculative"}
+        ) or 0
+
+    decoder = SpeculativeDecoder(target, target, num_draft_tokens=4)
+
+    def request():
+        track_first_token("/speculative")
+        decoder.generate([1, 2, 3], 6)
+
+    before = count()
+    # A context of its own, like a request's, so the timing doesn't leak
+    contextvars.copy_context().run(request)
+    assert count() - before == 1
@@ -0,0 +1,52 @@
+# tests/test_sse.py
+
+import asyncio
+
+import pytest
+
+from serving.streaming import ClosingStreamingResponse
+
+
+async def _body(started):
+    started.append(True)
+    yield "data: 1\n\n"
+
+
+def _serve(send, receive):
+    started, closed = [], []
+
+    async def on_close():
+        closed.append(True)
+
+    async def run():
+        response = ClosingStreamingResponse(_body(started), on_close=on_close)
+        await response({"type": "http"}, receive, send)
+
+    return run, started, closed
+
+
+def test_on_close_runs_when_client_leaves_before_the_body_starts():
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        # Never gets past the response headers
+        await asyncio.sleep(10)
+
+    run, started, closed = _serve(send, receive)
+    asyncio.run(run())
+    assert closed == [True]
+    assert not started
+
+
+def test_on_close_runs_when_sending_fails():
+    async def receive():
+        await asyncio.sleep(10)
+
+    async def send(message):
+        raise OSError("connection reset")
+
+    run, _, closed = _serve(send, receive)
+    with pytest.raises(OSError):
+        asyncio.run(run())
+    assert closed == [True]
@@ -0,0 +1,38 @@
+# tests/test_tokenized_cache.py
+
+from datasets import Dataset
+from transformers import AutoTokenizer
+
+from training.tokenized_cache import cache_key, tokenize_dataset
+
+
+def _dataset():
+    return Dataset.from_dict({"text": [f"line {i} " * (i % 7 + 1) for i in range(64)]})
+
+
+def test_second_run_loads_from_cache(tiny_model_dir, tmp_path):
+    tokenizer = AutoTokenizer.from_pretrained(tiny_model_dir)
+    first, meta = tokenize_dataset(
+        _dataset(), tokenizer, str(tmp_path), max_length=32, stride=8, num_proc=2
+    )
+    assert not meta["cache_hit"]
+    assert meta["tokens"] > 0 and meta["tokens_per_second"] > 0
+
+    second, meta_again = tokenize_dataset(_dataset(), tokenizer, str(tmp_path), max_length=32, stride=8)
+    assert meta_again["cache_hit"]
+    assert meta_again["cache_key"] == meta["cache_key"]
+    assert second["input_ids"] == first["input_ids"]
+    assert second["labels"] == second["input_ids"]
+
+
+def test_key_changes_with_parameters_tokenizer_and_data(tiny_model_dir):
+    tokenizer = AutoTokenizer.from_pretrained(tiny_model_dir)
+    dataset = _dataset()
+    key = cache_key(dataset, tokenizer, 32, 8)
+    assert cache_key(_dataset(), AutoTokenizer.from_pretrained(tiny_model_dir), 32, 8) == key
+    assert cache_key(dataset, tokenizer, 64, 8) != key
+    assert cache_key(dataset, tokenizer, 32, 8, packing=True) != key
+    assert cache_key(dataset.select(range(10)), tokenizer, 32, 8) != key
+
+    tokenizer.add_tokens(["<extra>"])
+    assert cache_key(dataset, tokenizer, 32, 8) != key
@@ -0,0 +1,181 @@
+# training/bench_scaling.py
+#
+# Data-parallel scaling of CPU training on this node: trains a fixed number
+# of steps at a fixed per-rank batch for each rank count (torchrun + gloo,
+# as `orchestrator/flow.py` launches training) and reports throughput and
+# scaling efficiency against one rank:
+#   python -m training.bench_scaling --ranks 1,2,4,8 --output scaling.json
+#   python -m training.bench_scaling --model_dir /models/granite --seq_len 512
+
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from training.distributed import launch_command
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Measure multi-rank CPU training throughput and scaling efficiency"
+    )
+    parser.add_argument(
+        "--model_dir", type=str, default=None,
+        help="Model to train; a tiny random model is generated when omitted"
+    )
+    parser.add_argument(
+        "--ranks", type=str, default="1,2,4,8",
+        help="Comma-separated numbers of ranks to run"
+    )
+    parser.add_argument("--batch_size", type=int, default=4, help="Sequences per rank per step")
+    parser.add_argument("--seq_len", type=int, default=128, help="Tokens per sequence")
+    parser.add_argument("--steps", type=int, default=20, help="Timed optimizer steps per run")
+    parser.add_argument("--warmup_steps", type=int, default=3, help="Untimed steps before those")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for data and model")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON")
+    # Internal: run as one rank of a measurement
+    parser.add_argument("--worker", type=str, default=None, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def _run_worker(args):
+    """
+    One rank: train on random token sequences and, on rank 0, write the
+    timed steps' throughput to ``args.worker``.
+    """
+    import torch
+    from datasets import Dataset
+    from transformers import AutoModelForCausalLM, Trainer, TrainerCallback, TrainingArguments
+
+    from training.distributed import DDP_BACKEND, world_size
+    from training.performance import configure_threads, peak_rss_mb
+
+    configure_threads()
+    ranks = world_size()
+    steps = args.warmup_steps + args.steps
+    model = AutoModelForCausalLM.from_pretrained(args.model_dir)
+    generator = torch.Generator().manual_seed(args.seed)
+    input_ids = torch.randint(
+        0, model.config.vocab_size, (steps * args.batch_size * ranks, args.seq_len), generator=generator
+    ).tolist()
+    dataset = Dataset.from_dict({"input_ids": input_ids, "labels": input_ids})
+
+    class StepTimer(TrainerCallback):
+        started = None
+
+        def on_step_end(self, training_args, state, control, **kwargs):
+            if state.global_step == args.warmup_steps:
+                self.started = time.perf_counter()
+
+    timer = StepTimer()
+    with tempfile.TemporaryDirectory(prefix="fluxpilot-scaling-") as output_dir:
+        training_args = TrainingArguments(
+            output_dir=output_dir,
+            max_steps=steps,
+            per_device_train_batch_size=args.batch_size,
+            ddp_backend=DDP_BACKEND if ranks > 1 else None,
+            use_cpu=True,
+            seed=args.seed,
+            save_strategy="no",
+            logging_strategy="no",
+            report_to=[],
+            disable_tqdm=True
+        )
+        trainer = Trainer(model=model, args=training_args, train_dataset=dataset, callbacks=[timer])
+        trainer.train()
+    seconds = time.perf_counter() - timer.started
+
+    if trainer.is_world_process_zero():
+        samples = args.steps * args.batch_size * ranks
+        with open(args.worker, "w") as f:
+            json.dump({
+                "ranks": ranks,
+                "seconds": round(seconds, 3),
+                "samples_per_second": round(samples / seconds, 2),
+                "tokens_per_second": round(samples * args.seq_len / seconds, 1),
+                "threads_per_rank": torch.get_num_threads(),
+                "peak_rss_mb_rank0": peak_rss_mb(),
+            }, f)
+
+
+def _measure(args, model_dir: str, ranks: int, workdir: str) -> Dict[str, Any]:
+    result_file = os.path.join(workdir, f"ranks-{ranks}.json")
+    command = launch_command(ranks, module="training.bench_scaling", args=[
+        "--worker", result_file,
+        "--model_dir", model_dir,
+        "--batch_size", str(args.batch_size),
+        "--seq_len", str(args.seq_len),
+        "--steps", str(args.steps),
+        "--warmup_steps", str(args.warmup_steps),
+        "--seed", str(args.seed),
+    ])
+    subprocess.run(command, check=True)
+    with open(result_file) as f:
+        return json.load(f)
+
+
+def scaling_efficiency(results: List[Dict[str, Any]]) -> None:
+    """
+    Add each run's speedup and efficiency (speedup / ranks) relative to the
+    smallest rank count measured, in place.
+    """
+    base = min(results, key=lambda r: r["ranks"])
+    for result in results:
+        speedup = result["samples_per_second"] / base["samples_per_second"]
+        result["speedup"] = round(speedup, 3)
+        result["scaling_efficiency"] = round(speedup * base["ranks"] / result["ranks"], 3)
+
+
+def main():
+    args = parse_args()
+    if args.worker:
+        _run_worker(args)
+        return
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s — %(levelname)s — %(message)s")
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="fluxpilot-scaling-") as workdir:
+        model_dir = args.model_dir
+        model = {"model_dir": model_dir}
+        if model_dir is None:
+            from serving.bench_serving import make_tiny_model
+
+            tiny = {"hidden_size": 256, "num_layers": 4, "max_positions": max(256, args.seq_len)}
+            model_dir = make_tiny_model(os.path.join(workdir, "model"), seed=args.seed, **tiny)
+            model = {"tiny_random": tiny}
+        for ranks in [int(n) for n in args.ranks.split(",")]:
+            result = _measure(args, model_dir, ranks, workdir)
+            logging.info(
+                f"{ranks} rank(s): {result['samples_per_second']} samples/s, "
+                f"{result['tokens_per_second']} tokens/s"
+            )
+            results.append(result)
+    scaling_efficiency(results)
+
+    report = {
+        "model": model,
+        "batch_size_per_rank": args.batch_size,
+        "seq_len": args.seq_len,
+        "steps": args.steps,
+        "environment": {
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "usable_cpus": len(os.sched_getaffinity(0)),
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
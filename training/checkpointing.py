@@ -0,0 +1,289 @@
+# training/checkpointing.py
+
+import copy
+import dataclasses
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+import torch.distributed as dist
+from safetensors.torch import load_file, safe_open, save_file
+from transformers import Trainer
+from transformers.trainer_callback import ExportableState
+
+CHECKPOINT_PATTERN = re.compile(r"^checkpoint-(\d+)$")
+# Written last, so a checkpoint directory holding it is complete
+TRAINER_STATE_NAME = "trainer_state.json"
+OPTIMIZER_NAME = "optimizer.safetensors"
+OPTIMIZER_META_NAME = "optimizer.json"
+SCHEDULER_NAME = "scheduler.json"
+
+
+def _checkpoints(output_dir: str) -> List[Tuple[float, str]]:
+    """Complete checkpoints in ``output_dir`` as (completion time, path), oldest first."""
+    if not os.path.isdir(output_dir):
+        return []
+    found = []
+    for name in os.listdir(output_dir):
+        path = os.path.join(output_dir, name)
+        state = os.path.join(path, TRAINER_STATE_NAME)
+        match = CHECKPOINT_PATTERN.match(name)
+        if match and os.path.isfile(state):
+            # The step breaks ties on filesystems with coarse mtimes
+            found.append((os.path.getmtime(state), int(match.group(1)), path))
+    return [(mtime, path) for mtime, _, path in sorted(found)]
+
+
+def latest_checkpoint(output_dir: str) -> Optional[str]:
+    """
+    The most recently completed checkpoint in ``output_dir``, or None.
+    Directories a crashed run left half-written are skipped.
+    """
+    found = _checkpoints(output_dir)
+    return found[-1][1] if found else None
+
+
+def prune_checkpoints(output_dir: str, keep: Optional[int]) -> None:
+    """Delete all but the ``keep`` most recently completed checkpoints."""
+    if not keep:
+        return
+    for _, path in _checkpoints(output_dir)[:-keep]:
+        logging.info(f"Deleting old checkpoint {path}")
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _cpu_copy(tensors: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+    # Tied weights share storage; safetensors refuses to write them twice
+    seen = set()
+    copies = {}
+    for name, tensor in tensors.items():
+        key = (tensor.device, tensor.untyped_storage().data_ptr(), tensor.storage_offset(), tuple(tensor.shape))
+        if key in seen:
+            continue
+        seen.add(key)
+        copies[name] = tensor.detach().to("cpu", copy=True).contiguous()
+    return copies
+
+
+def optimizer_to_safetensors(state_dict: Dict[str, Any]) -> Tuple[Dict[str, torch.Tensor], Dict[str, Any]]:
+    """
+    Split an optimizer ``state_dict`` into flat ``state.<param>.<key>``
+    tensors and the JSON-serializable rest (param groups, scalar state).
+    """
+    tensors = {}
+    scalars: Dict[str, Dict[str, Any]] = {}
+    for param, values in state_dict["state"].items():
+        for key, value in values.items():
+            if isinstance(value, torch.Tensor):
+                tensors[f"state.{param}.{key}"] = value
+            else:
+                scalars.setdefault(str(param), {})[key] = value
+    return _cpu_copy(tensors), {"param_groups": state_dict["param_groups"], "scalars": scalars}
+
+
+def optimizer_from_safetensors(tensors: Dict[str, torch.Tensor], meta: Dict[str, Any]) -> Dict[str, Any]:
+    """Inverse of ``optimizer_to_safetensors``."""
+    state: Dict[int, Dict[str, Any]] = {}
+    for name, tensor in tensors.items():
+        _, param, key = name.split(".", 2)
+        state.setdefault(int(param), {})[key] = tensor
+    for param, values in meta["scalars"].items():
+        state.setdefault(int(param), {}).update(values)
+    param_groups = meta["param_groups"]
+    for group in param_groups:
+        # JSON turned tuples such as Adam's betas into lists
+        for key, value in group.items():
+            if key != "params" and isinstance(value, list):
+                group[key] = tuple(value)
+    return {"state": state, "param_groups": param_groups}
+
+
+def save_rng_state(path: str) -> None:
+    """Python, numpy and torch RNG states of this process, as safetensors."""
+    tensors = {"cpu": torch.random.get_rng_state()}
+    if torch.cuda.is_available():
+        for device, rng in enumerate(torch.cuda.get_rng_state_all()):
+            tensors[f"cuda.{device}"] = rng
+    name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    metadata = {
+        "python": json.dumps(random.getstate()),
+        "numpy": json.dumps([name, keys.tolist(), pos, has_gauss, cached_gaussian]),
+    }
+    save_file(tensors, path, metadata=metadata)
+
+
+def load_rng_state(path: str) -> None:
+    """Restore the RNG states ``save_rng_state`` wrote."""
+    with safe_open(path, framework="pt") as f:
+        metadata = f.metadata()
+        torch.random.set_rng_state(f.get_tensor("cpu"))
+        if torch.cuda.is_available():
+            cuda = [f.get_tensor(f"cuda.{device}") for device in range(torch.cuda.device_count())
+                    if f"cuda.{device}" in f.keys()]
+            if cuda:
+                torch.cuda.set_rng_state_all(cuda)
+    version, internal, gauss = json.loads(metadata["python"])
+    random.setstate((version, tuple(internal), gauss))
+    name, keys, pos, has_gauss, cached_gaussian = json.loads(metadata["numpy"])
+    np.random.set_state((name, np.array(keys, dtype=np.uint32), pos, has_gauss, cached_gaussian))
+
+
+class AsyncCheckpointWriter:
+    """
+    Write checkpoints on one background thread. At most one save is in
+    flight: ``submit`` first waits for the previous one, which bounds the
+    memory held by snapshots. A failed save is raised by the next
+    ``submit`` or ``wait``.
+    """
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint-writer")
+        self._pending: Optional[Future] = None
+
+    def submit(self, write: Callable[[], None]) -> None:
+        self.wait()
+        self._pending = self._executor.submit(write)
+
+    def wait(self) -> None:
+        pending, self._pending = self._pending, None
+        if pending is not None:
+            pending.result()
+
+
+class CheckpointingTrainer(Trainer):
+    """
+    Trainer whose step checkpoints are written in safetensors format by a
+    background thread.
+
+    At a save the training loop only copies the model and optimizer state to
+    CPU memory; serialization happens while training continues. Each
+    checkpoint is written to a staging directory and renamed into place once
+    complete, so a crash mid-write never leaves a checkpoint that looks
+    valid. ``save_total_limit`` checkpoints are kept.
+
+    A checkpoint holds the model weights (``model.safetensors`` or, for a
+    LoRA model, ``adapter_model.safetensors``), the optimizer state
+    (``optimizer.safetensors`` and ``optimizer.json``), the LR scheduler
+    (``scheduler.json``), each rank's RNG states and ``trainer_state.json``,
+    whose ``global_step`` is the dataloader position the Trainer skips to on
+    resume.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkpoint_writer = AsyncCheckpointWriter()
+
+    def train(self, *args, **kwargs):
+        if self.args.should_save and os.path.isdir(self.args.output_dir):
+            # Staging directories of saves a crashed run never finished
+            for name in os.listdir(self.args.output_dir):
+                if name.startswith(".checkpoint-"):
+                    shutil.rmtree(os.path.join(self.args.output_dir, name), ignore_errors=True)
+        try:
+            return super().train(*args, **kwargs)
+        finally:
+            # The last checkpoint is complete (or its error raised) on return
+            self.checkpoint_writer.wait()
+
+    def _save_checkpoint(self, model, trial) -> None:
+        if self.hp_search_backend is None and trial is None:
+            self.store_flos()
+        run_dir = self._get_output_dir(trial=trial)
+        step = self.state.global_step
+        staging = os.path.join(run_dir, f".checkpoint-{step}")
+        self.checkpoint_writer.wait()
+
+        # Every rank saves its own RNG state; the rest is identical across ranks
+        os.makedirs(staging, exist_ok=True)
+        if self.args.world_size > 1:
+            save_rng_state(os.path.join(staging, f"rng_state_{self.args.process_index}.safetensors"))
+            dist.barrier()
+        else:
+            save_rng_state(os.path.join(staging, "rng_state.safetensors"))
+        if not self.args.should_save:
+            return
+
+        write = self._snapshot(staging, os.path.join(run_dir, f"checkpoint-{step}"), run_dir)
+        self.checkpoint_writer.submit(write)
+
+    def _snapshot(self, staging: str, final: str, run_dir: str) -> Callable[[], None]:
+        """Copy the training state and return the function that writes it out."""
+        started = time.perf_counter()
+        unwrapped = self.accelerator.unwrap_model(self.model)
+        if hasattr(unwrapped, "peft_config"):
+            from peft import get_peft_model_state_dict
+
+            weights_name = "adapter_model.safetensors"
+            weights = _cpu_copy(get_peft_model_state_dict(unwrapped))
+            save_config = unwrapped.peft_config[unwrapped.active_adapter].save_pretrained
+        else:
+            weights_name = "model.safetensors"
+            weights = _cpu_copy(unwrapped.state_dict())
+            save_config = unwrapped.config.save_pretrained
+        optimizer_tensors, optimizer_meta = optimizer_to_safetensors(self.optimizer.state_dict())
+        scheduler = copy.deepcopy(self.lr_scheduler.state_dict())
+
+        # Where ExportableState callbacks and TrainerControl stand now
+        for callback in self.callback_handler.callbacks + [self.control]:
+            if isinstance(callback, ExportableState):
+                name = callback.__class__.__name__
+                if isinstance(self.state.stateful_callbacks.get(name), list):
+                    self.state.stateful_callbacks[name].append(callback.state())
+                else:
+                    self.state.stateful_callbacks[name] = callback.state()
+        trainer_state = json.dumps(dataclasses.asdict(self.state), indent=2, sort_keys=True) + "\n"
+        stall = time.perf_counter() - started
+        keep = self.args.save_total_limit
+
+        def write():
+            started = time.perf_counter()
+            save_file(weights, os.path.join(staging, weights_name), metadata={"format": "pt"})
+            save_config(staging)
+            save_file(optimizer_tensors, os.path.join(staging, OPTIMIZER_NAME))
+            with open(os.path.join(staging, OPTIMIZER_META_NAME), "w") as f:
+                json.dump(optimizer_meta, f)
+            with open(os.path.join(staging, SCHEDULER_NAME), "w") as f:
+                json.dump(scheduler, f)
+            with open(os.path.join(staging, TRAINER_STATE_NAME), "w") as f:
+                f.write(trainer_state)
+            if os.path.isdir(final):
+                shutil.rmtree(final)
+            os.rename(staging, final)
+            prune_checkpoints(run_dir, keep)
+            logging.info(
+                f"Saved {final} in {time.perf_counter() - started:.2f}s in the background "
+                f"(training paused {stall:.2f}s to snapshot it)"
+            )
+
+        return write
+
+    def _load_optimizer_and_scheduler(self, checkpoint: Optional[str]) -> None:
+        if checkpoint is None or not os.path.isfile(os.path.join(checkpoint, OPTIMIZER_NAME)):
+            return super()._load_optimizer_and_scheduler(checkpoint)
+        with open(os.path.join(checkpoint, OPTIMIZER_META_NAME)) as f:
+            meta = json.load(f)
+        self.optimizer.load_state_dict(
+            optimizer_from_safetensors(load_file(os.path.join(checkpoint, OPTIMIZER_NAME)), meta)
+        )
+        with open(os.path.join(checkpoint, SCHEDULER_NAME)) as f:
+            self.lr_scheduler.load_state_dict(json.load(f))
+
+    def _load_rng_state(self, checkpoint: Optional[str]) -> None:
+        if checkpoint is None:
+            return
+        name = (
+            f"rng_state_{self.args.process_index}.safetensors"
+            if self.args.world_size > 1 else "rng_state.safetensors"
+        )
+        path = os.path.join(checkpoint, name)
+        if not os.path.isfile(path):
+            return super()._load_rng_state(checkpoint)
+        load_rng_state(path)
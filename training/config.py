@@ -2,7 +2,7 @@
 
 import os
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
 import yaml
 from pydantic import BaseSettings, Field
@@ -16,6 +16,31 @@ class ModelSettings(BaseSettings):
 class TrainingSettings(BaseSettings):
     epochs: int = Field(3, env="EPOCHS")
     batch_size: int = Field(4, env="BATCH_SIZE")
+    # Stream the dataset instead of downloading it; needs max_steps
+    streaming: bool = Field(False, env="STREAMING")
+    shuffle_buffer: int = Field(10000, env="SHUFFLE_BUFFER")
+    max_steps: int = Field(-1, env="MAX_STEPS")
+    # Step checkpoints, written in the background; "latest" resumes the newest
+    save_steps: int = Field(500, env="SAVE_STEPS")
+    save_total_limit: int = Field(2, env="SAVE_TOTAL_LIMIT")
+    resume_from_checkpoint: Optional[str] = Field(None, env="RESUME_FROM_CHECKPOINT")
+    # CPU performance settings; perf_profile "cpu_throughput" presets them
+    perf_profile: str = Field("default", env="PERF_PROFILE")
+    bf16: bool = Field(False, env="BF16")
+    gradient_checkpointing: bool = Field(False, env="GRADIENT_CHECKPOINTING")
+    global_batch_size: int = Field(0, env="GLOBAL_BATCH_SIZE")
+    torch_compile: bool = Field(False, env="TORCH_COMPILE")
+    num_threads: int = Field(0, env="TORCH_NUM_THREADS")
+    num_interop_threads: int = Field(0, env="TORCH_NUM_INTEROP_THREADS")
+    cpu_affinity: Optional[str] = Field(None, env="CPU_AFFINITY")
+    # Data-parallel CPU ranks launched by the orchestrator (torchrun, gloo)
+    nproc_per_node: int = Field(1, env="TRAIN_NPROC_PER_NODE")
+    # LoRA: train adapters on a frozen base and register only the adapter
+    lora: bool = Field(False, env="LORA")
+    lora_rank: int = Field(8, env="LORA_RANK")
+    lora_alpha: int = Field(16, env="LORA_ALPHA")
+    lora_dropout: float = Field(0.05, env="LORA_DROPOUT")
+    lora_target_modules: str = Field("q_proj,v_proj", env="LORA_TARGET_MODULES")
 
 
 class MLflowSettings(BaseSettings):
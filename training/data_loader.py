@@ -7,7 +7,9 @@ from typing import Optional
 def load_data(
     dataset_name: str,
     dataset_config: Optional[str] = None,
-    split: str = "train"
+    split: str = "train",
+    revision: Optional[str] = None,
+    streaming: bool = False
 ):
     """
     Load a Hugging Face dataset.
@@ -16,17 +18,24 @@ def load_data(
         dataset_name: Name of the dataset (e.g., "wikitext").
         dataset_config: Specific dataset configuration (e.g., "wikitext-2-raw-v1").
         split: Which split to load ("train", "validation", or "test").
+        revision: Dataset repository revision (branch, tag or commit) to pin.
+        streaming: Read the split lazily instead of downloading it first.
 
     Returns:
-        A Hugging Face Dataset object.
+        A Hugging Face Dataset object (an IterableDataset when streaming).
     """
     try:
+        name = f"{dataset_name}/{dataset_config}" if dataset_config else dataset_name
         if dataset_config:
-            dataset = load_dataset(dataset_name, dataset_config, split=split)
-            logging.info(f"Loaded dataset {dataset_name}/{dataset_config} split={split} with {len(dataset)} examples")
+            dataset = load_dataset(
+                dataset_name, dataset_config, split=split, revision=revision, streaming=streaming
+            )
         else:
-            dataset = load_dataset(dataset_name, split=split)
-            logging.info(f"Loaded dataset {dataset_name} split={split} with {len(dataset)} examples")
+            dataset = load_dataset(dataset_name, split=split, revision=revision, streaming=streaming)
+        if streaming:
+            logging.info(f"Streaming dataset {name} split={split} from {dataset.n_shards} shards")
+        else:
+            logging.info(f"Loaded dataset {name} split={split} with {len(dataset)} examples")
         return dataset
     except Exception as e:
         logging.error(f"Error loading dataset {dataset_name}: {e}")
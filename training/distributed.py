@@ -0,0 +1,34 @@
+# training/distributed.py
+
+import os
+import sys
+from typing import List, Sequence
+
+# CPU ranks all-reduce gradients over gloo
+DDP_BACKEND = "gloo"
+
+
+def world_size() -> int:
+    """Number of ranks; torchrun sets WORLD_SIZE for every process."""
+    return int(os.getenv("WORLD_SIZE", 1))
+
+
+def is_main_process() -> bool:
+    """Whether this is rank 0, the only rank that logs to MLflow."""
+    return int(os.getenv("RANK", 0)) == 0
+
+
+def launch_command(nproc: int, module: str = "training.train", args: Sequence[str] = ()) -> List[str]:
+    """
+    Command running ``python -m <module>`` as ``nproc`` data-parallel ranks
+    on this node through torchrun (a single plain process for ``nproc <= 1``).
+    """
+    if nproc <= 1:
+        return [sys.executable, "-m", module, *args]
+    return [
+        sys.executable, "-m", "torch.distributed.run",
+        "--standalone",
+        f"--nproc_per_node={nproc}",
+        "-m", module,
+        *args,
+    ]
@@ -1,8 +1,19 @@
 # training/hf_utils.py
 
+import functools
 import logging
+import random
 from transformers import PreTrainedTokenizer
-from typing import Dict, Any
+from transformers.trainer_pt_utils import get_length_grouped_indices
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+import torch
+
+# Label value ignored by the causal-LM loss
+IGNORE_INDEX = -100
+# A causal-LM window needs a token to predict and one to predict it from
+MIN_WINDOW_LENGTH = 2
+
 
 def preprocess_function(
     examples: Dict[str, Any],
@@ -20,7 +31,10 @@ def preprocess_function(
         stride: Number of overlapped tokens between windows.
 
     Returns:
-        A dict of tokenized inputs suitable for Trainer.
+        A dict of tokenized inputs suitable for Trainer, plus a "length"
+        column for length-grouped sampling. Windows shorter than two tokens
+        (e.g. from blank lines) are dropped: after the label shift they
+        carry no loss.
     """
     texts = examples.get("text", [])
     # Tokenize with sliding window
@@ -36,10 +50,233 @@ def preprocess_function(
     )
 
     # For overflowing tokens, label them the same as input_ids
-    input_ids = tokenized_inputs["input_ids"]
-    attention_masks = tokenized_inputs["attention_mask"]
+    keep = [i for i, ids in enumerate(tokenized_inputs["input_ids"]) if len(ids) >= MIN_WINDOW_LENGTH]
+    input_ids = [tokenized_inputs["input_ids"][i] for i in keep]
+    attention_masks = [tokenized_inputs["attention_mask"][i] for i in keep]
 
     return {
         "input_ids": input_ids,
         "attention_mask": attention_masks,
+        "labels": [list(ids) for ids in input_ids],
+        "length": [len(ids) for ids in input_ids],
+    }
+
+
+def tokenize_documents(
+    examples: Dict[str, Any],
+    tokenizer: PreTrainedTokenizer
+) -> Dict[str, Any]:
+    """
+    Tokenize each non-blank text as one document terminated by EOS, for
+    packing with ``group_texts``. Blank lines are dropped.
+
+    Returns:
+        "input_ids" and "length" (tokens per document) columns.
+    """
+    eos = tokenizer.eos_token_id
+    if eos is None:
+        raise ValueError("Packing needs a tokenizer with an EOS token to separate documents")
+    texts = [t for t in examples.get("text", []) if t and not t.isspace()]
+    input_ids = []
+    for ids in tokenizer(texts, return_attention_mask=False)["input_ids"]:
+        if not ids or ids[-1] != eos:
+            ids = ids + [eos]
+        input_ids.append(ids)
+    return {"input_ids": input_ids, "length": [len(ids) for ids in input_ids]}
+
+
+def group_texts(
+    examples: Dict[str, Any],
+    block_size: int = 512,
+    separate_documents: bool = False
+) -> Dict[str, Any]:
+    """
+    Concatenate tokenized documents and cut them into full ``block_size``
+    blocks; the tail of the batch that doesn't fill a block is dropped.
+
+    Args:
+        examples: A batch from ``tokenize_documents``.
+        block_size: Tokens per training sequence.
+        separate_documents: Also emit ``position_ids`` that restart at each
+            document, from which ``collate_packed`` builds attention masks
+            that keep documents from attending to each other. The first
+            token of each document is then not used as a label, since it
+            would be predicted from the previous document.
+
+    Returns:
+        "input_ids" and "labels", plus "position_ids" with
+        ``separate_documents`` or an all-ones "attention_mask" otherwise.
+    """
+    concatenated: List[int] = []
+    starts: List[int] = []
+    for ids in examples["input_ids"]:
+        starts.append(len(concatenated))
+        concatenated.extend(ids)
+    usable = (len(concatenated) // block_size) * block_size
+
+    blocks = [concatenated[i:i + block_size] for i in range(0, usable, block_size)]
+    labels = [list(block) for block in blocks]
+    if not separate_documents:
+        return {
+            "input_ids": blocks,
+            "labels": labels,
+            "attention_mask": [[1] * block_size for _ in blocks],
+        }
+
+    is_start = [False] * usable
+    for start in starts:
+        if start < usable:
+            is_start[start] = True
+    position_ids = []
+    for b, offset in enumerate(range(0, usable, block_size)):
+        positions = []
+        position = 0
+        for i in range(offset, offset + block_size):
+            if is_start[i]:
+                position = 0
+                # The block's first token has no preceding context either way
+                if i != offset:
+                    labels[b][i - offset] = IGNORE_INDEX
+            positions.append(position)
+            position += 1
+        position_ids.append(positions)
+    return {"input_ids": blocks, "labels": labels, "position_ids": position_ids}
+
+
+def pack_dataset(
+    dataset,
+    tokenizer: PreTrainedTokenizer,
+    block_size: int = 512,
+    separate_documents: bool = False,
+    num_proc: int = None
+) -> Tuple[Any, Dict[str, float]]:
+    """
+    Tokenize a dataset with a "text" column and pack it into dense blocks.
+
+    Returns:
+        The packed dataset and packing statistics: documents, tokens and
+        blocks, "packing_efficiency" (fraction of tokenized text that ended
+        up in a block) and, for comparison, "unpacked_efficiency" (fraction
+        of sequence slots holding real tokens if each document were padded
+        to ``block_size`` windows instead).
+    """
+    tokenized = dataset.map(
+        functools.partial(tokenize_documents, tokenizer=tokenizer),
+        batched=True,
+        num_proc=num_proc,
+        remove_columns=dataset.column_names
+    )
+    lengths = tokenized["length"]
+    packed = tokenized.map(
+        functools.partial(
+            group_texts, block_size=block_size, separate_documents=separate_documents
+        ),
+        batched=True,
+        num_proc=num_proc,
+        remove_columns=tokenized.column_names
+    )
+
+    tokens = sum(lengths)
+    windows = sum(-(-length // block_size) for length in lengths)
+    stats = {
+        "documents": len(lengths),
+        "tokens": tokens,
+        "blocks": len(packed),
+        "packing_efficiency": round(len(packed) * block_size / tokens, 4) if tokens else 0.0,
+        "unpacked_efficiency": round(tokens / (windows * block_size), 4) if windows else 0.0,
+    }
+    logging.info(
+        f"Packed {stats['documents']} documents ({tokens} tokens) into {stats['blocks']} "
+        f"blocks of {block_size}: {stats['packing_efficiency']:.1%} of tokens used, "
+        f"vs {stats['unpacked_efficiency']:.1%} of padded slots without packing"
+    )
+    return packed, stats
+
+
+def collate_packed(features: List[Dict[str, Any]]) -> Dict[str, torch.Tensor]:
+    """
+    Data collator for blocks from ``group_texts(separate_documents=True)``.
+    Builds a 4D boolean attention mask (batch, 1, block, block) that is
+    causal within each document and blocks attention across documents.
+    """
+    batch = {
+        key: torch.tensor([f[key] for f in features], dtype=torch.long)
+        for key in ("input_ids", "labels", "position_ids")
+    }
+    position_ids = batch["position_ids"]
+    # A new document starts wherever the position resets to 0
+    document_ids = (position_ids == 0).cumsum(-1)
+    same_document = document_ids[:, :, None] == document_ids[:, None, :]
+    length = position_ids.shape[1]
+    causal = torch.tril(torch.ones(length, length, dtype=torch.bool))
+    batch["attention_mask"] = (same_document & causal)[:, None]
+    return batch
+
+
+def _padded_length(length: int, pad_to_multiple_of: Optional[int]) -> int:
+    if pad_to_multiple_of:
+        return -(-length // pad_to_multiple_of) * pad_to_multiple_of
+    return length
+
+
+def collate_padded(
+    features: List[Dict[str, Any]],
+    pad_token_id: int,
+    pad_to_multiple_of: Optional[int] = None
+) -> Dict[str, torch.Tensor]:
+    """
+    Data collator for variable-length windows from ``preprocess_function``.
+    Right-pads each batch only to its own longest sequence (rounded up to
+    ``pad_to_multiple_of``); padding gets attention mask 0 and label
+    ``IGNORE_INDEX``. Other feature keys (e.g. "length") are dropped.
+    """
+    length = _padded_length(max(len(f["input_ids"]) for f in features), pad_to_multiple_of)
+    input_ids = torch.full((len(features), length), pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(features), length), dtype=torch.long)
+    labels = torch.full((len(features), length), IGNORE_INDEX, dtype=torch.long)
+    for i, feature in enumerate(features):
+        n = len(feature["input_ids"])
+        input_ids[i, :n] = torch.tensor(feature["input_ids"], dtype=torch.long)
+        attention_mask[i, :n] = torch.tensor(feature.get("attention_mask", [1] * n), dtype=torch.long)
+        labels[i, :n] = torch.tensor(feature.get("labels", feature["input_ids"]), dtype=torch.long)
+    labels[attention_mask == 0] = IGNORE_INDEX
+    return {"input_ids": input_ids, "attention_mask": attention_mask, "labels": labels}
+
+
+def padding_report(
+    lengths: Sequence[int],
+    batch_size: int,
+    max_length: int,
+    pad_to_multiple_of: Optional[int] = None,
+    seed: int = 0
+) -> Dict[str, float]:
+    """
+    Fraction of batch slots that would be padding for one epoch over
+    ``lengths`` when batches are:
+
+    - "fixed": random, every sequence padded to ``max_length``
+    - "random": random, padded to the batch's longest sequence
+    - "grouped": drawn like the Trainer's length-grouped sampler, padded
+      to the batch's longest sequence
+    """
+    tokens = sum(lengths)
+    if not tokens:
+        return {"fixed": 0.0, "random": 0.0, "grouped": 0.0}
+
+    def ratio(order: List[int], pad_to: Optional[int] = None) -> float:
+        slots = 0
+        for start in range(0, len(order), batch_size):
+            batch = [lengths[i] for i in order[start:start + batch_size]]
+            slots += len(batch) * (pad_to or _padded_length(max(batch), pad_to_multiple_of))
+        return round(1 - tokens / slots, 4)
+
+    shuffled = list(range(len(lengths)))
+    random.Random(seed).shuffle(shuffled)
+    grouped = get_length_grouped_indices(
+        list(lengths), batch_size, generator=torch.Generator().manual_seed(seed)
+    )
+    return {
+        "fixed": ratio(shuffled, pad_to=max_length),
+        "random": ratio(shuffled),
+        "grouped": ratio(grouped),
     }
@@ -0,0 +1,72 @@
+# training/lora.py
+
+import logging
+from typing import Dict, List, Union
+
+from transformers import PreTrainedModel
+
+# Attention query/value projections of Llama-style models such as Granite
+DEFAULT_TARGET_MODULES = "q_proj,v_proj"
+
+
+def parse_target_modules(spec: str) -> Union[str, List[str]]:
+    """
+    Comma-separated module names to adapt, or "all-linear" for every
+    linear layer except the output head.
+    """
+    if spec.strip() == "all-linear":
+        return "all-linear"
+    return [name.strip() for name in spec.split(",") if name.strip()]
+
+
+def parameter_counts(model) -> Dict[str, float]:
+    """
+    Trainable and total parameter counts, and the AdamW state the
+    trainable ones need (two fp32 moments each).
+    """
+    trainable = sum(p.numel() for p in model.parameters() if p.requires_grad)
+    total = sum(p.numel() for p in model.parameters())
+    return {
+        "trainable_params": trainable,
+        "total_params": total,
+        "trainable_fraction": round(trainable / total, 6) if total else 0.0,
+        "optimizer_state_mb": round(trainable * 2 * 4 / 2**20, 2),
+    }
+
+
+def apply_lora(
+    model: PreTrainedModel,
+    rank: int = 8,
+    alpha: int = 16,
+    dropout: float = 0.05,
+    target_modules: str = DEFAULT_TARGET_MODULES,
+    gradient_checkpointing: bool = False
+):
+    """
+    Freeze ``model`` and wrap it with trainable LoRA adapters of ``rank``
+    on ``target_modules``. ``save_pretrained`` on the result writes only the
+    adapter weights and config.
+    """
+    from peft import LoraConfig, TaskType, get_peft_model
+
+    before = parameter_counts(model)
+    config = LoraConfig(
+        task_type=TaskType.CAUSAL_LM,
+        r=rank,
+        lora_alpha=alpha,
+        lora_dropout=dropout,
+        target_modules=parse_target_modules(target_modules)
+    )
+    model = get_peft_model(model, config)
+    if gradient_checkpointing:
+        # The frozen embeddings would otherwise cut the graph that
+        # checkpointed blocks recompute through
+        model.enable_input_require_grads()
+
+    after = parameter_counts(model)
+    logging.info(
+        f"LoRA r={rank} on {target_modules}: {after['trainable_params']:,} of "
+        f"{after['total_params']:,} parameters trainable ({after['trainable_fraction']:.4%}); "
+        f"optimizer state {before['optimizer_state_mb']} MB -> {after['optimizer_state_mb']} MB"
+    )
+    return model
@@ -0,0 +1,99 @@
+# training/performance.py
+
+import logging
+import math
+import os
+import resource
+from typing import Any, Dict, List, Optional
+
+import torch
+
+# Settings each --perf_profile turns on; explicit flags still apply on top
+PERF_PROFILES: Dict[str, Dict[str, Any]] = {
+    "default": {},
+    "cpu_throughput": {
+        "bf16": True,
+        "gradient_checkpointing": True,
+        "global_batch_size": 32,
+    },
+}
+
+
+def apply_profile(args) -> None:
+    """
+    Turn on the settings of ``args.perf_profile`` that weren't set
+    explicitly (flags left at False / 0).
+    """
+    for name, value in PERF_PROFILES[args.perf_profile].items():
+        if not getattr(args, name):
+            setattr(args, name, value)
+
+
+def parse_cpu_list(spec: str) -> List[int]:
+    """Parse a CPU list like ``"0-7,16-23"`` (the taskset / cgroup format)."""
+    cpus: List[int] = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return sorted(set(cpus))
+
+
+def configure_threads(
+    num_threads: int = 0,
+    num_interop_threads: int = 0,
+    cpu_affinity: Optional[str] = None
+) -> int:
+    """
+    Pin this process to ``cpu_affinity`` (if given) and size torch's thread
+    pools. Call before the model is loaded: the inter-op pool can only be
+    sized before its first use.
+
+    ``num_threads=0`` splits the usable cores evenly between the ranks on
+    this node (LOCAL_WORLD_SIZE, set by torchrun) so they don't
+    oversubscribe it.
+
+    Returns:
+        The intra-op thread count in use.
+    """
+    if cpu_affinity:
+        os.sched_setaffinity(0, parse_cpu_list(cpu_affinity))
+    cores = len(os.sched_getaffinity(0))
+    if not num_threads:
+        num_threads = max(1, cores // int(os.getenv("LOCAL_WORLD_SIZE", 1)))
+    torch.set_num_threads(num_threads)
+    if num_interop_threads:
+        torch.set_num_interop_threads(num_interop_threads)
+    logging.info(
+        f"torch threads: {torch.get_num_threads()} intra-op, "
+        f"{torch.get_num_interop_threads()} inter-op on {cores} usable cores"
+    )
+    return num_threads
+
+
+def accumulation_steps(global_batch_size: int, per_device_batch_size: int, world_size: int = 1) -> int:
+    """
+    Gradient accumulation steps reaching at least ``global_batch_size``
+    sequences per optimizer step (1 when ``global_batch_size`` is 0).
+    """
+    if not global_batch_size:
+        return 1
+    per_step = per_device_batch_size * world_size
+    steps = max(1, math.ceil(global_batch_size / per_step))
+    if steps * per_step != global_batch_size:
+        logging.warning(
+            f"Global batch {global_batch_size} is not a multiple of {per_step} sequences per "
+            f"step; using {steps * per_step}"
+        )
+    return steps
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far, in MB."""
+    # ru_maxrss is reported in KiB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
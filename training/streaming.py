@@ -0,0 +1,160 @@
+# training/streaming.py
+
+import logging
+import os
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import torch
+from datasets import IterableDataset
+from datasets.distributed import split_dataset_by_node
+from torch.utils.data import DataLoader, get_worker_info
+from transformers import PreTrainedTokenizer
+
+from training.checkpointing import CheckpointingTrainer
+from training.hf_utils import group_texts, preprocess_function, tokenize_documents
+
+
+def _packing_tail(documents: List[List[int]], usable: int) -> List[List[int]]:
+    """The parts of ``documents`` past the first ``usable`` concatenated tokens."""
+    tail = []
+    offset = 0
+    for ids in documents:
+        end = offset + len(ids)
+        if end > usable:
+            tail.append(ids[max(0, usable - offset):])
+        offset = end
+    return tail
+
+
+class StreamingTextDataset(torch.utils.data.IterableDataset):
+    """
+    Tokenize (and optionally pack) a streaming "text" dataset on the fly,
+    for corpora that don't fit on local disk or in memory.
+
+    The stream is read through a ``shuffle_buffer``-example shuffle buffer
+    and split deterministically across ranks and dataloader workers: whole
+    shards when their count divides evenly, otherwise every reader keeps
+    one example in ``world_size * num_workers``. It restarts with a new
+    shuffle order each time it runs out, so it never ends; training length
+    is set with ``max_steps``.
+    """
+
+    def __init__(
+        self,
+        source: IterableDataset,
+        tokenizer: PreTrainedTokenizer,
+        max_length: int = 512,
+        stride: int = 128,
+        packing: bool = False,
+        separate_documents: bool = False,
+        shuffle_buffer: int = 10_000,
+        seed: int = 42,
+        rank: Optional[int] = None,
+        world_size: Optional[int] = None,
+        read_batch_size: int = 256
+    ):
+        self.source = source
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.stride = stride
+        self.packing = packing
+        self.separate_documents = separate_documents
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+        # torchrun sets RANK / WORLD_SIZE for every process
+        self.rank = int(os.getenv("RANK", 0)) if rank is None else rank
+        self.world_size = int(os.getenv("WORLD_SIZE", 1)) if world_size is None else world_size
+        self.read_batch_size = read_batch_size
+        self._resume: Tuple[int, int] = (0, 0)
+
+    def resume(self, batches: int, batch_size: int):
+        """
+        Start after the first ``batches`` batches of ``batch_size`` this
+        rank's dataloader yielded, e.g. ``global_step * gradient_accumulation_steps``
+        from a checkpoint. The skipped sequences are still read and
+        tokenized, but not collated or trained on.
+        """
+        self._resume = (batches, batch_size)
+
+    def _reader(self, epoch: int, worker: int, num_workers: int) -> IterableDataset:
+        stream = self.source
+        if self.shuffle_buffer > 0:
+            stream = stream.shuffle(seed=self.seed, buffer_size=self.shuffle_buffer)
+        stream = split_dataset_by_node(
+            stream,
+            rank=self.rank * num_workers + worker,
+            world_size=self.world_size * num_workers
+        )
+        # Reshuffles shards and buffer differently on every pass
+        stream.set_epoch(epoch)
+        return stream
+
+    def _sequences(self, batches: Iterator[Dict[str, List[Any]]]) -> Iterator[Dict[str, List[int]]]:
+        carry: List[List[int]] = []
+        for batch in batches:
+            if self.packing:
+                documents = carry + tokenize_documents(batch, self.tokenizer)["input_ids"]
+                rows = group_texts(
+                    {"input_ids": documents},
+                    block_size=self.max_length,
+                    separate_documents=self.separate_documents
+                )
+                # Tokens that didn't fill a block start the next one
+                carry = _packing_tail(documents, len(rows["input_ids"]) * self.max_length)
+            else:
+                rows = preprocess_function(
+                    batch, self.tokenizer, max_length=self.max_length, stride=self.stride
+                )
+            for values in zip(*rows.values()):
+                yield dict(zip(rows.keys(), values))
+
+    def __iter__(self) -> Iterator[Dict[str, List[int]]]:
+        info = get_worker_info()
+        worker, num_workers = (info.id, info.num_workers) if info is not None else (0, 1)
+        # DataLoader workers hand out batches round-robin starting from worker
+        # 0, so after a resume worker 0 takes over the share of whichever
+        # worker would have produced the next batch
+        batches, batch_size = self._resume
+        worker = (worker + batches) % num_workers
+        skip = max(0, (batches - worker + num_workers - 1) // num_workers) * batch_size
+        if skip:
+            logging.info(
+                f"Stream rank {self.rank} worker {worker}: resuming after {skip} sequences"
+            )
+
+        epoch = 0
+        while True:
+            reader = self._reader(epoch, worker, num_workers)
+            empty = True
+            for sequence in self._sequences(reader.iter(batch_size=self.read_batch_size)):
+                empty = False
+                if skip:
+                    skip -= 1
+                    continue
+                yield sequence
+            if empty:
+                logging.warning(
+                    f"Stream rank {self.rank} worker {worker} has no data; use fewer workers or ranks"
+                )
+                return
+            epoch += 1
+
+
+class StreamingTrainer(CheckpointingTrainer):
+    """
+    Trainer for a ``StreamingTextDataset``, which already yields only this
+    rank's share: its dataloader is built directly rather than through
+    ``accelerator.prepare``, which would dispatch or shard it again.
+    """
+
+    def get_train_dataloader(self) -> DataLoader:
+        if not isinstance(self.train_dataset, StreamingTextDataset):
+            return super().get_train_dataloader()
+        return DataLoader(
+            self.train_dataset,
+            batch_size=self._train_batch_size,
+            collate_fn=self.data_collator,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory,
+            prefetch_factor=self.args.dataloader_prefetch_factor
+        )
@@ -0,0 +1,165 @@
+# training/tokenized_cache.py
+
+import functools
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import pyarrow.compute as pc
+from datasets import Dataset, load_from_disk
+from transformers import PreTrainedTokenizer
+
+from training.hf_utils import pack_dataset, preprocess_function
+
+# Bump whenever preprocess_function / packing change what they emit, so
+# caches written by older code are not reused
+TOKENIZATION_VERSION = 3
+
+_META_FILE = "fluxpilot_tokenization.json"
+
+
+def tokenizer_hash(tokenizer: PreTrainedTokenizer) -> str:
+    """
+    Hash of everything that decides how the tokenizer splits text: its
+    class, vocabulary and merges (the serialized fast tokenizer when
+    available) and special tokens. Independent of where it was loaded from.
+    """
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    state = {
+        "class": type(tokenizer).__name__,
+        "tokenizer": backend.to_str() if backend is not None else sorted(tokenizer.get_vocab().items()),
+        "special_tokens": tokenizer.special_tokens_map,
+        "add_bos_token": getattr(tokenizer, "add_bos_token", None),
+        "add_eos_token": getattr(tokenizer, "add_eos_token", None),
+    }
+    return hashlib.sha256(json.dumps(state, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def cache_key(
+    dataset: Dataset,
+    tokenizer: PreTrainedTokenizer,
+    max_length: int,
+    stride: int,
+    packing: bool = False,
+    separate_documents: bool = False,
+    dataset_revision: Optional[str] = None,
+) -> str:
+    """
+    Key of a tokenized dataset: the raw dataset's fingerprint (which
+    changes with its source, config, split and revision), the requested
+    revision, the tokenizer hash and the tokenization parameters.
+    """
+    parts = {
+        "version": TOKENIZATION_VERSION,
+        "dataset": dataset._fingerprint,
+        "dataset_revision": dataset_revision,
+        "tokenizer": tokenizer_hash(tokenizer),
+        "max_length": max_length,
+        "stride": stride,
+        "packing": packing,
+        "separate_documents": separate_documents,
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()[:24]
+
+
+def _count_tokens(dataset: Dataset) -> int:
+    # Summed in Arrow; the lists never become Python objects
+    lengths = pc.list_value_length(dataset.data.column("input_ids"))
+    return pc.sum(lengths).as_py() or 0
+
+
+def tokenize_dataset(
+    dataset: Dataset,
+    tokenizer: PreTrainedTokenizer,
+    cache_dir: str,
+    max_length: int = 512,
+    stride: int = 128,
+    packing: bool = False,
+    separate_documents: bool = False,
+    num_proc: Optional[int] = None,
+    dataset_revision: Optional[str] = None,
+) -> Tuple[Dataset, Dict[str, Any]]:
+    """
+    Tokenize ``dataset`` (windowed, or packed into ``max_length`` blocks)
+    on ``num_proc`` processes (default: all cores), and keep the result
+    under ``cache_dir`` keyed by ``cache_key``. Later calls with the same
+    key memory-map the saved Arrow files instead of tokenizing again.
+
+    Returns:
+        The tokenized dataset and its metadata (cache key, token count,
+        tokenization time and, with packing, the packing statistics).
+    """
+    key = cache_key(dataset, tokenizer, max_length, stride, packing, separate_documents,
+                    dataset_revision)
+    path = os.path.join(cache_dir, key)
+    if os.path.isfile(os.path.join(path, _META_FILE)):
+        started = time.monotonic()
+        tokenized = load_from_disk(path)
+        with open(os.path.join(path, _META_FILE)) as f:
+            meta = json.load(f)
+        logging.info(
+            f"Tokenization cache hit {key}: loaded {len(tokenized)} sequences "
+            f"({meta['tokens']} tokens) in {time.monotonic() - started:.1f}s"
+        )
+        return tokenized, {**meta, "cache_hit": True}
+
+    num_proc = num_proc or os.cpu_count() or 1
+    logging.info(f"Tokenization cache miss {key}: tokenizing {len(dataset)} records on {num_proc} processes")
+    started = time.monotonic()
+    stats: Dict[str, Any] = {}
+    if packing:
+        tokenized, stats = pack_dataset(
+            dataset,
+            tokenizer,
+            block_size=max_length,
+            separate_documents=separate_documents,
+            num_proc=num_proc
+        )
+    else:
+        tokenized = dataset.map(
+            functools.partial(
+                preprocess_function, tokenizer=tokenizer, max_length=max_length, stride=stride
+            ),
+            batched=True,
+            num_proc=num_proc,
+            remove_columns=dataset.column_names,
+            # Our key already identifies the result; skip hashing the tokenizer
+            new_fingerprint=key
+        )
+    seconds = time.monotonic() - started
+    tokens = _count_tokens(tokenized)
+    meta = {
+        # Packing statistics count document tokens; "tokens" is what is trained on
+        **stats,
+        "cache_key": key,
+        "sequences": len(tokenized),
+        "tokens": tokens,
+        "tokenize_seconds": round(seconds, 3),
+        "tokens_per_second": round(tokens / seconds, 1) if seconds > 0 else None,
+    }
+    logging.info(
+        f"Tokenized {len(tokenized)} sequences ({tokens} tokens) in {seconds:.1f}s "
+        f"({meta['tokens_per_second']} tokens/s)"
+    )
+
+    # Write next to the final path and rename, so an interrupted run (or a
+    # concurrent retry) never leaves a half-written cache entry behind
+    os.makedirs(cache_dir, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=cache_dir, prefix=f".{key}-")
+    try:
+        tokenized.save_to_disk(staging)
+        with open(os.path.join(staging, _META_FILE), "w") as f:
+            json.dump(meta, f, indent=2)
+        os.rename(staging, path)
+    except OSError:
+        if not os.path.isfile(os.path.join(path, _META_FILE)):
+            raise
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    # Serve from the memory-mapped copy rather than the in-memory result
+    return load_from_disk(path), {**meta, "cache_hit": False}
@@ -2,19 +2,33 @@
 
 import os
 import argparse
+import functools
+import json
 import logging
 
 import mlflow
 import mlflow.pytorch
+import torch
 from transformers import (
     AutoTokenizer,
     AutoModelForCausalLM,
-    Trainer,
     TrainingArguments
 )
 
+from training.checkpointing import CheckpointingTrainer, latest_checkpoint
 from training.data_loader import load_data
-from training.hf_utils import preprocess_function
+from training.distributed import DDP_BACKEND, is_main_process, world_size
+from training.hf_utils import collate_packed, collate_padded, padding_report
+from training.lora import DEFAULT_TARGET_MODULES, apply_lora, parameter_counts
+from training.performance import (
+    PERF_PROFILES,
+    accumulation_steps,
+    apply_profile,
+    configure_threads,
+    peak_rss_mb,
+)
+from training.streaming import StreamingTextDataset, StreamingTrainer
+from training.tokenized_cache import tokenize_dataset
 
 
 def parse_args():
@@ -39,6 +53,12 @@ def parse_args():
         default="wikitext-2-raw-v1",
         help="HuggingFace dataset config"
     )
+    parser.add_argument(
+        "--dataset_revision",
+        type=str,
+        default=os.getenv("DATASET_REVISION"),
+        help="Dataset revision (branch, tag or commit) to pin"
+    )
     parser.add_argument(
         "--output_dir",
         type=str,
@@ -57,7 +77,179 @@ def parse_args():
         default=int(os.getenv("BATCH_SIZE", 4)),
         help="Batch size per device"
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--packing",
+        action="store_true",
+        help="Pack documents (EOS-separated) into dense block_size sequences "
+             "instead of padding overlapping windows of each text"
+    )
+    parser.add_argument(
+        "--block_size",
+        type=int,
+        default=int(os.getenv("BLOCK_SIZE", 512)),
+        help="Tokens per training sequence"
+    )
+    parser.add_argument(
+        "--separate_documents",
+        action="store_true",
+        help="With --packing, mask attention across document boundaries"
+    )
+    parser.add_argument(
+        "--tokenized_cache_dir",
+        type=str,
+        default=os.getenv("TOKENIZED_CACHE_DIR", "./cache/tokenized"),
+        help="Where tokenized datasets are kept between runs"
+    )
+    parser.add_argument(
+        "--num_proc",
+        type=int,
+        default=int(os.getenv("TOKENIZE_NUM_PROC", 0)),
+        help="Tokenization processes (0 = all cores)"
+    )
+    parser.add_argument(
+        "--sampling",
+        type=str,
+        choices=["group_by_length", "random"],
+        default=os.getenv("TRAIN_SAMPLING", "group_by_length"),
+        help="Without --packing, batch windows of similar length together "
+             "(group_by_length) or draw them at random"
+    )
+    parser.add_argument(
+        "--pad_to_multiple_of",
+        type=int,
+        default=int(os.getenv("PAD_TO_MULTIPLE_OF", 8)),
+        help="Without --packing, round each batch's padded length up to a multiple of this (0 = off)"
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        default=os.getenv("STREAMING", "false").lower() == "true",
+        help="Stream the dataset and tokenize on the fly instead of downloading "
+             "and caching it; needs --max_steps"
+    )
+    parser.add_argument(
+        "--shuffle_buffer",
+        type=int,
+        default=int(os.getenv("SHUFFLE_BUFFER", 10000)),
+        help="With --streaming, examples held in the shuffle buffer (0 = no shuffling)"
+    )
+    parser.add_argument(
+        "--max_steps",
+        type=int,
+        default=int(os.getenv("MAX_STEPS", -1)),
+        help="Optimizer steps to train for; overrides --epochs"
+    )
+    parser.add_argument(
+        "--save_steps",
+        type=int,
+        default=int(os.getenv("SAVE_STEPS", 500)),
+        help="Optimizer steps between checkpoints"
+    )
+    parser.add_argument(
+        "--save_total_limit",
+        type=int,
+        default=int(os.getenv("SAVE_TOTAL_LIMIT", 2)),
+        help="Most recent checkpoints to keep in --output_dir (0 = all)"
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=int(os.getenv("SEED", 42)),
+        help="Seed for model init, shuffling and the stream order"
+    )
+    parser.add_argument(
+        "--resume_from_checkpoint",
+        type=str,
+        default=os.getenv("RESUME_FROM_CHECKPOINT"),
+        help="Checkpoint directory to resume training from, or \"latest\" for the "
+             "most recent complete one in --output_dir (a fresh start if there is none)"
+    )
+    parser.add_argument(
+        "--perf_profile",
+        type=str,
+        choices=sorted(PERF_PROFILES),
+        default=os.getenv("PERF_PROFILE", "default"),
+        help="Preset of the settings below; cpu_throughput turns on bf16, "
+             "gradient checkpointing and a global batch of 32"
+    )
+    parser.add_argument(
+        "--bf16",
+        action="store_true",
+        default=os.getenv("BF16", "false").lower() == "true",
+        help="Run forward and backward under bf16 autocast"
+    )
+    parser.add_argument(
+        "--gradient_checkpointing",
+        action="store_true",
+        default=os.getenv("GRADIENT_CHECKPOINTING", "false").lower() == "true",
+        help="Recompute activations in the backward pass instead of keeping them"
+    )
+    parser.add_argument(
+        "--global_batch_size",
+        type=int,
+        default=int(os.getenv("GLOBAL_BATCH_SIZE", 0)),
+        help="Sequences per optimizer step across ranks, reached by gradient "
+             "accumulation (0 = batch_size x ranks)"
+    )
+    parser.add_argument(
+        "--torch_compile",
+        action="store_true",
+        default=os.getenv("TORCH_COMPILE", "false").lower() == "true",
+        help="Compile the model with torch.compile"
+    )
+    parser.add_argument(
+        "--num_threads",
+        type=int,
+        default=int(os.getenv("TORCH_NUM_THREADS", 0)),
+        help="Intra-op threads per rank (0 = usable cores / local ranks)"
+    )
+    parser.add_argument(
+        "--num_interop_threads",
+        type=int,
+        default=int(os.getenv("TORCH_NUM_INTEROP_THREADS", 0)),
+        help="Inter-op threads per rank (0 = torch default)"
+    )
+    parser.add_argument(
+        "--cpu_affinity",
+        type=str,
+        default=os.getenv("CPU_AFFINITY"),
+        help="CPUs to pin training to, e.g. 0-15 or 0-7,16-23"
+    )
+    parser.add_argument(
+        "--lora",
+        action="store_true",
+        default=os.getenv("LORA", "false").lower() == "true",
+        help="Train LoRA adapters on a frozen base model and register only the adapter"
+    )
+    parser.add_argument(
+        "--lora_rank",
+        type=int,
+        default=int(os.getenv("LORA_RANK", 8)),
+        help="Rank of the LoRA update matrices"
+    )
+    parser.add_argument(
+        "--lora_alpha",
+        type=int,
+        default=int(os.getenv("LORA_ALPHA", 16)),
+        help="LoRA scaling (updates are scaled by alpha / rank)"
+    )
+    parser.add_argument(
+        "--lora_dropout",
+        type=float,
+        default=float(os.getenv("LORA_DROPOUT", 0.05)),
+        help="Dropout on the LoRA branch"
+    )
+    parser.add_argument(
+        "--lora_target_modules",
+        type=str,
+        default=os.getenv("LORA_TARGET_MODULES", DEFAULT_TARGET_MODULES),
+        help="Comma-separated module names to adapt, or all-linear"
+    )
+    args = parser.parse_args()
+    apply_profile(args)
+    if args.streaming and args.max_steps <= 0:
+        parser.error("--streaming needs --max_steps: a stream has no length to count epochs by")
+    return args
 
 
 def setup_logging():
@@ -68,67 +260,244 @@ def setup_logging():
     logging.info("Logger initialized")
 
 
+def _prepare_dataset(args, tokenizer):
+    """
+    Load the raw dataset and tokenize it: a cached, pre-tokenized Dataset
+    plus its tokenization metadata, or a StreamingTextDataset (and None).
+    """
+    raw_dataset = load_data(
+        args.dataset_name,
+        args.dataset_config,
+        revision=args.dataset_revision,
+        streaming=args.streaming
+    )
+    if args.streaming:
+        # Tokenized (and packed) on the fly by each dataloader worker
+        tokenized = StreamingTextDataset(
+            raw_dataset,
+            tokenizer,
+            max_length=args.block_size,
+            packing=args.packing,
+            separate_documents=args.separate_documents,
+            shuffle_buffer=args.shuffle_buffer,
+            seed=args.seed
+        )
+        return tokenized, None
+
+    logging.info(f"Loaded dataset {args.dataset_name}/{args.dataset_config} with {len(raw_dataset)} records")
+    # Preprocess (tokenize + pack or chunk, drop unused cols); cached on disk
+    tokenized, tokenization = tokenize_dataset(
+        raw_dataset,
+        tokenizer,
+        cache_dir=args.tokenized_cache_dir,
+        max_length=args.block_size,
+        packing=args.packing,
+        separate_documents=args.separate_documents,
+        num_proc=args.num_proc or None,
+        dataset_revision=args.dataset_revision
+    )
+    logging.info("Dataset tokenized")
+    return tokenized, tokenization
+
+
 def main():
     args = parse_args()
     setup_logging()
+    # Before anything starts torch's thread pools
+    configure_threads(args.num_threads, args.num_interop_threads, args.cpu_affinity)
 
-    # MLflow setup
-    mlflow_uri = os.getenv("MLFLOW_TRACKING_URI", "http://localhost:5000")
-    mlflow.set_tracking_uri(mlflow_uri)
-    exp_name = os.getenv("MLFLOW_EXPERIMENT", "FluxPilot_Granite")
-    mlflow.set_experiment(exp_name)
-    logging.info(f"MLflow URI={mlflow_uri}, experiment={exp_name}")
+    # MLflow setup; with several ranks only rank 0 talks to MLflow
+    if is_main_process():
+        mlflow_uri = os.getenv("MLFLOW_TRACKING_URI", "http://localhost:5000")
+        mlflow.set_tracking_uri(mlflow_uri)
+        exp_name = os.getenv("MLFLOW_EXPERIMENT", "FluxPilot_Granite")
+        mlflow.set_experiment(exp_name)
+        logging.info(f"MLflow URI={mlflow_uri}, experiment={exp_name}")
 
-    # Load raw dataset
-    raw_dataset = load_data(args.dataset_name, args.dataset_config)
-    logging.info(f"Loaded dataset {args.dataset_name}/{args.dataset_config} with {len(raw_dataset)} records")
+    if args.resume_from_checkpoint == "latest":
+        args.resume_from_checkpoint = latest_checkpoint(args.output_dir)
+        logging.info(f"Resuming from {args.resume_from_checkpoint or 'scratch: no checkpoint found'}")
 
-    # Initialize tokenizer & model
-    tokenizer = AutoTokenizer.from_pretrained(args.model_name)
-    model = AutoModelForCausalLM.from_pretrained(args.model_name)
-    logging.info(f"Loaded model & tokenizer from {args.model_name}")
-
-    # Preprocess (tokenize + chunk, drop unused cols)
-    tokenized = raw_dataset.map(
-        lambda examples: preprocess_function(examples, tokenizer),
-        batched=True,
-        remove_columns=raw_dataset.column_names
-    )
-    logging.info("Dataset tokenized")
+    if args.streaming:
+        # No epochs to count; the stream resumes itself
+        schedule = {
+            "max_steps": args.max_steps,
+            "ignore_data_skip": True,
+        }
+    else:
+        schedule = {
+            "train_sampling_strategy": "random" if args.packing else args.sampling,
+            "num_train_epochs": args.epochs,
+            "max_steps": args.max_steps,
+        }
 
     # TrainingArguments with MLflow integration
     training_args = TrainingArguments(
         output_dir=args.output_dir,
-        num_train_epochs=args.epochs,
         per_device_train_batch_size=args.batch_size,
+        gradient_accumulation_steps=accumulation_steps(
+            args.global_batch_size, args.batch_size, world_size()
+        ),
+        # Under torchrun, one CPU rank per process with gradients all-reduced
+        ddp_backend=DDP_BACKEND if world_size() > 1 else None,
+        bf16=args.bf16,
+        # CPU bf16 autocast is only accepted when the CPU is requested explicitly
+        use_cpu=not torch.cuda.is_available(),
+        gradient_checkpointing=args.gradient_checkpointing,
+        torch_compile=args.torch_compile,
+        seed=args.seed,
+        # Step checkpoints, written in the background by CheckpointingTrainer
+        save_strategy="steps",
+        save_steps=args.save_steps,
+        save_total_limit=args.save_total_limit or None,
         logging_dir="./logs",
         logging_steps=50,
-        evaluation_strategy="epoch",
-        save_strategy="epoch",
-        load_best_model_at_end=True,
-        metric_for_best_model="loss",
-        report_to=["mlflow"]
+        # Logged throughput (train_tokens_per_second) counts real tokens only
+        include_num_input_tokens_seen="non_padding",
+        # collate_padded picks its fields itself and needs "length" kept for
+        # the length-grouped sampler
+        remove_unused_columns=args.packing,
+        report_to=["mlflow"],
+        **schedule
     )
 
-    trainer = Trainer(
+    # Initialize tokenizer & model
+    tokenizer = AutoTokenizer.from_pretrained(args.model_name)
+    model = AutoModelForCausalLM.from_pretrained(args.model_name)
+    logging.info(f"Loaded model & tokenizer from {args.model_name}")
+    if args.lora:
+        model = apply_lora(
+            model,
+            rank=args.lora_rank,
+            alpha=args.lora_alpha,
+            dropout=args.lora_dropout,
+            target_modules=args.lora_target_modules,
+            gradient_checkpointing=args.gradient_checkpointing
+        )
+    parameters = parameter_counts(model)
+
+    # Rank 0 downloads and tokenizes first; the other ranks then load the
+    # same files from the HF and tokenization caches
+    with training_args.main_process_first(desc="dataset loading and tokenization"):
+        tokenized, tokenization = _prepare_dataset(args, tokenizer)
+
+    padding = None
+    if not args.packing:
+        # Windows vary in length: pad each batch only to its longest one
+        data_collator = functools.partial(
+            collate_padded,
+            pad_token_id=tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id,
+            pad_to_multiple_of=args.pad_to_multiple_of or None
+        )
+        if not args.streaming:
+            padding = padding_report(
+                tokenized["length"],
+                args.batch_size,
+                max_length=args.block_size,
+                pad_to_multiple_of=args.pad_to_multiple_of or None,
+                seed=args.seed
+            )
+            logging.info(
+                f"Padding per epoch: {padding['fixed']:.1%} of slots padded to block_size, "
+                f"{padding['random']:.1%} with random batches, {padding['grouped']:.1%} grouped "
+                f"by length; sampling={args.sampling}"
+            )
+    elif args.separate_documents:
+        data_collator = collate_packed
+    else:
+        data_collator = None
+
+    if args.streaming and args.resume_from_checkpoint:
+        with open(os.path.join(args.resume_from_checkpoint, "trainer_state.json")) as f:
+            global_step = json.load(f)["global_step"]
+        tokenized.resume(
+            global_step * training_args.gradient_accumulation_steps,
+            args.batch_size
+        )
+
+    trainer_class = StreamingTrainer if args.streaming else CheckpointingTrainer
+    trainer = trainer_class(
         model=model,
         args=training_args,
-        train_dataset=tokenized
+        train_dataset=tokenized,
+        data_collator=data_collator
     )
 
+    if not trainer.is_world_process_zero():
+        # Other ranks train in lockstep with rank 0 (gradients are
+        # all-reduced every step) but leave logging and registration to it
+        trainer.train(resume_from_checkpoint=args.resume_from_checkpoint)
+        if args.lora:
+            trainer.save_model(os.path.join(args.output_dir, "adapter"))
+        return
+
     # Run training under MLflow
     with mlflow.start_run(run_name="granite_finetune") as run:
         mlflow.pytorch.autolog()               # auto-log all params/metrics/artifacts
-        trainer.train()
+        result = trainer.train(resume_from_checkpoint=args.resume_from_checkpoint)
+        mlflow.log_metrics({
+            "samples_per_second": result.metrics["train_samples_per_second"],
+            "tokens_per_second": result.metrics.get("train_tokens_per_second", 0.0),
+            "peak_rss_mb": peak_rss_mb(),
+        })
         mlflow.log_params({
             "epochs": args.epochs,
             "batch_size": args.batch_size,
-            "model_name": args.model_name
+            "model_name": args.model_name,
+            "packing": args.packing,
+            "block_size": args.block_size,
+            "separate_documents": args.separate_documents,
+            "streaming": args.streaming,
+            "max_steps": args.max_steps,
+            "seed": args.seed,
+            "perf_profile": args.perf_profile,
+            "bf16": args.bf16,
+            "gradient_checkpointing": args.gradient_checkpointing,
+            "gradient_accumulation_steps": training_args.gradient_accumulation_steps,
+            "torch_compile": args.torch_compile,
+            "num_threads": torch.get_num_threads(),
+            "cpu_affinity": args.cpu_affinity,
+            "world_size": world_size(),
         })
+        if args.streaming:
+            mlflow.log_param("shuffle_buffer", args.shuffle_buffer)
+        else:
+            mlflow.log_param("tokenization_cache_key", tokenization["cache_key"])
+            mlflow.log_metrics({
+                "tokenization_cache_hit": float(tokenization["cache_hit"]),
+                "train_tokens": tokenization["tokens"],
+            })
+        if padding is not None:
+            mlflow.log_param("sampling", args.sampling)
+            mlflow.log_metrics({
+                "padding_ratio": padding["grouped" if args.sampling == "group_by_length" else "random"],
+                "padding_ratio_fixed": padding["fixed"],
+            })
+        if args.packing and not args.streaming:
+            mlflow.log_metrics({
+                "packing_efficiency": tokenization["packing_efficiency"],
+                "unpacked_efficiency": tokenization["unpacked_efficiency"],
+                "packed_blocks": tokenization["blocks"]
+            })
+
+        mlflow.log_metrics(parameters)
+        if args.lora:
+            mlflow.log_params({
+                "lora_rank": args.lora_rank,
+                "lora_alpha": args.lora_alpha,
+                "lora_dropout": args.lora_dropout,
+                "lora_target_modules": args.lora_target_modules,
+            })
+            # Adapter weights and config only (plus the tokenizer); serving
+            # loads them on top of the base model named in adapter_config.json
+            adapter_dir = os.path.join(args.output_dir, "adapter")
+            trainer.save_model(adapter_dir)
+            tokenizer.save_pretrained(adapter_dir)
+            mlflow.log_artifacts(adapter_dir, artifact_path="adapter")
 
         # Register the best model in MLflow Model Registry
         run_id = run.info.run_id
-        model_uri = f"runs:/{run_id}/model"
+        model_uri = f"runs:/{run_id}/{'adapter' if args.lora else 'model'}"
         mlflow.register_model(model_uri, "FluxPilot_Granite")
         logging.info(f"Registered model 'FluxPilot_Granite' from run {run_id}")
 